@@ -2,6 +2,8 @@
 ASGI config for base project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP goes to Django; websocket connections are routed by path to the
+streaming handlers below.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/6.0/howto/deployment/asgi/
@@ -13,4 +15,21 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'base.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once the app registry is ready
+from base.websocket import websocket_router  # noqa: E402
+from servers.driver.stream import driver_location_stream  # noqa: E402
+from servers.rider.stream import nearby_driver_feed  # noqa: E402
+
+websocket_application = websocket_router({
+    '/ws/driver/location/': driver_location_stream,
+    '/ws/rider/nearby/': nearby_driver_feed,
+})
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        await websocket_application(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
@@ -0,0 +1,171 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    Thread-safe in-process LRU cache with per-entry expiry.
+
+    Args:
+        maxsize: Maximum number of entries kept
+        ttl: Default time to live in seconds
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Return a live entry, or default if it is missing or expired.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """
+        Returns:
+            dict: Hit and miss counters and current size
+        """
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._data)}
+
+
+class SingleFlight:
+    """
+    Collapse concurrent calls for the same key into one.
+
+    The first caller for a key runs the function; callers arriving while it
+    runs wait for it and share its result (or exception).
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {"done": threading.Event()}
+        if not leader:
+            call["done"].wait()
+            if "error" in call:
+                raise call["error"]
+            return call["result"]
+        try:
+            call["result"] = fn()
+            return call["result"]
+        except BaseException as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call["done"].set()
+
+
+class TwoTierCache:
+    """
+    In-process LRU in front of the shared Django cache.
+
+    Reads try this process first, then Redis through ``django.core.cache``;
+    Redis hits are copied into the local tier. Redis errors are logged and
+    treated as misses so a cache outage never fails the caller.
+
+    Args:
+        prefix: Namespace prepended to every shared-cache key
+        maxsize: Maximum number of entries kept in process
+        local_ttl: Time to live of in-process entries in seconds
+        remote_ttl: Time to live of shared-cache entries in seconds
+    """
+
+    def __init__(self, prefix, maxsize, local_ttl, remote_ttl):
+        self.prefix = prefix
+        self.remote_ttl = remote_ttl
+        self.local = LRUCache(maxsize, local_ttl)
+        self.remote_hits = 0
+        self.remote_misses = 0
+
+    def _key(self, key):
+        return f'{self.prefix}:{key}'
+
+    def get(self, key, default=None):
+        value = self.local.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        try:
+            value = cache.get(self._key(key), _MISSING)
+        except Exception as e:
+            logger.warning(f"Shared cache read failed for {self.prefix}: {str(e)}")
+            value = _MISSING
+        if value is _MISSING:
+            self.remote_misses += 1
+            return default
+        self.remote_hits += 1
+        self.local.set(key, value)
+        return value
+
+    def set(self, key, value):
+        self.local.set(key, value)
+        try:
+            cache.set(self._key(key), value, self.remote_ttl)
+        except Exception as e:
+            logger.warning(f"Shared cache write failed for {self.prefix}: {str(e)}")
+
+    def delete(self, key):
+        self.local.delete(key)
+        try:
+            cache.delete(self._key(key))
+        except Exception as e:
+            logger.warning(f"Shared cache delete failed for {self.prefix}: {str(e)}")
+
+    def stats(self):
+        """
+        Returns:
+            dict: Hit and miss counters for both tiers
+        """
+        local = self.local.stats()
+        return {
+            "local_hits": local["hits"],
+            "local_size": local["size"],
+            "remote_hits": self.remote_hits,
+            "misses": self.remote_misses,
+        }
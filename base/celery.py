@@ -4,4 +4,5 @@ from django.conf import settings
 os.environ.setdefault('DJANGO_SETTINGS_MODULE','base.settings')
 app=Celery('base')
 
-app.config_from_object(settings,namespace='CELERY')
\ No newline at end of file
+app.config_from_object(settings,namespace='CELERY')
+app.autodiscover_tasks()
\ No newline at end of file
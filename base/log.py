@@ -0,0 +1,160 @@
+import os
+import json
+import queue
+import atexit
+import random
+import logging
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# LogRecord attributes that are not user supplied ``extra`` fields
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line.
+
+    Every record carries ts, level, logger and msg; exceptions add exc, and
+    any ``extra={...}`` fields passed to the logging call are added as-is.
+    """
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep a fraction of the records below WARNING, per logger.
+
+    Args:
+        rates: Mapping of logger name to the fraction of records kept, or a
+            "logger=rate,..." string. A rate applies to the logger and its
+            children; the most specific name wins. Loggers without a rate
+            keep everything.
+    """
+
+    def __init__(self, rates=None):
+        super().__init__()
+        if isinstance(rates, str):
+            rates = parse_sample_rates(rates)
+        self.rates = dict(rates or {})
+        self._resolved = {}
+
+    def _rate(self, name):
+        rate = self._resolved.get(name)
+        if rate is None:
+            rate, prefix = 1.0, name
+            while prefix:
+                if prefix in self.rates:
+                    rate = self.rates[prefix]
+                    break
+                prefix = prefix.rpartition('.')[0]
+            self._resolved[name] = rate
+        return rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate(record.name)
+        return rate >= 1 or random.random() < rate
+
+
+class AsyncStreamHandler(QueueHandler):
+    """
+    Non-blocking handler: callers only enqueue the record and a background
+    QueueListener formats and writes it to stderr.
+
+    Records are dropped, not waited on, if the queue is full. The listener
+    is restarted in forked worker processes, where the parent's thread does
+    not exist.
+
+    Args:
+        maxsize: Records buffered before new ones are dropped
+    """
+
+    def __init__(self, maxsize=10000):
+        super().__init__(queue.Queue(maxsize))
+        self.target = logging.StreamHandler()
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+        atexit.register(self.stop)
+
+    def setFormatter(self, fmt):
+        # Formatting happens on the listener thread, not the caller's
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # Resolve the message and traceback now, since args may change after
+        # the call returns, but leave the formatting to the listener
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def emit(self, record):
+        if self._pid != os.getpid():
+            self._start()
+        super().emit(record)
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                # Forked: records queued by the parent are the parent's to write
+                self.queue = queue.Queue(self.queue.maxsize)
+            self._listener = QueueListener(self.queue, self.target, respect_handler_level=False)
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def stop(self):
+        with self._lock:
+            if self._listener is not None and self._pid == os.getpid():
+                try:
+                    self._listener.stop()
+                except queue.Full:
+                    pass
+            self._listener = None
+            self._pid = None
+
+
+def parse_sample_rates(value):
+    """
+    Parse "logger=rate,logger=rate" into a dict.
+
+    Args:
+        value: Comma separated logger=rate pairs, rates between 0 and 1
+
+    Returns:
+        dict: Logger name to rate
+    """
+    rates = {}
+    for pair in filter(None, (p.strip() for p in value.split(','))):
+        name, _, rate = pair.partition('=')
+        rates[name.strip()] = min(max(float(rate), 0.0), 1.0)
+    return rates
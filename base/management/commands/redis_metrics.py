@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from base.redis_metrics import TOGGLE_KEY
+
+
+class Command(BaseCommand):
+    help = (
+        "Switch per-command Redis metrics and the slow-command log on or off "
+        "for every process. Changes apply within REDIS_METRICS_POLL_INTERVAL."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['on', 'off', 'status', 'reset'],
+                            help="reset falls back to REDIS_METRICS_ENABLED/REDIS_SLOW_COMMAND_MS")
+        parser.add_argument('--slow-ms', type=float, default=None,
+                            help="Log commands at least this slow (default: REDIS_SLOW_COMMAND_MS)")
+
+    def handle(self, *args, **options):
+        action = options['action']
+        config = cache.get(TOGGLE_KEY)
+        if action == 'reset':
+            cache.delete(TOGGLE_KEY)
+            config = None
+        elif action in ('on', 'off'):
+            slow_ms = options['slow_ms']
+            if slow_ms is None:
+                slow_ms = (config or {}).get('slow_ms', settings.REDIS_SLOW_COMMAND_MS)
+            config = {'enabled': action == 'on', 'slow_ms': slow_ms}
+            cache.set(TOGGLE_KEY, config, None)
+
+        if config is None:
+            config = {'enabled': settings.REDIS_METRICS_ENABLED, 'slow_ms': settings.REDIS_SLOW_COMMAND_MS}
+            source = 'settings'
+        else:
+            source = 'runtime'
+        state = 'on' if config['enabled'] else 'off'
+        self.stdout.write(f"Redis command metrics {state}, slow threshold {config['slow_ms']} ms ({source})")
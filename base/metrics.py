@@ -0,0 +1,262 @@
+import time
+import threading
+from contextvars import ContextVar
+
+# Sub-buckets per power of two: values are kept within 1/16 (6.25%)
+SUB_BUCKET_BITS = 4
+_SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+_MAX_VALUE = (1 << 40) - 1
+
+# Upper bounds of the exported Prometheus buckets, in seconds
+EXPORT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+# Upper bounds of the exported Prometheus buckets for sizes, in bytes
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+class Histogram:
+    """
+    HDR-style log-linear histogram.
+
+    Values are scaled to integers (microseconds for durations) and recorded
+    into buckets that split every power of two into 16 linear steps, so any
+    recorded value is known to within 6.25% while the histogram stays a few
+    hundred integers at most. Recording is a couple of integer operations
+    under a lock.
+
+    Args:
+        scale: Multiplier turning recorded values into integer units
+        buckets: Upper bounds exported to Prometheus, in recorded units
+    """
+
+    def __init__(self, scale=1e6, buckets=EXPORT_BUCKETS):
+        self.scale = scale
+        self.buckets = buckets
+        self.count = 0
+        self.total = 0.0
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _index(value):
+        if value < 2 * _SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - SUB_BUCKET_BITS - 1
+        return shift * _SUB_BUCKETS + (value >> shift)
+
+    @staticmethod
+    def _lower_bound(index):
+        if index < 2 * _SUB_BUCKETS:
+            return index
+        shift = index // _SUB_BUCKETS - 1
+        return (index - shift * _SUB_BUCKETS) << shift
+
+    def record(self, value):
+        index = self._index(min(max(int(value * self.scale), 0), _MAX_VALUE))
+        with self._lock:
+            self.count += 1
+            self.total += value
+            self._counts[index] = self._counts.get(index, 0) + 1
+
+    def _sorted_counts(self):
+        with self._lock:
+            return sorted(self._counts.items()), self.count, self.total
+
+    def quantile(self, q):
+        """
+        Returns:
+            float: Value at quantile q (0-1), or 0.0 when empty
+        """
+        counts, count, _ = self._sorted_counts()
+        if not count:
+            return 0.0
+        rank, seen = q * count, 0
+        for index, n in counts:
+            seen += n
+            if seen >= rank:
+                break
+        # Midpoint of the bucket halves the worst-case error
+        return (self._lower_bound(index) + self._lower_bound(index + 1)) / (2 * self.scale)
+
+    def cumulative(self):
+        """
+        Returns:
+            tuple: ([count <= bound for each export bucket], count, sum)
+        """
+        counts, count, total = self._sorted_counts()
+        cumulative, seen, i = [], 0, 0
+        for bound in self.buckets:
+            limit = bound * self.scale
+            while i < len(counts) and self._lower_bound(counts[i][0]) <= limit:
+                seen += counts[i][1]
+                i += 1
+            cumulative.append(seen)
+        return cumulative, count, total
+
+
+class Registry:
+    """
+    Process-local store of histograms and counters keyed by metric name and
+    label values.
+
+    Each worker process keeps its own registry; scrape every worker or run
+    one worker per metrics target.
+    """
+
+    def __init__(self):
+        self._histograms = {}
+        self._counters = {}
+        self._help = {}
+        self._shapes = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name, text, scale=1e6, buckets=EXPORT_BUCKETS):
+        """
+        Set a metric's help text and, for histograms, its scale and export
+        buckets (durations in seconds by default).
+        """
+        self._help[name] = text
+        self._shapes[name] = (scale, buckets)
+
+    def histogram(self, name, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = Histogram(*self._shapes.get(name, ()))
+        return histogram
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def histograms(self):
+        with self._lock:
+            return dict(self._histograms)
+
+    def counters(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def help(self, name):
+        return self._help.get(name, name)
+
+
+registry = Registry()
+
+
+class RequestStats:
+    """
+    Database and Redis work done while serving one request.
+    """
+
+    __slots__ = ('db_queries', 'db_time', 'redis_commands', 'redis_time')
+
+    def __init__(self):
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.redis_commands = 0
+        self.redis_time = 0.0
+
+
+_request_stats = ContextVar('request_stats', default=None)
+
+
+def start_request():
+    """
+    Begin collecting RequestStats for the current context.
+
+    Returns:
+        tuple: (stats, token to pass to finish_request)
+    """
+    stats = RequestStats()
+    return stats, _request_stats.set(stats)
+
+
+def finish_request(token):
+    _request_stats.reset(token)
+
+
+def record_db(seconds):
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.db_queries += 1
+        stats.db_time += seconds
+
+
+def record_redis(commands, seconds):
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.redis_commands += commands
+        stats.redis_time += seconds
+
+
+def db_execute_wrapper(execute, sql, params, many, context):
+    """
+    connection.execute_wrapper hook timing every query.
+    """
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        record_db(time.perf_counter() - start)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+def render_prometheus(gauges=None, counters=None):
+    """
+    Render the registry in the Prometheus text exposition format.
+
+    Args:
+        gauges: Optional mapping of metric name to value appended as gauges
+        counters: Optional mapping of metric name to a monotonic total kept
+            outside the registry, appended as counters
+
+    Returns:
+        str: Exposition text
+    """
+    lines = []
+    by_name = {}
+    for (name, labels), histogram in registry.histograms().items():
+        by_name.setdefault(name, []).append((labels, histogram))
+    for name in sorted(by_name):
+        lines.append(f'# HELP {name} {registry.help(name)}')
+        lines.append(f'# TYPE {name} histogram')
+        for labels, histogram in sorted(by_name[name], key=lambda item: item[0]):
+            cumulative, count, total = histogram.cumulative()
+            for bound, seen in zip(histogram.buckets, cumulative):
+                lines.append(f'{name}_bucket{_labels(labels + (("le", bound),))} {seen}')
+            lines.append(f'{name}_bucket{_labels(labels + (("le", "+Inf"),))} {count}')
+            lines.append(f'{name}_sum{_labels(labels)} {total}')
+            lines.append(f'{name}_count{_labels(labels)} {count}')
+
+    by_name = {}
+    for (name, labels), value in registry.counters().items():
+        by_name.setdefault(name, []).append((labels, value))
+    for name in sorted(by_name):
+        lines.append(f'# HELP {name} {registry.help(name)}')
+        lines.append(f'# TYPE {name} counter')
+        for labels, value in sorted(by_name[name]):
+            lines.append(f'{name}{_labels(labels)} {value}')
+
+    for name, value in sorted((counters or {}).items()):
+        lines.append(f'# TYPE {name} counter')
+        lines.append(f'{name} {value}')
+
+    for name, value in sorted((gauges or {}).items()):
+        lines.append(f'# TYPE {name} gauge')
+        lines.append(f'{name} {value}')
+    return '\n'.join(lines) + '\n'
@@ -1,5 +1,9 @@
+import time
+from contextlib import ExitStack
+from django.db import connections
 from django.http import JsonResponse
 import logging
+from base import metrics
 
 logger = logging.getLogger(__name__)
 
@@ -13,4 +17,52 @@ class ExceptionHandlingMiddleware:
     def process_exception(self, request, exception):
         logger.error(f"Unhandled exception: {exception}", exc_info=True)
 
-        return JsonResponse({'error': f'An unexpected error occurred.{exception}'}, status=404)
\ No newline at end of file
+        return JsonResponse({'error': f'An unexpected error occurred.{exception}'}, status=404)
+
+metrics.registry.describe('http_request_duration_seconds', 'Wall time per request')
+metrics.registry.describe('http_request_db_seconds', 'Database time per request')
+metrics.registry.describe('http_request_redis_seconds', 'Redis time per request')
+metrics.registry.describe('http_requests_total', 'Requests served')
+metrics.registry.describe('http_request_db_queries_total', 'Database queries run by requests')
+metrics.registry.describe('http_request_redis_commands_total', 'Redis commands sent by requests')
+
+
+class InstrumentationMiddleware:
+    """
+    Record wall time, database queries and Redis commands per request into
+    histograms labelled by the resolved URL name (or route pattern).
+
+    Place it first so its timing covers the rest of the middleware stack.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats, token = metrics.start_request()
+        start = time.perf_counter()
+        status = 500
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics.db_execute_wrapper))
+                response = self.get_response(request)
+            status = response.status_code
+            return response
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.finish_request(token)
+            self._record(request, status, elapsed, stats)
+
+    def _record(self, request, status, elapsed, stats):
+        match = request.resolver_match
+        view = (match.url_name or match.route) if match is not None else 'unmatched'
+        registry = metrics.registry
+        registry.histogram('http_request_duration_seconds', view=view, method=request.method).record(elapsed)
+        registry.inc('http_requests_total', view=view, method=request.method, status=status)
+        if stats.db_queries:
+            registry.histogram('http_request_db_seconds', view=view).record(stats.db_time)
+            registry.inc('http_request_db_queries_total', stats.db_queries, view=view)
+        if stats.redis_commands:
+            registry.histogram('http_request_redis_seconds', view=view).record(stats.redis_time)
+            registry.inc('http_request_redis_commands_total', stats.redis_commands, view=view)
@@ -0,0 +1,193 @@
+import re
+import time
+import logging
+import threading
+import redis
+from django.conf import settings
+from django.core.cache import cache
+from base import metrics
+
+logger = logging.getLogger(__name__)
+
+# Cache key holding the runtime hook switch: {"enabled": bool, "slow_ms": float}
+TOGGLE_KEY = 'redis_metrics:config'
+
+# django-redis prepends ":<version>:" to every cache key
+_VERSION_PREFIX = re.compile(r'^:\d+:')
+_VARIABLE_PART = re.compile(r'\d.*')
+# Scripts name their keys after the key count: EVALSHA sha numkeys key ...
+_SCRIPT_COMMANDS = {'EVAL', 'EVALSHA', 'EVAL_RO', 'EVALSHA_RO', 'FCALL', 'FCALL_RO'}
+_KEYLESS_COMMANDS = {'PING', 'INFO', 'SCRIPT', 'CLIENT', 'CONFIG', 'SLOWLOG', 'FLUSHDB', 'DBSIZE', 'TIME'}
+
+metrics.registry.describe('redis_command_duration_seconds', 'Client-side time per Redis command or pipeline')
+metrics.registry.describe(
+    'redis_reply_bytes', 'Approximate decoded size of Redis replies',
+    scale=1, buckets=metrics.SIZE_BUCKETS,
+)
+metrics.registry.describe('redis_pipelined_commands_total', 'Commands sent inside pipelines')
+metrics.registry.describe('redis_slow_commands_total', 'Commands slower than the slow-command threshold')
+
+_prefixes = []
+_prefixes_lock = threading.Lock()
+
+
+def register_key_prefixes(*prefixes):
+    """
+    Declare key namespaces so per-command metrics group keys by them
+    instead of by the full key. The longest matching prefix wins; keys
+    that match none are grouped by their first segment.
+    """
+    global _prefixes
+    with _prefixes_lock:
+        _prefixes = sorted(set(_prefixes) | set(prefixes), key=len, reverse=True)
+
+
+def key_prefix(key):
+    """
+    Returns:
+        str: Registered namespace of a key, or its first segment with any
+        variable (numeric) tail replaced by "*"
+    """
+    if key is None:
+        return '-'
+    if isinstance(key, bytes):
+        key = key.decode(errors='replace')
+    key = _VERSION_PREFIX.sub('', str(key))
+    for prefix in _prefixes:
+        if key.startswith(prefix):
+            return prefix
+    return _VARIABLE_PART.sub('*', key.split(':', 1)[0])
+
+
+def _command_key(args):
+    name = str(args[0]).upper()
+    if name in _SCRIPT_COMMANDS:
+        return name, args[3] if len(args) > 3 and int(args[2]) > 0 else None
+    if name in _KEYLESS_COMMANDS or len(args) < 2:
+        return name, None
+    return name, args[1]
+
+
+def _reply_size(reply):
+    if reply is None:
+        return 0
+    if isinstance(reply, (bytes, str)):
+        return len(reply)
+    if isinstance(reply, (list, tuple, set)):
+        return sum(_reply_size(item) for item in reply)
+    if isinstance(reply, dict):
+        return sum(_reply_size(k) + _reply_size(v) for k, v in reply.items())
+    return 8
+
+
+class RedisHooks:
+    """
+    Per-command Redis metrics and slow-command logging, switchable at runtime.
+
+    When enabled, every command is timed into a histogram labelled by
+    command name and key prefix, reply sizes are recorded, and commands at
+    or above the slow threshold are logged. The switch lives in the shared
+    cache under TOGGLE_KEY (see the redis_metrics management command) and
+    each process re-reads it every REDIS_METRICS_POLL_INTERVAL seconds;
+    until set there, REDIS_METRICS_ENABLED and REDIS_SLOW_COMMAND_MS apply.
+    """
+
+    def __init__(self):
+        self.enabled = settings.REDIS_METRICS_ENABLED
+        self.slow_seconds = settings.REDIS_SLOW_COMMAND_MS / 1000
+        self._next_poll = 0.0
+        self._local = threading.local()
+
+    def active(self):
+        now = time.monotonic()
+        if now >= self._next_poll and not getattr(self._local, 'polling', False):
+            self._next_poll = now + settings.REDIS_METRICS_POLL_INTERVAL
+            self._poll()
+        return self.enabled
+
+    def _poll(self):
+        # The toggle read goes through an instrumented client too
+        self._local.polling = True
+        try:
+            config = cache.get(TOGGLE_KEY)
+        except Exception as e:
+            logger.debug("Could not read Redis metrics toggle: %s", e)
+            return
+        finally:
+            self._local.polling = False
+        if config is None:
+            self.enabled = settings.REDIS_METRICS_ENABLED
+            self.slow_seconds = settings.REDIS_SLOW_COMMAND_MS / 1000
+        else:
+            self.enabled = bool(config.get('enabled'))
+            self.slow_seconds = float(config.get('slow_ms', settings.REDIS_SLOW_COMMAND_MS)) / 1000
+
+    def observe(self, name, prefix, elapsed, reply, description):
+        registry = metrics.registry
+        registry.histogram('redis_command_duration_seconds', command=name, prefix=prefix).record(elapsed)
+        size = _reply_size(reply)
+        registry.histogram('redis_reply_bytes', command=name, prefix=prefix).record(size)
+        if elapsed >= self.slow_seconds:
+            registry.inc('redis_slow_commands_total', command=name, prefix=prefix)
+            logger.warning(
+                "Slow Redis command %s on %s: %.1f ms, %d reply bytes",
+                description, prefix, elapsed * 1000, size,
+            )
+
+    def command(self, args, elapsed, reply):
+        name, key = _command_key(args)
+        self.observe(name, key_prefix(key), elapsed, reply, name)
+
+    def pipeline(self, stack, elapsed, replies):
+        names, prefixes = set(), set()
+        for args, _ in stack:
+            name, key = _command_key(args)
+            prefix = key_prefix(key)
+            names.add(name)
+            prefixes.add(prefix)
+            metrics.registry.inc('redis_pipelined_commands_total', command=name, prefix=prefix)
+        # A pipeline of one kind of command is timed under that command
+        name = names.pop() if len(names) == 1 else 'PIPELINE'
+        prefix = prefixes.pop() if len(prefixes) == 1 else 'mixed'
+        self.observe(name, prefix, elapsed, replies, f'{name} x{len(stack)} (pipelined)')
+
+
+hooks = RedisHooks()
+
+
+class InstrumentedPipeline(redis.client.Pipeline):
+    def execute(self, raise_on_error=True):
+        stack = list(self.command_stack)
+        start = time.perf_counter()
+        replies = None
+        try:
+            replies = super().execute(raise_on_error)
+            return replies
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.record_redis(len(stack), elapsed)
+            if stack and hooks.active():
+                hooks.pipeline(stack, elapsed, replies)
+
+
+class InstrumentedRedis(redis.Redis):
+    """
+    Redis client that adds its commands and their time to the current
+    request's stats and, when RedisHooks are enabled, to per-command
+    metrics. Usable as django-redis' REDIS_CLIENT_CLASS.
+    """
+
+    def execute_command(self, *args, **options):
+        start = time.perf_counter()
+        reply = None
+        try:
+            reply = super().execute_command(*args, **options)
+            return reply
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.record_redis(1, elapsed)
+            if hooks.active():
+                hooks.command(args, elapsed, reply)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
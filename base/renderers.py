@@ -0,0 +1,175 @@
+import json
+import struct
+import numpy as np
+from django.utils import timezone
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is in requirements.txt
+    orjson = None
+
+# Envelope fragments around an encoded payload, matching success_response
+_SUCCESS_HEAD = b'{"status":"success","data":'
+_META_HEAD = b',"meta":{"timestamp":'
+_TAIL = b'}}'
+
+# Decimal places kept in compact geo results: ~0.1 m for coordinates, 0.1 m
+# for distances (GEOSEARCH reports 4 places)
+COORD_DECIMALS = 6
+DIST_DECIMALS = 1
+
+# Binary columnar nearby-driver results, see pack_geo_columns
+GEO_COLUMNS_MEDIA_TYPE = 'application/vnd.vahango.nearby-columns'
+GEO_COLUMNS_MAGIC = b'NRBY'
+GEO_COLUMNS_VERSION = 1
+GEO_COLUMNS_RESET = 0x01
+COORD_SCALE = 10 ** COORD_DECIMALS
+DIST_SCALE = 10 ** DIST_DECIMALS
+_GEO_COLUMNS_HEADER = struct.Struct('<4sBBH')
+_GEO_COLUMNS_NEW = struct.Struct('<iB')
+# Largest driver count and member length (bytes) the layout can carry
+GEO_COLUMNS_MAX_COUNT = 0xFFFF
+GEO_COLUMNS_MAX_MEMBER = 0xFF
+
+_encoder = JSONEncoder()
+
+
+def _default(obj):
+    # Types orjson doesn't know (Decimal, lazy strings, querysets, numpy
+    # scalars) are converted the way DRF's JSONEncoder would
+    return _encoder.default(obj)
+
+
+def dumps(data):
+    """
+    Encode data as compact UTF-8 JSON, with orjson when it is installed and
+    the stdlib json module otherwise.
+
+    Returns:
+        bytes: Encoded JSON
+    """
+    if orjson is not None:
+        return orjson.dumps(data, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(data, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def success_envelope(data):
+    """
+    Wrap an encoded payload in the success envelope without re-encoding it.
+
+    Args:
+        data: JSON-encoded payload
+
+    Returns:
+        bytes: Encoded envelope with the current timestamp
+    """
+    return _SUCCESS_HEAD + data + _META_HEAD + dumps(timezone.localtime(timezone.now())) + _TAIL
+
+
+def compact_geo(drivers):
+    """
+    Column-oriented form of nearby_drivers results: one array of ids, one of
+    distances and one flat [lng, lat, lng, lat, ...] array, with numbers
+    rounded to COORD_DECIMALS/DIST_DECIMALS.
+
+    Args:
+        drivers: List of [member, dist, (lng, lat)] results
+
+    Returns:
+        dict: {"ids": [...], "dist": [...], "coords": [...]}, the numbers as
+        numpy arrays that dumps() encodes natively
+    """
+    if not drivers:
+        return {"ids": [], "dist": [], "coords": []}
+    numbers = np.array([(distance, lng, lat) for _, distance, (lng, lat) in drivers], dtype=np.float64)
+    return {
+        "ids": [member for member, *_ in drivers],
+        "dist": np.round(numbers[:, 0], DIST_DECIMALS),
+        "coords": np.round(numbers[:, 1:], COORD_DECIMALS).ravel(),
+    }
+
+
+def pack_geo_columns(drivers, handles, new, reset):
+    """
+    Binary column-oriented form of nearby_drivers results, little-endian:
+
+        header   4s magic b"NRBY", uint8 version, uint8 flags
+                 (bit 0: forget earlier handles), uint16 count n
+        int32[n] driver handles
+        int32[n] longitudes x 10^COORD_DECIMALS
+        int32[n] latitudes x 10^COORD_DECIMALS
+        int32[n] distances x 10^DIST_DECIMALS (metres)
+        uint16 m, then m x (int32 handle, uint8 length, utf-8 member)
+                 for the handles sent for the first time
+
+    The header is 8 bytes, so the columns can be read as Int32Arrays in
+    place.
+
+    Args:
+        drivers: List of [member, dist, (lng, lat)] results
+        handles: Integer handle per driver
+        new: Per driver, whether its handle is sent for the first time
+        reset: Whether the client must drop handles from earlier responses
+
+    Returns:
+        bytes: Packed results
+    
+    Raises:
+        ValueError: If there are more than GEO_COLUMNS_MAX_COUNT drivers or
+            a new member is longer than GEO_COLUMNS_MAX_MEMBER bytes
+    """
+    count = len(drivers)
+    if count > GEO_COLUMNS_MAX_COUNT:
+        raise ValueError(f"At most {GEO_COLUMNS_MAX_COUNT} drivers fit in one response")
+    numbers = np.array(
+        [(lng, lat, distance) for _, distance, (lng, lat) in drivers], dtype=np.float64,
+    ).reshape(count, 3)
+    columns = np.empty((4, count), dtype='<i4')
+    columns[0] = handles
+    columns[1:3] = np.rint(numbers[:, :2].T * COORD_SCALE)
+    columns[3] = np.rint(numbers[:, 2] * DIST_SCALE)
+
+    flags = GEO_COLUMNS_RESET if reset else 0
+    parts = [_GEO_COLUMNS_HEADER.pack(GEO_COLUMNS_MAGIC, GEO_COLUMNS_VERSION, flags, count), columns.tobytes()]
+    fresh = [(handle, member.encode()) for (member, *_), handle, is_new in zip(drivers, handles, new) if is_new]
+    if any(len(member) > GEO_COLUMNS_MAX_MEMBER for _, member in fresh):
+        raise ValueError(f"Driver members must be at most {GEO_COLUMNS_MAX_MEMBER} bytes")
+    parts.append(struct.pack('<H', len(fresh)))
+    for handle, member in fresh:
+        parts.append(_GEO_COLUMNS_NEW.pack(handle, len(member)) + member)
+    return b''.join(parts)
+
+
+class FastJSONRenderer(BaseRenderer):
+    """
+    Drop-in for DRF's JSONRenderer that encodes with dumps(). Opt in per
+    view with @renderer_classes or globally via DEFAULT_RENDERER_CLASSES.
+    """
+    media_type = 'application/json'
+    format = 'json'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return dumps(data)
+
+
+class GeoColumnsRenderer(BaseRenderer):
+    """
+    Renderer for GEO_COLUMNS_MEDIA_TYPE. Views return payloads already
+    packed by pack_geo_columns; anything else (errors) is sent as JSON.
+    """
+    media_type = GEO_COLUMNS_MEDIA_TYPE
+    format = 'columns'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, bytes):
+            return data
+        response = (renderer_context or {}).get('response')
+        if response is not None:
+            response['Content-Type'] = 'application/json'
+        return dumps(data)
@@ -12,6 +12,23 @@ load_dotenv()
 # SECURITY WARNING: keep the secret key used in production secret!
 SECRET_KEY = 'django-insecure-*5(=ti+p9y=gyu0zkoojz$b55meinl-5w*ibm)3mpkm2ybiohh'
 REDIS_URL=os.environ.get('REDIS_URL','redis://redis:6379')
+# geo store connection pool: at most REDIS_MAX_CONNECTIONS, callers wait up
+# to REDIS_POOL_TIMEOUT seconds for a free one; socket timeouts in seconds
+REDIS_MAX_CONNECTIONS=int(os.environ.get('REDIS_MAX_CONNECTIONS',50))
+REDIS_POOL_TIMEOUT=float(os.environ.get('REDIS_POOL_TIMEOUT',2))
+REDIS_SOCKET_TIMEOUT=float(os.environ.get('REDIS_SOCKET_TIMEOUT',1))
+REDIS_CONNECT_TIMEOUT=float(os.environ.get('REDIS_CONNECT_TIMEOUT',1))
+REDIS_HEALTH_CHECK_INTERVAL=int(os.environ.get('REDIS_HEALTH_CHECK_INTERVAL',30))
+# circuit breaker: fail fast after this many consecutive connection errors,
+# probing again after a backoff that doubles up to the max (seconds)
+REDIS_BREAKER_THRESHOLD=int(os.environ.get('REDIS_BREAKER_THRESHOLD',5))
+REDIS_BREAKER_BACKOFF=float(os.environ.get('REDIS_BREAKER_BACKOFF',1))
+REDIS_BREAKER_MAX_BACKOFF=float(os.environ.get('REDIS_BREAKER_MAX_BACKOFF',30))
+# asyncio geo store client used by the websocket handlers: connections are
+# capped and callers wait up to the timeout (seconds) for a free one; socket
+# timeouts, health checks and the circuit breaker are shared with the above
+REDIS_ASYNC_MAX_CONNECTIONS=int(os.environ.get('REDIS_ASYNC_MAX_CONNECTIONS',50))
+REDIS_ASYNC_POOL_TIMEOUT=float(os.environ.get('REDIS_ASYNC_POOL_TIMEOUT',5))
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
 
@@ -30,6 +47,7 @@ INSTALLED_APPS = [
     'rest_framework',
     'rest_framework_simplejwt',
     'corsheaders',
+    'base',
     'servers.auth_user',
     'servers.rider',
     'servers.driver',
@@ -37,6 +55,7 @@ INSTALLED_APPS = [
     
 ]
 MIDDLEWARE = [
+    'base.middleware.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -53,7 +72,7 @@ MIDDLEWARE = [
 ROOT_URLCONF = 'base.urls'
 REST_FRAMEWORK={
     'DEFAULT_AUTHENTICATION_CLASSES':[
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'servers.auth_user.authentication.StatelessJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication'
     ],
     'DEFAULT_PAGINATION_CLASS':'rest_framework.pagination.LimitOffsetPagination',
@@ -65,17 +84,148 @@ SIMPLE_JWT={
     'REFRESH_TOKEN_LIFETIME':timedelta(days=7),
 
 }
+# reject tokens issued before a user's revocation cutoff (role change,
+# deactivation, deletion); cutoffs are cached in process for ttl seconds
+JWT_REVOCATION_CHECK=os.environ.get('JWT_REVOCATION_CHECK','1')=='1'
+JWT_REVOCATION_CACHE_TTL=float(os.environ.get('JWT_REVOCATION_CACHE_TTL',5))
+JWT_REVOCATION_CACHE_SIZE=int(os.environ.get('JWT_REVOCATION_CACHE_SIZE',100000))
 # celery
 CELERY_BROKER_URL=REDIS_URL+'/0'
+CELERY_BEAT_SCHEDULE={
+    'evict-offline-drivers':{
+        'task':'servers.driver.tasks.evict_offline_drivers',
+        'schedule':float(os.environ.get('DRIVER_SWEEP_INTERVAL',30)),
+    },
+    'publish-surge':{
+        'task':'servers.ride.tasks.publish_surge',
+        'schedule':float(os.environ.get('SURGE_INTERVAL',15)),
+    },
+    'dispatch-rides':{
+        'task':'servers.ride.tasks.dispatch_rides',
+        'schedule':float(os.environ.get('DISPATCH_INTERVAL',1)),
+    },
+}
 # cache
 CACHES={
     'default':{
         "BACKEND": "django_redis.cache.RedisCache",
         "LOCATION": REDIS_URL+'/1',
-        "OPTIONS": {"CLIENT_CLASS": "django_redis.client.DefaultClient"}
+        "OPTIONS": {
+            "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            "REDIS_CLIENT_CLASS": "base.redis_metrics.InstrumentedRedis",
+        }
     },
     
 }
+# bearer token required by /metrics (empty = endpoint disabled)
+METRICS_TOKEN=os.environ.get('METRICS_TOKEN','')
+# per-command redis histograms and slow-command log; the redis_metrics
+# management command switches them at runtime, polled every interval seconds
+REDIS_METRICS_ENABLED=os.environ.get('REDIS_METRICS_ENABLED','0')=='1'
+REDIS_SLOW_COMMAND_MS=float(os.environ.get('REDIS_SLOW_COMMAND_MS',10))
+REDIS_METRICS_POLL_INTERVAL=float(os.environ.get('REDIS_METRICS_POLL_INTERVAL',5))
+# geo
+DRIVER_LOCATION_BATCH_MAX=int(os.environ.get('DRIVER_LOCATION_BATCH_MAX',500))
+# geohash length of the cells driver locations are sharded by (0 = single shard)
+GEO_SHARD_PRECISION=int(os.environ.get('GEO_SHARD_PRECISION',4))
+# per-driver state (last fix, owning cell, reservation) is split into this
+# many hash-tagged buckets; changing it orphans existing state
+GEO_OWNER_BUCKETS=int(os.environ.get('GEO_OWNER_BUCKETS',64))
+# drivers without a location fix for this many seconds are evicted by the sweeper
+DRIVER_LOCATION_TTL=int(os.environ.get('DRIVER_LOCATION_TTL',120))
+DRIVER_SWEEP_BATCH=int(os.environ.get('DRIVER_SWEEP_BATCH',1000))
+# client location timestamps may run this many seconds ahead of the server
+# clock; fixes older than DRIVER_LOCATION_TTL are rejected
+DRIVER_LOCATION_MAX_FUTURE=float(os.environ.get('DRIVER_LOCATION_MAX_FUTURE',5))
+# only show riders drivers seen within this many seconds (0 = no filter)
+NEARBY_DRIVERS_MAX_AGE=int(os.environ.get('NEARBY_DRIVERS_MAX_AGE',60))
+# upper bounds on a nearby search, in meters and drivers
+NEARBY_MAX_RADIUS=int(os.environ.get('NEARBY_MAX_RADIUS',50000))
+NEARBY_MAX_COUNT=int(os.environ.get('NEARBY_MAX_COUNT',100))
+# in-process spatial index for nearby-driver queries, synced from redis
+GEO_INDEX_ENABLED=os.environ.get('GEO_INDEX_ENABLED','0')=='1'
+GEO_INDEX_CELL_DEG=float(os.environ.get('GEO_INDEX_CELL_DEG',0.01))
+GEO_INDEX_SYNC_INTERVAL=float(os.environ.get('GEO_INDEX_SYNC_INTERVAL',0.5))
+GEO_INDEX_MAX_STALENESS=float(os.environ.get('GEO_INDEX_MAX_STALENESS',2.0))
+GEO_INDEX_SYNC_BATCH=int(os.environ.get('GEO_INDEX_SYNC_BATCH',1000))
+# approximate length cap of each shard's change stream
+GEO_CHANGES_MAXLEN=int(os.environ.get('GEO_CHANGES_MAXLEN',10000))
+# websocket location stream: latest fix per driver is buffered and written
+# in one batch every flush interval (seconds) or once max batch is pending
+DRIVER_STREAM_FLUSH_INTERVAL=float(os.environ.get('DRIVER_STREAM_FLUSH_INTERVAL',0.2))
+DRIVER_STREAM_MAX_BATCH=int(os.environ.get('DRIVER_STREAM_MAX_BATCH',1000))
+# websocket nearby feed for riders: one computation per (geohash cell,
+# radius bucket) per tick, shared by every subscriber of that key
+NEARBY_FEED_PRECISION=int(os.environ.get('NEARBY_FEED_PRECISION',6))
+NEARBY_FEED_RADII=[int(r) for r in os.environ.get('NEARBY_FEED_RADII','500,1000,2000,5000').split(',')]
+NEARBY_FEED_TICK=float(os.environ.get('NEARBY_FEED_TICK',1.0))
+NEARBY_FEED_MAX_DRIVERS=int(os.environ.get('NEARBY_FEED_MAX_DRIVERS',50))
+# nearby-driver results shared by requests in the same geohash cell with
+# radius and count rounded up to a bucket, for ttl seconds (0 disables)
+NEARBY_CACHE_TTL=float(os.environ.get('NEARBY_CACHE_TTL',1.0))
+NEARBY_CACHE_PRECISION=int(os.environ.get('NEARBY_CACHE_PRECISION',7))
+NEARBY_CACHE_RADII=[int(r) for r in os.environ.get('NEARBY_CACHE_RADII','500,1000,2000,5000').split(',')]
+NEARBY_CACHE_COUNTS=[int(c) for c in os.environ.get('NEARBY_CACHE_COUNTS','10,20,50').split(',')]
+NEARBY_CACHE_OVERFETCH=int(os.environ.get('NEARBY_CACHE_OVERFETCH',2))
+NEARBY_CACHE_SIZE=int(os.environ.get('NEARBY_CACHE_SIZE',10000))
+# per-session driver handles of the binary nearby format: idle expiry in
+# seconds, and handles per session before it starts over
+NEARBY_HANDLE_TTL=int(os.environ.get('NEARBY_HANDLE_TTL',3600))
+NEARBY_HANDLE_MAX=int(os.environ.get('NEARBY_HANDLE_MAX',4096))
+# driver/rider rows per user; other processes see changes within the local ttl
+PROFILE_CACHE_LOCAL_SIZE=int(os.environ.get('PROFILE_CACHE_LOCAL_SIZE',50000))
+PROFILE_CACHE_LOCAL_TTL=int(os.environ.get('PROFILE_CACHE_LOCAL_TTL',30))
+PROFILE_CACHE_TTL=int(os.environ.get('PROFILE_CACHE_TTL',3600))
+# serialized favorite location lists, versioned per rider
+FAVORITES_CACHE_LOCAL_SIZE=int(os.environ.get('FAVORITES_CACHE_LOCAL_SIZE',10000))
+FAVORITES_CACHE_LOCAL_TTL=int(os.environ.get('FAVORITES_CACHE_LOCAL_TTL',300))
+FAVORITES_CACHE_TTL=int(os.environ.get('FAVORITES_CACHE_TTL',7*24*3600))
+# distance matrix results, cached per snapped origin/destination cell pair
+DISTANCE_CACHE_PRECISION=int(os.environ.get('DISTANCE_CACHE_PRECISION',7))
+DISTANCE_CACHE_LOCAL_SIZE=int(os.environ.get('DISTANCE_CACHE_LOCAL_SIZE',10000))
+DISTANCE_CACHE_LOCAL_TTL=int(os.environ.get('DISTANCE_CACHE_LOCAL_TTL',600))
+DISTANCE_CACHE_TTL=int(os.environ.get('DISTANCE_CACHE_TTL',6*3600))
+# distance matrix provider limits per request and concurrent chunk requests
+DISTANCE_MATRIX_MAX_ORIGINS=int(os.environ.get('DISTANCE_MATRIX_MAX_ORIGINS',25))
+DISTANCE_MATRIX_MAX_DESTINATIONS=int(os.environ.get('DISTANCE_MATRIX_MAX_DESTINATIONS',25))
+DISTANCE_MATRIX_MAX_ELEMENTS=int(os.environ.get('DISTANCE_MATRIX_MAX_ELEMENTS',100))
+DISTANCE_MATRIX_CONCURRENCY=int(os.environ.get('DISTANCE_MATRIX_CONCURRENCY',8))
+DISTANCE_MATRIX_TIMEOUT=float(os.environ.get('DISTANCE_MATRIX_TIMEOUT',5))
+# offline ETA model: road/straight-line distance ratio, optionally per region
+# bbox (min_lng, min_lat, max_lng, max_lat), and typical km/h by hour of day
+ETA_DEFAULT_CIRCUITY=float(os.environ.get('ETA_DEFAULT_CIRCUITY',1.35))
+# e.g. {'name':'bengaluru','bbox':(77.35,12.75,77.85,13.20),'circuity':1.4}
+ETA_REGIONS=[]
+ETA_SPEED_BY_HOUR=[
+    32,34,35,35,34,30,26,22,17,15,17,19,
+    20,20,19,18,16,14,13,15,19,23,27,30,
+]
+# fare rate card per Vehicle.vehicle_type (amounts in INR)
+FARE_RATE_CARD={
+    'bike':{'base_fare':20,'per_km':6,'per_min':1,'min_fare':25},
+    'car':{'base_fare':50,'per_km':16,'per_min':2,'min_fare':80},
+    'auto':{'base_fare':30,'per_km':12,'per_min':1.5,'min_fare':40},
+}
+# surge pricing per geohash cell from supply (online drivers) and demand
+# (ride requests over a sliding window of time buckets)
+SURGE_PRECISION=int(os.environ.get('SURGE_PRECISION',5))
+SURGE_WINDOW_SECONDS=int(os.environ.get('SURGE_WINDOW_SECONDS',300))
+SURGE_BUCKET_SECONDS=int(os.environ.get('SURGE_BUCKET_SECONDS',30))
+SURGE_THRESHOLD=float(os.environ.get('SURGE_THRESHOLD',1.0))
+SURGE_SENSITIVITY=float(os.environ.get('SURGE_SENSITIVITY',0.5))
+SURGE_STEP=float(os.environ.get('SURGE_STEP',0.1))
+SURGE_MAX=float(os.environ.get('SURGE_MAX',3.0))
+SURGE_REFRESH_INTERVAL=float(os.environ.get('SURGE_REFRESH_INTERVAL',5))
+# batched dispatch: requests are grouped per geohash cell and matched to
+# drivers once per DISPATCH_INTERVAL window
+DISPATCH_PRECISION=int(os.environ.get('DISPATCH_PRECISION',6))
+DISPATCH_RADIUS=float(os.environ.get('DISPATCH_RADIUS',3000))
+DISPATCH_CANDIDATES=int(os.environ.get('DISPATCH_CANDIDATES',50))
+DISPATCH_RESERVATION_TTL=int(os.environ.get('DISPATCH_RESERVATION_TTL',30))
+DISPATCH_MAX_ATTEMPTS=int(os.environ.get('DISPATCH_MAX_ATTEMPTS',10))
+# rank candidates by road ETA from one distance matrix call per cell instead
+# of the offline ETA model
+DISPATCH_ROAD_ETA=os.environ.get('DISPATCH_ROAD_ETA','0')=='1'
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -129,17 +279,42 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# root log level, output format (json or text) and per-logger sampling of
+# records below WARNING, e.g. "servers.redis=0.01,servers.driver=0.1"
+LOG_LEVEL=os.environ.get('LOG_LEVEL','INFO')
+LOG_FORMAT=os.environ.get('LOG_FORMAT','json')
+LOG_SAMPLE_RATES=os.environ.get('LOG_SAMPLE_RATES','')
+# records buffered for the background log writer before new ones are dropped
+LOG_QUEUE_SIZE=int(os.environ.get('LOG_QUEUE_SIZE',10000))
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
+    'formatters': {
+        'json': {
+            '()': 'base.log.JsonFormatter',
+        },
+        'text': {
+            'format': '%(asctime)s %(levelname)s %(name)s: %(message)s',
+        },
+    },
+    'filters': {
+        'sampling': {
+            '()': 'base.log.SamplingFilter',
+            'rates': LOG_SAMPLE_RATES,
+        },
+    },
     'handlers': {
         'console': {
-            'class': 'logging.StreamHandler',
+            '()': 'base.log.AsyncStreamHandler',
+            'maxsize': LOG_QUEUE_SIZE,
+            'formatter': LOG_FORMAT,
+            'filters': ['sampling'],
         },
     },
     'root': {
         'handlers': ['console'],
-        'level': 'DEBUG',
+        'level': LOG_LEVEL,
     },
 }
 
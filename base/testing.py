@@ -0,0 +1,22 @@
+import unittest
+import redis
+from servers.redis_pool import get_redis_client
+
+
+class RedisTestMixin:
+    """
+    Skip a test case when the geo store Redis is unreachable.
+
+    Tests run against the configured Redis and share it with anything else
+    using it, so they only touch drivers and keys they created themselves
+    and remove them again.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        client = get_redis_client()
+        try:
+            client.ping()
+        except (AttributeError, redis.RedisError):
+            raise unittest.SkipTest("Redis is not reachable")
+        super().setUpClass()
@@ -2,7 +2,9 @@
 from django.contrib import admin
 from django.urls import path,include
 from servers.urls import urlpatterns as api_urls
+from base.views import metrics
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('api/v1/',include(api_urls))
+    path('api/v1/',include(api_urls)),
+    path('metrics',metrics,name='metrics'),
 ]
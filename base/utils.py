@@ -3,11 +3,13 @@ import logging
 import random
 from typing import Dict, Any, Optional
 from django.utils import timezone
+from django.http import HttpResponse
 from rest_framework.response import Response
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from celery import shared_task
 from botocore.exceptions import ClientError, BotoCoreError
+from base.renderers import dumps, success_envelope
 
 logger = logging.getLogger(__name__)
 
@@ -65,6 +67,43 @@ def success_response(data: Any, status_code: int) -> Response:
     )
 
 
+def raw_success_response(data: bytes, status_code: int, headers: Optional[Dict[str, str]] = None) -> HttpResponse:
+    """
+    Generate the success envelope around an already JSON-encoded payload,
+    for cached responses that skip serialization.
+    
+    Args:
+        data: JSON-encoded response payload
+        status_code: HTTP status code
+        headers: Extra response headers
+    
+    Returns:
+        HttpResponse with the same body success_response would render
+    """
+    return HttpResponse(
+        success_envelope(data),
+        status=status_code,
+        content_type='application/json',
+        headers=headers,
+    )
+
+
+def fast_success_response(data: Any, status_code: int, headers: Optional[Dict[str, str]] = None) -> HttpResponse:
+    """
+    Generate the success_response envelope for hot endpoints, encoding the
+    payload with orjson and skipping DRF's renderer.
+    
+    Args:
+        data: Response payload of JSON-native types
+        status_code: HTTP status code
+        headers: Extra response headers
+    
+    Returns:
+        HttpResponse with the same body success_response would render
+    """
+    return raw_success_response(dumps(data), status_code, headers)
+
+
 def error_response(
     code: str,
     message: str,
@@ -0,0 +1,41 @@
+import hmac
+from django.conf import settings
+from django.http import HttpResponse
+from base.metrics import render_prometheus
+from servers.redis_pool import pool_stats
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_BREAKER_STATES = {'closed': 0, 'half_open': 1, 'open': 2}
+
+
+def metrics(request):
+    """
+    Prometheus scrape endpoint: per-view request histograms plus the geo
+    store Redis pool and circuit breaker state of this process.
+
+    Requires ``Authorization: Bearer <METRICS_TOKEN>``; without a
+    METRICS_TOKEN the endpoint is disabled and answers 404.
+    """
+    if not settings.METRICS_TOKEN:
+        return HttpResponse(status=404)
+    supplied = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(supplied, f'Bearer {settings.METRICS_TOKEN}'):
+        return HttpResponse(status=401)
+
+    stats = pool_stats()
+    gauges = {
+        'redis_pool_connections_in_use': stats['in_use'],
+        'redis_pool_waiting': stats['waiting'],
+        'redis_pool_connections_created': stats['created'],
+        'redis_pool_max_connections': stats['max_connections'],
+        'redis_async_pool_connections_in_use': stats['async_in_use'],
+        'redis_async_pool_waiting': stats['async_waiting'],
+        'redis_async_pool_connections_created': stats['async_created'],
+        'redis_async_pool_max_connections': stats['async_max_connections'],
+        'redis_breaker_state': _BREAKER_STATES[stats['breaker']],
+    }
+    counters = {
+        'redis_breaker_opened_total': stats['breaker_opened'],
+    }
+    return HttpResponse(render_prometheus(gauges, counters), content_type=PROMETHEUS_CONTENT_TYPE)
@@ -0,0 +1,143 @@
+import json
+import logging
+from urllib.parse import parse_qs
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+logger = logging.getLogger(__name__)
+
+# Close codes in the application range (4000-4999)
+CLOSE_UNAUTHORIZED = 4401
+CLOSE_FORBIDDEN = 4403
+CLOSE_NOT_FOUND = 4404
+
+
+class WebSocketDisconnect(Exception):
+    pass
+
+
+class WebSocket:
+    """
+    Thin wrapper over an ASGI websocket connection.
+
+    Args:
+        scope: ASGI connection scope
+        receive: ASGI receive callable
+        send: ASGI send callable
+    """
+
+    def __init__(self, scope, receive, send):
+        self.scope = scope
+        self._receive = receive
+        self._send = send
+        self.user = None
+        self.query = {key: values[-1] for key, values in parse_qs(scope.get('query_string', b'').decode()).items()}
+        self.headers = {key.decode().lower(): value.decode() for key, value in scope.get('headers', [])}
+
+    async def accept(self):
+        await self._send({'type': 'websocket.accept'})
+
+    async def close(self, code=1000):
+        await self._send({'type': 'websocket.close', 'code': code})
+
+    async def send_text(self, text):
+        await self._send({'type': 'websocket.send', 'text': text})
+
+    async def send_json(self, data):
+        await self.send_text(json.dumps(data, separators=(',', ':')))
+
+    async def receive(self):
+        """
+        Next text or bytes frame.
+
+        Raises:
+            WebSocketDisconnect: When the client goes away
+        """
+        message = await self._receive()
+        if message['type'] == 'websocket.disconnect':
+            raise WebSocketDisconnect()
+        if message.get('text') is not None:
+            return message['text']
+        return message.get('bytes') or b''
+
+    async def __aiter__(self):
+        try:
+            while True:
+                yield await self.receive()
+        except WebSocketDisconnect:
+            return
+
+
+def _token(ws):
+    """
+    Access token from an "Authorization: Bearer" header or, for browsers
+    which cannot set headers on a websocket, a ?token= query parameter.
+    """
+    header = ws.headers.get('authorization', '')
+    scheme, _, token = header.partition(' ')
+    if scheme.lower() == 'bearer' and token:
+        return token.strip()
+    return ws.query.get('token')
+
+
+@sync_to_async
+def _load_user(user_id):
+    User = get_user_model()
+    return (
+        User.objects.select_related('driver', 'rider')
+        .filter(**{api_settings.USER_ID_FIELD: user_id}, is_active=True)
+        .first()
+    )
+
+
+async def authenticate(ws):
+    """
+    Validate the connection's JWT once and load its user.
+
+    Returns:
+        User or None if the token is missing, invalid or the user is inactive
+    """
+    token = _token(ws)
+    if not token:
+        return None
+    try:
+        access = AccessToken(token)
+    except TokenError as e:
+        logger.info(f"Rejected websocket token: {str(e)}")
+        return None
+    return await _load_user(access[api_settings.USER_ID_CLAIM])
+
+
+def websocket_router(routes):
+    """
+    ASGI app dispatching websocket connections by path.
+
+    Handlers are called after the handshake event and decide whether to
+    accept; they are expected to authenticate before reading frames.
+
+    Args:
+        routes: Mapping of path -> async handler(ws)
+    """
+    async def app(scope, receive, send):
+        ws = WebSocket(scope, receive, send)
+        # The handshake arrives as the first event
+        if (await receive())['type'] != 'websocket.connect':
+            return
+        handler = routes.get(scope['path'])
+        if handler is None:
+            await ws.close(CLOSE_NOT_FOUND)
+            return
+        try:
+            await handler(ws)
+        except WebSocketDisconnect:
+            pass
+        except Exception as e:
+            logger.error(f"Unhandled websocket error on {scope['path']}: {str(e)}", exc_info=True)
+            try:
+                await ws.close(1011)
+            except Exception:
+                pass
+    return app
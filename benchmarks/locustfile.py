@@ -0,0 +1,123 @@
+"""
+Over-the-wire load test of the hot endpoints, the HTTP counterpart of
+``python manage.py bench``.
+
+Run the API (runserver, gunicorn or uvicorn) against a local Redis and
+database, then from the project root:
+
+    pip install locust
+    locust -f benchmarks/locustfile.py --host http://127.0.0.1:8000
+
+The locust process loads the Django settings (DJANGO_SETTINGS_MODULE,
+default base.settings) to create benchmark accounts, mint their tokens and
+read OTPs from the shared cache, so it must point at the same database and
+Redis as the server. Accounts are removed when the test stops.
+"""
+import os
+import sys
+import uuid
+import random
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'base.settings')
+
+import django
+
+django.setup()
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from locust import HttpUser, between, events, task
+from servers import redis as geo_store
+from servers.auth_user.authentication import tokens_for_user
+from servers.driver.models import Driver
+from servers.ride.management.commands.bench import PHONE_PREFIX, SyntheticCity
+from servers.rider.models import Rider
+
+ACCOUNTS = int(os.environ.get('BENCH_ACCOUNTS', 200))
+CITY = SyntheticCity(77.5946, 12.9716, 15, np.random.default_rng(42))
+
+accounts = {'driver': [], 'rider': []}
+
+
+@events.test_start.add_listener
+def create_accounts(environment, **kwargs):
+    User = get_user_model()
+    users = [
+        User(username=f'bench-{uuid.uuid4().hex[:12]}', phone=f'{PHONE_PREFIX}{i:08d}', role=role, is_verified=True)
+        for i, role in enumerate(['driver'] * ACCOUNTS + ['rider'] * ACCOUNTS)
+    ]
+    User.objects.bulk_create(users)
+    Driver.objects.bulk_create([Driver(user_id=u, is_active=True) for u in users if u.role == 'driver'])
+    Rider.objects.bulk_create([Rider(user_id=u) for u in users if u.role == 'rider'])
+    for user in users:
+        accounts[user.role].append((user.phone, str(tokens_for_user(user)[0])))
+
+
+@events.test_stop.add_listener
+def remove_accounts(environment, **kwargs):
+    for driver in Driver.objects.filter(user_id__phone__startswith=PHONE_PREFIX):
+        geo_store.remove_driver(str(driver.id))
+    get_user_model().objects.filter(phone__startswith=PHONE_PREFIX).delete()
+
+
+class DriverApp(HttpUser):
+    """
+    A driver app reporting its position every couple of seconds.
+    """
+    weight = 3
+    wait_time = between(1, 3)
+
+    def on_start(self):
+        self.rnd = random.Random()
+        _, self.token = self.rnd.choice(accounts['driver'])
+
+    @task
+    def ingest(self):
+        lng, lat = CITY.point(self.rnd)
+        self.client.post(
+            '/api/v1/driver/add/', json={'lng': lng, 'lat': lat},
+            headers={'Authorization': f'Bearer {self.token}'}, name='driver/add',
+        )
+
+
+class RiderApp(HttpUser):
+    """
+    A rider polling nearby drivers, occasionally requesting a ride or
+    logging in again.
+    """
+    weight = 2
+    wait_time = between(1, 5)
+
+    def on_start(self):
+        self.rnd = random.Random()
+        self.phone, self.token = self.rnd.choice(accounts['rider'])
+        self.auth = {'Authorization': f'Bearer {self.token}'}
+
+    @task(10)
+    def nearby(self):
+        lng, lat = CITY.point(self.rnd)
+        self.client.get(
+            '/api/v1/rider/nearby/', params={'lng': lng, 'lat': lat, 'radius': 1000, 'count': 10},
+            headers=self.auth, name='rider/nearby',
+        )
+
+    @task(2)
+    def ride_request(self):
+        lng, lat = CITY.point(self.rnd)
+        dest_lng, dest_lat = CITY.point(self.rnd)
+        self.client.post(
+            '/api/v1/ride/ride-request/',
+            json={'src_lat': lat, 'src_lng': lng, 'dest_lat': dest_lat, 'dest_lng': dest_lng,
+                  'vehicle_type': self.rnd.choice(list(settings.FARE_RATE_CARD))},
+            headers=self.auth, name='ride/ride-request',
+        )
+
+    @task(1)
+    def login(self):
+        self.client.post('/api/v1/auth/otp/', json={'phone_number': self.phone, 'role': 'rider'}, name='auth/otp')
+        otp = (cache.get(f'otp_role_{self.phone}') or {}).get('otp', '')
+        self.client.post('/api/v1/auth/login/', json={'phone_number': self.phone, 'otp': otp}, name='auth/login')
@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class AuthUserConfig(AppConfig):
     name = 'servers.auth_user'
+
+    def ready(self):
+        from servers import profiles
+        from . import signals
+        signals.connect()
+        profiles.connect()
@@ -0,0 +1,158 @@
+import time
+import logging
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.functional import cached_property
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from base.cache import LRUCache
+from servers.profiles import get_driver_profile, get_rider_profile
+
+logger = logging.getLogger(__name__)
+
+# Claims describing the user's role and profiles; tokens carrying ROLE_CLAIM
+# are authenticated without loading the user
+ROLE_CLAIM = 'role'
+STAFF_CLAIM = 'is_staff'
+PROFILE_CLAIMS = {'driver': 'driver_id', 'rider': 'rider_id'}
+_PROFILE_GETTERS = {'driver': get_driver_profile, 'rider': get_rider_profile}
+
+REVOKED_KEY = 'auth:revoked:{user_id}'
+
+_revocations = LRUCache(
+    maxsize=settings.JWT_REVOCATION_CACHE_SIZE,
+    ttl=settings.JWT_REVOCATION_CACHE_TTL,
+)
+
+
+def _profile_id(user, name):
+    try:
+        return str(_PROFILE_GETTERS[name](user).id)
+    except AttributeError:
+        return None
+
+
+def tokens_for_user(user):
+    """
+    Issue a refresh/access token pair carrying the user's role, staff flag
+    and driver/rider profile ids, so requests can be authenticated from the
+    token alone. Refreshed access tokens inherit the claims.
+
+    Args:
+        user: User instance
+
+    Returns:
+        tuple: (access token, refresh token)
+    """
+    refresh = RefreshToken.for_user(user)
+    refresh[ROLE_CLAIM] = user.role
+    refresh[STAFF_CLAIM] = user.is_staff
+    for name, claim in PROFILE_CLAIMS.items():
+        profile_id = _profile_id(user, name)
+        if profile_id is not None:
+            refresh[claim] = profile_id
+    return refresh.access_token, refresh
+
+
+def revoke_user_tokens(user_id):
+    """
+    Reject every token issued to a user before the current second.
+
+    Token iat claims are whole seconds, so the cutoff is too: a token issued
+    right after revoking (e.g. the login that follows a role change) stays
+    valid. The cutoff is kept in the shared cache for the refresh token lifetime,
+    after which all older tokens have expired anyway. Other processes see it
+    within JWT_REVOCATION_CACHE_TTL seconds.
+    """
+    key = REVOKED_KEY.format(user_id=user_id)
+    cutoff = int(time.time())
+    cache.set(key, cutoff, int(api_settings.REFRESH_TOKEN_LIFETIME.total_seconds()))
+    _revocations.set(key, cutoff)
+    logger.info(f"Revoked tokens issued to user {user_id}")
+
+
+def is_token_revoked(token):
+    """
+    Returns:
+        bool: True if the token was issued before its user's revocation cutoff
+
+    Raises:
+        Exception: Whatever the shared cache raises when it is unreachable
+    """
+    key = REVOKED_KEY.format(user_id=token[api_settings.USER_ID_CLAIM])
+    cutoff = _revocations.get(key)
+    if cutoff is None:
+        cutoff = cache.get(key) or 0
+        _revocations.set(key, cutoff)
+    return bool(cutoff) and token.get('iat', 0) < cutoff
+
+
+class ProfileRef:
+    """
+    Stand-in for a Driver or Rider instance when only its id is known.
+    """
+
+    def __init__(self, pk):
+        self.id = self.pk = pk
+
+    def __str__(self):
+        return str(self.id)
+
+
+class ProfileTokenUser(TokenUser):
+    """
+    User built from token claims. ``role`` and ``is_staff`` come from the
+    token; ``driver`` and ``rider`` are ProfileRefs and raise AttributeError,
+    like the model's reverse relations, when the user has no such profile.
+    """
+
+    @cached_property
+    def driver(self):
+        return self._profile('driver')
+
+    @cached_property
+    def rider(self):
+        return self._profile('rider')
+
+    def _profile(self, name):
+        profile_id = self.token.get(PROFILE_CLAIMS[name])
+        if profile_id is None:
+            raise AttributeError(f"User has no {name} profile")
+        return ProfileRef(profile_id)
+
+    def __getattr__(self, attr):
+        # A failing property falls back here; keep the AttributeError
+        # instead of TokenUser's claim lookup returning None
+        if attr in PROFILE_CLAIMS:
+            raise AttributeError(f"User has no {attr} profile")
+        return super().__getattr__(attr)
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that trusts the claims issued by tokens_for_user
+    instead of loading the user and its profiles from the database.
+
+    With JWT_REVOCATION_CHECK on, tokens issued before revoke_user_tokens
+    are rejected. Tokens without the role claim (issued before it existed),
+    and every token while the shared cache is unreachable, go through the
+    regular database lookup.
+    """
+
+    def get_user(self, validated_token):
+        if ROLE_CLAIM not in validated_token:
+            return super().get_user(validated_token)
+
+        if settings.JWT_REVOCATION_CHECK:
+            try:
+                revoked = is_token_revoked(validated_token)
+            except Exception as e:
+                logger.warning(f"Token revocation check failed, loading user from the database: {str(e)}")
+                return super().get_user(validated_token)
+            if revoked:
+                raise AuthenticationFailed('Token has been revoked', code='token_revoked')
+
+        return ProfileTokenUser(validated_token)
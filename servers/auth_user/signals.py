@@ -0,0 +1,46 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save, pre_save
+from servers.driver.models import Driver
+from servers.rider.models import Rider
+from .authentication import revoke_user_tokens
+
+User = get_user_model()
+
+# User fields copied into token claims or checked when tokens are issued
+_CLAIM_FIELDS = ('role', 'is_staff', 'is_active')
+
+
+def _remember_claim_fields(sender, instance, **kwargs):
+    if instance._state.adding:
+        instance._claim_fields = None
+        return
+    instance._claim_fields = User.objects.filter(pk=instance.pk).values_list(*_CLAIM_FIELDS).first()
+
+
+def _revoke_on_claim_change(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_claim_fields', None)
+    if created or previous is None:
+        return
+    if previous != tuple(getattr(instance, field) for field in _CLAIM_FIELDS):
+        revoke_user_tokens(instance.pk)
+
+
+def _revoke_user(sender, instance, **kwargs):
+    revoke_user_tokens(instance.pk)
+
+
+def _revoke_profile_owner(sender, instance, **kwargs):
+    revoke_user_tokens(instance.user_id_id)
+
+
+def connect():
+    """
+    Revoke a user's tokens whenever the claims they carry go stale: role,
+    staff or active flags change, the user is deleted, or a driver/rider
+    profile named in them is deleted.
+    """
+    pre_save.connect(_remember_claim_fields, sender=User, dispatch_uid='auth_user_claim_fields')
+    post_save.connect(_revoke_on_claim_change, sender=User, dispatch_uid='auth_user_claim_change')
+    post_delete.connect(_revoke_user, sender=User, dispatch_uid='auth_user_deleted')
+    post_delete.connect(_revoke_profile_owner, sender=Driver, dispatch_uid='auth_user_driver_deleted')
+    post_delete.connect(_revoke_profile_owner, sender=Rider, dispatch_uid='auth_user_rider_deleted')
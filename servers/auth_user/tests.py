@@ -1,3 +1,58 @@
+import time
+import uuid
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.test import TestCase
+from rest_framework.test import APIClient
+from base.testing import RedisTestMixin
+from .authentication import REVOKED_KEY, _revocations, is_token_revoked, revoke_user_tokens, tokens_for_user
 
-# Create your tests here.
+User = get_user_model()
+
+
+class TokenRevocationTests(RedisTestMixin, TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            username=f'test-{uuid.uuid4().hex[:12]}', phone=f'+1{uuid.uuid4().int % 10 ** 10:010d}', role='rider'
+        )
+        self.key = REVOKED_KEY.format(user_id=self.user.pk)
+
+    def tearDown(self):
+        cache.delete(self.key)
+        _revocations.delete(self.key)
+
+    def _revoke_at(self, now):
+        with mock.patch('servers.auth_user.authentication.time.time', return_value=now):
+            revoke_user_tokens(self.user.pk)
+
+    def _update(self, access):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        return client.patch('/api/v1/auth/update/', {'name': 'Test'}, format='json')
+
+    def test_cutoff_is_whole_seconds(self):
+        self._revoke_at(1000.7)
+        self.assertEqual(cache.get(self.key), 1000)
+        self.assertTrue(is_token_revoked({'user_id': str(self.user.pk), 'iat': 999}))
+        self.assertFalse(is_token_revoked({'user_id': str(self.user.pk), 'iat': 1000}))
+        self.assertFalse(is_token_revoked({'user_id': str(uuid.uuid4()), 'iat': 999}))
+
+    def test_revoked_token_is_rejected(self):
+        access, _ = tokens_for_user(self.user)
+        self.assertEqual(self._update(access).status_code, 200)
+
+        self._revoke_at(time.time() + 2)
+        response = self._update(access)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()['detail'], 'Token has been revoked')
+
+    def test_role_change_revokes_tokens(self):
+        self.user.name = 'Renamed'
+        self.user.save()
+        self.assertIsNone(cache.get(self.key))
+
+        self.user.role = 'driver'
+        self.user.save()
+        self.assertIsNotNone(cache.get(self.key))
@@ -5,13 +5,14 @@ from rest_framework.decorators import api_view, permission_classes
 from base.utils import success_response, error_response, generate_otp, send_otp_via_sns, generate_username
 from django.core.cache import cache
 from django.contrib.auth import get_user_model
-from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+from rest_framework_simplejwt.tokens import RefreshToken
 from .serializers import UserModelSerializer
 from django.db import transaction, IntegrityError
 from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
 from servers.rider.models import Rider
 from rest_framework.permissions import IsAuthenticated
 from servers.driver.models import Driver
+from .authentication import is_token_revoked, tokens_for_user
 
 logger = logging.getLogger(__name__)
 user_model = get_user_model()
@@ -287,8 +288,7 @@ def login(request):
         
         # Generate tokens
         try:
-            access_token = AccessToken.for_user(user)
-            refresh_token = RefreshToken.for_user(user)
+            access_token, refresh_token = tokens_for_user(user)
         except Exception as e:
             logger.error(f"Error generating tokens for user {user.id}: {str(e)}")
             return error_response(
@@ -346,6 +346,15 @@ def refresh(request):
         
         try:
             refresh_obj = RefreshToken(refresh_token)
+            if is_token_revoked(refresh_obj):
+                logger.warning(f"Revoked refresh token used by user {refresh_obj.get('user_id')}")
+                return error_response(
+                    code='AUTH_TOKEN_REVOKED',
+                    message='Refresh token has been revoked',
+                    field='refresh_token',
+                    issue='Please log in again',
+                    status=status.HTTP_401_UNAUTHORIZED
+                )
             new_access_token = str(refresh_obj.access_token)
             new_refresh_token = str(refresh_obj)
             
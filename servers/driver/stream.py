@@ -0,0 +1,174 @@
+import json
+import time
+import math
+import uuid
+import asyncio
+import logging
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from base.websocket import CLOSE_FORBIDDEN, CLOSE_UNAUTHORIZED, authenticate
+from servers.redis import GEO_LAT_LIMIT, _timestamp_window
+from servers.redis_async import aadd_driver_locations
+from .views import _unknown_driver_ids
+
+logger = logging.getLogger(__name__)
+
+
+class LocationCoalescer:
+    """
+    Process-wide buffer of the latest location per driver.
+
+    Frames from every open connection land here; only the newest fix per
+    driver survives until the next flush, which writes the whole buffer
+    with one aadd_driver_locations call. A flush runs every
+    ``flush_interval`` seconds, or as soon as ``max_batch`` drivers are
+    pending.
+
+    Args:
+        flush_interval: Seconds between flushes
+        max_batch: Pending drivers that trigger an early flush
+    """
+
+    def __init__(self, flush_interval, max_batch):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.flushed = 0
+        self.coalesced = 0
+        self._pending = {}
+        self._wakeup = None
+        self._task = None
+
+    def put(self, driver_id, lng, lat, ts):
+        previous = self._pending.get(driver_id)
+        if previous is not None:
+            self.coalesced += 1
+            if previous[2] > ts:
+                return
+        self._pending[driver_id] = (lng, lat, ts)
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        if len(self._pending) >= self.max_batch:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        items = [(driver_id, lng, lat, ts) for driver_id, (lng, lat, ts) in batch.items()]
+        result = await aadd_driver_locations(items)
+        if not result.get('success'):
+            logger.error(f"Failed to flush {len(items)} streamed locations: {result.get('error')}")
+            return
+        self.flushed += result.get('accepted', 0)
+
+
+_coalescer = None
+
+
+def get_coalescer():
+    global _coalescer
+    if _coalescer is None:
+        _coalescer = LocationCoalescer(
+            flush_interval=settings.DRIVER_STREAM_FLUSH_INTERVAL,
+            max_batch=settings.DRIVER_STREAM_MAX_BATCH,
+        )
+    return _coalescer
+
+
+def _parse_frame(frame, default_driver_id):
+    """
+    Parse one location frame.
+
+    Frames are JSON objects {"lng", "lat", "ts"?, "driver_id"?} or arrays
+    [lng, lat, ts?]. ts defaults to the time the frame was received and must
+    fall within _timestamp_window.
+
+    Returns:
+        tuple: ((driver_id, lng, lat, ts), error message or None)
+    """
+    try:
+        data = json.loads(frame)
+    except ValueError:
+        return None, "Frame must be valid JSON"
+    if isinstance(data, dict):
+        driver_id = data.get('driver_id') or default_driver_id
+        lng, lat, ts = data.get('lng'), data.get('lat'), data.get('ts')
+    elif isinstance(data, list) and 2 <= len(data) <= 3:
+        driver_id = default_driver_id
+        lng, lat = data[:2]
+        ts = data[2] if len(data) == 3 else None
+    else:
+        return None, "Frame must be an object or a [lng, lat, ts] array"
+    now = time.time()
+    try:
+        lng, lat = float(lng), float(lat)
+        ts = now if ts is None else float(ts)
+    except (TypeError, ValueError):
+        return None, "lng, lat and ts must be numbers"
+    if not (math.isfinite(lng) and math.isfinite(lat) and math.isfinite(ts)):
+        return None, "lng, lat and ts must be finite"
+    earliest, latest = _timestamp_window(now)
+    if not earliest <= ts <= latest:
+        return None, "ts is too old or in the future"
+    if not (-180 <= lng <= 180 and -GEO_LAT_LIMIT <= lat <= GEO_LAT_LIMIT):
+        return None, "Coordinates are out of range"
+    if not driver_id:
+        return None, "driver_id is required"
+    try:
+        driver_id = str(uuid.UUID(str(driver_id)))
+    except ValueError:
+        return None, "driver_id must be a UUID"
+    return (driver_id, lng, lat, ts), None
+
+
+async def driver_location_stream(ws):
+    """
+    Stream location updates from a driver app over one websocket.
+
+    The JWT is checked once at connect time; after that every text frame
+    is a location fix (see _parse_frame). Nothing is sent back for good
+    frames; bad frames get an {"error": ...} reply and are dropped.
+    Drivers may only stream their own location; staff and admin accounts
+    acting as fleet gateways must name an existing driver_id in each frame.
+    Driver ids found are remembered for the rest of the connection, so each
+    is looked up once.
+    """
+    user = await authenticate(ws)
+    await ws.accept()
+    if user is None:
+        await ws.close(CLOSE_UNAUTHORIZED)
+        return
+    is_fleet = user.is_staff or user.role == 'admin'
+    own_driver_id = None
+    if not is_fleet:
+        driver = getattr(user, 'driver', None)
+        if driver is None:
+            await ws.close(CLOSE_FORBIDDEN)
+            return
+        own_driver_id = str(driver.id)
+
+    coalescer = get_coalescer()
+    known = set()
+    async for frame in ws:
+        item, error = _parse_frame(frame, own_driver_id)
+        if error is None and own_driver_id is not None and item[0] != own_driver_id:
+            error = "Drivers can only report their own location"
+        elif error is None and own_driver_id is None and item[0] not in known:
+            if await sync_to_async(_unknown_driver_ids)([item[0]]):
+                error = "Unknown driver"
+            else:
+                known.add(item[0])
+        if error is not None:
+            await ws.send_json({'error': error})
+            continue
+        coalescer.put(*item)
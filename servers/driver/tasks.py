@@ -0,0 +1,25 @@
+import logging
+from celery import shared_task
+from django.conf import settings
+from servers.redis import evict_stale_drivers
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def evict_offline_drivers():
+    """
+    Periodically drop drivers that stopped sending location updates.
+    
+    Scheduled by celery beat every DRIVER_SWEEP_INTERVAL seconds.
+    
+    Returns:
+        dict: Status and number of evicted drivers
+    """
+    result = evict_stale_drivers(
+        settings.DRIVER_LOCATION_TTL,
+        batch_size=settings.DRIVER_SWEEP_BATCH
+    )
+    if not result.get('success'):
+        logger.error(f"Stale driver sweep failed: {result.get('error')}")
+    return result
@@ -1,3 +1,376 @@
-from django.test import TestCase
+import json
+import time
+import uuid
+import threading
+from unittest import mock
+import redis
+from redis.crc import key_slot
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.test import APIClient
+from base.testing import RedisTestMixin
+from servers import redis as geo_store
+from servers.geo_index import GeoIndex
+from servers.redis_pool import get_redis_client
+from .models import Driver
+from .stream import driver_location_stream
+from .views import _unknown_driver_ids
 
-# Create your tests here.
+User = get_user_model()
+
+
+class _FakeSocket:
+
+    def __init__(self, frames):
+        self.frames = frames
+        self.sent = []
+
+    async def accept(self):
+        pass
+
+    async def close(self, code=1000):
+        self.closed = code
+
+    async def send_json(self, data):
+        self.sent.append(data)
+
+    async def __aiter__(self):
+        for frame in self.frames:
+            yield frame
+
+
+def _make_user(role, **fields):
+    return User.objects.create(
+        username=f'test-{uuid.uuid4().hex[:12]}', phone=f'+1{uuid.uuid4().int % 10 ** 10:010d}', role=role, **fields
+    )
+
+
+class LocationBatchValidationTests(SimpleTestCase):
+
+    def _errors(self, items):
+        return list(geo_store._validate_location_batch(items)[3])
+
+    def test_rejects_bad_coordinates_and_ids(self):
+        errors = self._errors([
+            ('a', 77.6, 12.9, None),
+            ('a', 181, 12.9, None),
+            ('a', 77.6, 86, None),
+            ('a', 'x', 12.9, None),
+            ('', 77.6, 12.9, None),
+        ])
+        self.assertIsNone(errors[0])
+        self.assertIn('Longitude', errors[1])
+        self.assertIn('Latitude', errors[2])
+        self.assertIn('valid numbers', errors[3])
+        self.assertIn('driver_id', errors[4])
+
+    def test_timestamps_must_fall_in_window(self):
+        now = time.time()
+        errors = self._errors([
+            ('a', 77.6, 12.9, now - 10),
+            ('a', 77.6, 12.9, now + settings.DRIVER_LOCATION_MAX_FUTURE + 60),
+            ('a', 77.6, 12.9, now - settings.DRIVER_LOCATION_TTL - 60),
+            ('a', 77.6, 12.9, float('nan')),
+        ])
+        self.assertIsNone(errors[0])
+        self.assertIn('future', errors[1])
+        self.assertIn('last', errors[2])
+        self.assertIn('valid epoch', errors[3])
+
+    def test_newest_fix_per_driver_is_written(self):
+        now = time.time()
+        entries, results = geo_store._prepare_location_batch([
+            ('a', 77.60, 12.9, now - 5),
+            ('a', 77.61, 12.9, now),
+            ('b', 500, 12.9, now),
+        ])
+        self.assertEqual(entries, [('driver:a', 77.61, 12.9, now)])
+        self.assertEqual(results[0]['message'], 'Superseded by a newer location')
+        self.assertTrue(results[1]['success'])
+        self.assertFalse(results[2]['success'])
+
+
+class DriverBatchViewTests(RedisTestMixin, TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.driver = Driver.objects.create(user_id=_make_user('driver'))
+        self.fleet = _make_user('admin', is_staff=True)
+        self.redis = get_redis_client()
+
+    def tearDown(self):
+        geo_store.remove_driver(str(self.driver.id))
+
+    def _seen(self, member):
+        return self.redis.zscore(geo_store._member_keys(member).seen, member)
+
+    def _post(self, user, locations):
+        self.client.force_authenticate(user)
+        return self.client.post('/api/v1/driver/add/batch/', {'locations': locations}, format='json')
+
+    def test_driver_cannot_report_other_drivers(self):
+        other = str(uuid.uuid4())
+        response = self._post(self.driver.user_id, [[other, 77.6, 12.9]])
+        self.assertEqual(response.status_code, 403)
+        self.assertIsNone(self._seen(f'driver:{other}'))
+
+    def test_driver_reports_own_location(self):
+        response = self._post(self.driver.user_id, [{'lng': 77.6, 'lat': 12.9}, [str(self.driver.id), 77.61, 12.9]])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data']['accepted'], 1)
+        position = self.redis.geopos(geo_store._shard_key(77.61, 12.9), f'driver:{self.driver.id}')[0]
+        self.assertAlmostEqual(position[0], 77.61, places=5)
+
+    def test_fleet_batch_skips_unknown_drivers(self):
+        unknown = str(uuid.uuid4())
+        response = self._post(self.fleet, [
+            [str(self.driver.id).upper(), 77.6, 12.9],
+            [unknown, 77.6, 12.9],
+            ['x' * 300, 77.6, 12.9],
+            {'lng': 77.6, 'lat': 12.9},
+        ])
+        self.assertEqual(response.status_code, 200)
+        data = response.json()['data']
+        self.assertEqual(data['accepted'], 1)
+        self.assertEqual([r['success'] for r in data['results']], [True, False, False, False])
+        self.assertEqual(data['results'][0]['driver_id'], str(self.driver.id))
+        self.assertEqual(data['results'][1]['error'], 'Unknown driver')
+        self.assertEqual(data['results'][3]['error'], 'driver_id cannot be empty')
+        self.assertIsNone(self._seen(f'driver:{unknown}'))
+
+    def test_fleet_stream_skips_unknown_drivers(self):
+        known, unknown = str(self.driver.id), str(uuid.uuid4())
+        ws = _FakeSocket([
+            json.dumps({'driver_id': known, 'lng': 77.6, 'lat': 12.9}),
+            json.dumps({'driver_id': unknown, 'lng': 77.6, 'lat': 12.9}),
+            json.dumps({'driver_id': known.upper(), 'lng': 77.61, 'lat': 12.9}),
+        ])
+        coalescer = mock.Mock()
+        with mock.patch('servers.driver.stream.authenticate', mock.AsyncMock(return_value=self.fleet)), \
+                mock.patch('servers.driver.stream.get_coalescer', return_value=coalescer), \
+                mock.patch('servers.driver.stream._unknown_driver_ids', wraps=_unknown_driver_ids) as lookup:
+            async_to_sync(driver_location_stream)(ws)
+
+        self.assertEqual(ws.sent, [{'error': 'Unknown driver'}])
+        self.assertEqual([call.args[:3] for call in coalescer.put.call_args_list], [
+            (known, 77.6, 12.9), (known, 77.61, 12.9),
+        ])
+        self.assertEqual(lookup.call_count, 2)
+
+
+class GeoShardTests(RedisTestMixin, SimpleTestCase):
+
+    def setUp(self):
+        self.redis = get_redis_client()
+        self.driver_ids = []
+
+    def tearDown(self):
+        for driver_id in self.driver_ids:
+            geo_store.remove_driver(driver_id)
+
+    def _driver(self):
+        driver_id = str(uuid.uuid4())
+        self.driver_ids.append(driver_id)
+        return driver_id, f'driver:{driver_id}'
+
+    def _owner(self, member):
+        return self.redis.hget(geo_store._member_keys(member).owner, member)
+
+    def _shards_holding(self, member, *points):
+        keys = {geo_store._shard_key(lng, lat) for lng, lat in points}
+        return {key for key in keys if self.redis.zscore(key, member) is not None}
+
+    def test_move_across_cells_leaves_one_shard(self):
+        driver_id, member = self._driver()
+        bengaluru, chennai = (77.6, 12.9), (80.27, 13.08)
+        geo_store.add_driver_location(driver_id, *bengaluru)
+        geo_store.add_driver_location(driver_id, *chennai)
+
+        self.assertEqual(self._shards_holding(member, bengaluru, chennai), {geo_store._shard_key(*chennai)})
+        self.assertEqual(self._owner(member), geo_store._cell(*chennai))
+        self.assertIn(member, [m for m, *_ in geo_store.nearby_drivers(*chennai, radius=500)])
+        self.assertNotIn(member, [m for m, *_ in geo_store.nearby_drivers(*bengaluru, radius=500)])
+
+    def test_concurrent_moves_leave_one_shard(self):
+        driver_id, member = self._driver()
+        points = [(77.6, 12.9), (80.27, 13.08), (72.88, 19.07), (88.36, 22.57)]
+
+        def move(offset):
+            for i in range(50):
+                geo_store.add_driver_location(driver_id, *points[(i + offset) % len(points)])
+
+        threads = [threading.Thread(target=move, args=(offset,)) for offset in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        holding = self._shards_holding(member, *points)
+        self.assertEqual(len(holding), 1)
+        self.assertEqual(geo_store._shard_keys(self._owner(member)).geo, holding.pop())
+
+    def test_reserved_driver_stays_out_of_shards(self):
+        driver_id, member = self._driver()
+        geo_store.add_driver_location(driver_id, 77.6, 12.9)
+        self.assertEqual(geo_store.reserve_drivers([(driver_id, 'ride')], ttl=60)['taken'], [True])
+
+        geo_store.add_driver_location(driver_id, 80.27, 13.08)
+        self.assertEqual(self._shards_holding(member, (77.6, 12.9), (80.27, 13.08)), set())
+        self.assertIsNone(self._owner(member))
+        lng, lat = self.redis.geopos(geo_store._member_keys(member).pos, member)[0]
+        self.assertAlmostEqual(lng, 80.27, places=4)
+
+    def test_scripts_stay_in_one_hash_slot(self):
+        calls = []
+        pipeline_execute = redis.client.Pipeline.pipeline_execute_command
+
+        def record(pipe, *args, **options):
+            if args[0] == 'EVALSHA':
+                calls.append(args[3:3 + args[2]])
+            return pipeline_execute(pipe, *args, **options)
+
+        driver_id, member = self._driver()
+        with mock.patch.object(redis.client.Pipeline, 'pipeline_execute_command', record):
+            geo_store.add_driver_location(driver_id, 77.6, 12.9)
+            geo_store.add_driver_location(driver_id, 80.27, 13.08)
+            geo_store.reserve_drivers([(driver_id, 'ride')], ttl=60)
+            geo_store.hold_drivers([(driver_id, 'ride')])
+            geo_store.add_driver_location(driver_id, 77.6, 12.9)
+            geo_store.release_driver(driver_id, 'ride')
+            geo_store.evict_stale_drivers(-1)
+            geo_store.add_driver_location(driver_id, 77.6, 12.9)
+            geo_store.remove_driver(driver_id)
+
+        self.assertGreater(len(calls), 8)
+        for keys in calls:
+            self.assertEqual(len({key_slot(key.encode()) for key in keys}), 1, keys)
+
+    def test_nearby_search_is_bounded(self):
+        self.assertIsNone(geo_store.nearby_drivers(77.6, 12.9, radius=settings.NEARBY_MAX_RADIUS + 1))
+        self.assertIsNone(geo_store.nearby_drivers(77.6, 12.9, count=settings.NEARBY_MAX_COUNT + 1))
+        self.assertIsNone(geo_store.nearby_drivers(77.6, 89.0))
+
+
+# One owner bucket, so paging past reserved drivers is exercised
+@override_settings(GEO_OWNER_BUCKETS=1)
+class StaleDriverTests(RedisTestMixin, SimpleTestCase):
+
+    def setUp(self):
+        self.redis = get_redis_client()
+        self.driver_ids = []
+
+    def tearDown(self):
+        for driver_id in self.driver_ids:
+            geo_store.remove_driver(driver_id)
+
+    def _add(self, lng, lat, age):
+        driver_id = str(uuid.uuid4())
+        self.driver_ids.append(driver_id)
+        result = geo_store.add_driver_locations([(driver_id, lng, lat, time.time() - age)])
+        self.assertEqual(result['accepted'], 1)
+        return driver_id, f'driver:{driver_id}'
+
+    def _indexed(self, member):
+        return self.redis.zscore(geo_store._member_keys(member).seen, member) is not None
+
+    def test_evicts_only_stale_drivers(self):
+        _, stale = self._add(77.6, 12.9, 100)
+        _, fresh = self._add(77.6, 12.9, 0)
+
+        result = geo_store.evict_stale_drivers(50)
+        self.assertTrue(result['success'])
+        self.assertGreaterEqual(result['evicted'], 1)
+        self.assertFalse(self._indexed(stale))
+        self.assertIsNone(self.redis.hget(geo_store._member_keys(stale).owner, stale))
+        self.assertTrue(self._indexed(fresh))
+
+    def test_reserved_drivers_survive_and_do_not_block_paging(self):
+        reserved = [self._add(77.6, 12.9, 100) for _ in range(3)]
+        _, stale = self._add(77.6, 12.9, 90)
+        taken = geo_store.reserve_drivers([(driver_id, 'ride') for driver_id, _ in reserved], ttl=60)['taken']
+        self.assertEqual(taken, [True] * 3)
+
+        geo_store.evict_stale_drivers(50, batch_size=1)
+        self.assertFalse(self._indexed(stale))
+        for _, member in reserved:
+            self.assertTrue(self._indexed(member))
+            self.assertIsNotNone(self.redis.zscore(geo_store._member_keys(member).reserved, member))
+
+    def test_freshness_filter_looks_past_stale_drivers(self):
+        lng, lat = 20.0 + uuid.uuid4().int % 1000 / 1000, 10.0
+        for _ in range(geo_store.STALE_OVERFETCH * 3):
+            self._add(lng, lat, 100)
+        _, fresh = self._add(lng + 0.001, lat, 0)
+
+        drivers = geo_store.nearby_drivers(lng, lat, radius=500, count=1, max_age=50)
+        self.assertEqual([member for member, *_ in drivers], [fresh])
+
+
+@override_settings(GEO_INDEX_ENABLED=True)
+class GeoIndexTests(RedisTestMixin, SimpleTestCase):
+
+    def setUp(self):
+        self.redis = get_redis_client()
+        self.point = (25.0 + uuid.uuid4().int % 1000 / 1000, 11.0)
+        self.driver_ids = []
+        self.index = GeoIndex(geo_store.GEO_SHARDS_KEY, geo_store._shard_keys, 0.01, 0, 60)
+
+    def tearDown(self):
+        for driver_id in self.driver_ids:
+            geo_store.remove_driver(driver_id)
+
+    def _driver(self, lng_offset):
+        driver_id = str(uuid.uuid4())
+        self.driver_ids.append(driver_id)
+        geo_store.add_driver_location(driver_id, self.point[0] + lng_offset, self.point[1])
+        return driver_id
+
+    def _nearby(self, **kwargs):
+        return self.index.nearby(self.redis, *self.point, 2000, 10, **kwargs)
+
+    def _members(self, drivers):
+        return [member for member, *_ in drivers]
+
+    def test_matches_geosearch(self):
+        for offset in (0.004, 0.001, 0.002):
+            self._driver(offset)
+        indexed = self._nearby()
+        with self.settings(GEO_INDEX_ENABLED=False):
+            searched = geo_store.nearby_drivers(*self.point, radius=2000)
+        self.assertEqual(self._members(indexed), self._members(searched))
+        for (_, dist, coords), (_, expected, expected_coords) in zip(indexed, searched):
+            self.assertAlmostEqual(dist, expected, delta=0.5)
+            self.assertAlmostEqual(coords[0], expected_coords[0], places=5)
+
+    def test_follows_moves_reservations_and_removals(self):
+        driver_id = self._driver(0.001)
+        member = f'driver:{driver_id}'
+        self.assertEqual(self._members(self._nearby()), [member])
+
+        geo_store.add_driver_location(driver_id, self.point[0] + 1, self.point[1])
+        self.assertEqual(self._nearby(), [])
+        geo_store.add_driver_location(driver_id, self.point[0] + 0.002, self.point[1])
+        self.assertEqual(self._members(self._nearby()), [member])
+
+        geo_store.reserve_drivers([(driver_id, 'ride')], ttl=60)
+        self.assertEqual(self._nearby(), [])
+        geo_store.release_driver(driver_id, 'ride')
+        self.assertEqual(self._members(self._nearby()), [member])
+
+        geo_store.remove_driver(driver_id)
+        self.assertEqual(self._nearby(), [])
+
+    def test_trimmed_feed_reloads_shard(self):
+        driver_id = self._driver(0.001)
+        self._nearby()
+        moved = self._driver(0.002)
+        geo_store.add_driver_location(driver_id, self.point[0] + 1, self.point[1])
+        self.redis.xtrim(geo_store._shard_keys(geo_store._cell(*self.point)).changes, maxlen=1)
+
+        self.assertEqual(self._members(self._nearby()), [f'driver:{moved}'])
+
+    def test_freshness_filter(self):
+        self._driver(0.001)
+        self.assertEqual(self._nearby(min_seen=time.time() + 60), [])
@@ -1,5 +1,6 @@
 from django.urls import path
-from .views import add_driver
+from .views import add_driver,add_driver_batch
 urlpatterns=[
-    path('add/',add_driver)
+    path('add/',add_driver),
+    path('add/batch/',add_driver_batch)
 ]
\ No newline at end of file
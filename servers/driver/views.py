@@ -1,7 +1,12 @@
+import uuid
 import logging
-from base.utils import success_response, error_response
-from servers.redis import add_driver_location
-from rest_framework.decorators import api_view, permission_classes
+from base.renderers import FastJSONRenderer
+from base.utils import error_response, fast_success_response
+from django.conf import settings
+from servers.redis import add_driver_location, add_driver_locations
+from servers.profiles import get_driver_profile
+from .models import Driver
+from rest_framework.decorators import api_view, permission_classes, renderer_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import status
 
@@ -10,6 +15,7 @@ logger = logging.getLogger(__name__)
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@renderer_classes([FastJSONRenderer])
 def add_driver(request):
     """
     Add or update driver location.
@@ -21,7 +27,7 @@ def add_driver(request):
     }
     """
     try:
-        driver_id = request.user.driver.id
+        driver_id = get_driver_profile(request.user).id
         lng = request.data.get('lng')
         lat = request.data.get('lat')
         
@@ -40,7 +46,7 @@ def add_driver(request):
         result = add_driver_location(driver_id, lng=lng, lat=lat)
         
         if result.get('success'):
-            return success_response(
+            return fast_success_response(
                 {'message': result.get('message')},
                 status.HTTP_200_OK
             )
@@ -73,3 +79,151 @@ def add_driver(request):
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
+
+
+def _parse_location_item(item, default_driver_id):
+    """
+    Normalize one batch entry into a (driver_id, lng, lat, ts) tuple.
+    
+    Entries may be objects with driver_id/lng/lat/ts keys or arrays in the
+    same order. driver_id falls back to the caller's own driver profile.
+    """
+    if isinstance(item, dict):
+        driver_id = item.get('driver_id')
+        lng, lat, ts = item.get('lng'), item.get('lat'), item.get('ts')
+    elif isinstance(item, (list, tuple)) and 3 <= len(item) <= 4:
+        driver_id, lng, lat = item[:3]
+        ts = item[3] if len(item) == 4 else None
+    else:
+        return default_driver_id, None, None, None
+    driver_id = str(driver_id) if driver_id else default_driver_id
+    return driver_id, lng, lat, ts
+
+
+def _canonical_driver_id(driver_id):
+    """
+    Driver id in canonical UUID form, or None if it is not a UUID.
+    """
+    try:
+        return str(uuid.UUID(driver_id))
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+def _unknown_driver_ids(driver_ids):
+    """
+    Returns:
+        set: The given canonical driver ids that name no Driver
+    """
+    driver_ids = set(driver_ids)
+    known = Driver.objects.filter(id__in=driver_ids).values_list('id', flat=True)
+    return driver_ids - {str(driver_id) for driver_id in known}
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@renderer_classes([FastJSONRenderer])
+def add_driver_batch(request):
+    """
+    Add or update many driver locations in one request.
+    
+    Drivers may only report their own locations; staff accounts acting as
+    fleet gateways may report for any existing driver. Entries naming an
+    unknown driver are reported as failed in the results.
+    
+    Expected request data:
+    {
+        "locations": [
+            {"driver_id": str (optional), "lng": float, "lat": float, "ts": float (optional)},
+            [driver_id, lng, lat, ts],
+            ...
+        ]
+    }
+    """
+    try:
+        locations = request.data.get('locations')
+        is_fleet = request.user.is_staff or request.user.role == 'admin'
+        own_driver_id = None if is_fleet else str(get_driver_profile(request.user).id)
+        
+        if not isinstance(locations, list) or not locations:
+            logger.warning("Batch location request without locations")
+            return error_response(
+                code='MISSING_FIELDS',
+                message='A non-empty list of locations is required',
+                field='locations',
+                issue='locations must be a non-empty array',
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if len(locations) > settings.DRIVER_LOCATION_BATCH_MAX:
+            logger.warning(f"Batch location request too large: {len(locations)} items")
+            return error_response(
+                code='BATCH_TOO_LARGE',
+                message=f'At most {settings.DRIVER_LOCATION_BATCH_MAX} locations are allowed per request',
+                field='locations',
+                issue='Too many locations in one batch',
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        items = [_parse_location_item(item, own_driver_id) for item in locations]
+        driver_ids = [_canonical_driver_id(driver_id) for driver_id, *_ in items]
+        if own_driver_id is not None and any(driver_id != own_driver_id for driver_id in driver_ids):
+            logger.warning(f"Driver {own_driver_id} tried to report other drivers' locations")
+            return error_response(
+                code='PERMISSION_DENIED',
+                message='Drivers can only report their own location',
+                field='driver_id',
+                issue='driver_id does not match the authenticated driver',
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        unknown = set() if own_driver_id is not None else _unknown_driver_ids(filter(None, driver_ids))
+        known = [
+            index for index, driver_id in enumerate(driver_ids)
+            if driver_id is not None and driver_id not in unknown
+        ]
+        result = add_driver_locations([(driver_ids[index], *items[index][1:]) for index in known])
+        
+        if result.get('success'):
+            results = [
+                {
+                    "driver_id": driver_id,
+                    "success": False,
+                    "error": "Unknown driver" if driver_id else "driver_id cannot be empty",
+                }
+                for driver_id, *_ in items
+            ]
+            for index, item_result in zip(known, result.get('results')):
+                results[index] = item_result
+            return fast_success_response(
+                {'accepted': result.get('accepted'), 'results': results},
+                status.HTTP_200_OK
+            )
+        else:
+            logger.error(f"Failed to add driver locations: {result.get('error')}")
+            return error_response(
+                code='LOCATION_ERROR',
+                message=result.get('error', 'Failed to add locations'),
+                field='locations',
+                issue='Could not save driver locations to cache',
+                status=status.HTTP_400_BAD_REQUEST
+            )
+    
+    except AttributeError as e:
+        logger.error(f"Driver profile error: {str(e)}")
+        return error_response(
+            code='PROFILE_ERROR',
+            message='Driver profile not found',
+            field='user',
+            issue='User does not have a driver profile',
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    except Exception as e:
+        logger.error(f"Unexpected error adding driver locations: {str(e)}")
+        return error_response(
+            code='INTERNAL_ERROR',
+            message='An unexpected error occurred',
+            field='general',
+            issue=str(e),
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
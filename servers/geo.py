@@ -0,0 +1,202 @@
+import numpy as np
+
+# Earth radius used by Redis GEO commands, so local distances match GEOSEARCH
+EARTH_RADIUS_M = 6372797.560856
+
+GEO_LAT_MIN, GEO_LAT_MAX = -85.05112878, 85.05112878
+GEO_LNG_MIN, GEO_LNG_MAX = -180.0, 180.0
+GEO_STEP = 26  # bits per axis in a Redis GEO score
+
+METERS_PER_DEGREE = 111320.0
+
+
+def haversine(lng1, lat1, lng2, lat2):
+    """
+    Great-circle distance in meters, vectorized over NumPy arrays.
+
+    Args:
+        lng1, lat1: Origin coordinates (scalars or arrays)
+        lng2, lat2: Destination coordinates (scalars or arrays)
+
+    Returns:
+        ndarray: Distances in meters, broadcast over the inputs
+    """
+    lng1, lat1, lng2, lat2 = map(np.radians, (lng1, lat1, lng2, lat2))
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+def bounding_box(lng, lat, radius):
+    """
+    Bounding box of a circle of ``radius`` meters around a point.
+
+    Returns:
+        tuple: (min_lng, min_lat, max_lng, max_lat)
+    """
+    dlat = radius / METERS_PER_DEGREE
+    dlng = radius / (METERS_PER_DEGREE * max(np.cos(np.radians(lat)), 1e-6))
+    return lng - dlng, lat - dlat, lng + dlng, lat + dlat
+
+
+def _compact_bits(x):
+    """
+    Gather the even bits of each uint64 into its low 32 bits.
+    """
+    x = x & np.uint64(0x5555555555555555)
+    x = (x | (x >> np.uint64(1))) & np.uint64(0x3333333333333333)
+    x = (x | (x >> np.uint64(2))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    x = (x | (x >> np.uint64(4))) & np.uint64(0x00FF00FF00FF00FF)
+    x = (x | (x >> np.uint64(8))) & np.uint64(0x0000FFFF0000FFFF)
+    x = (x | (x >> np.uint64(16))) & np.uint64(0x00000000FFFFFFFF)
+    return x
+
+
+def decode_geo_scores(scores):
+    """
+    Decode Redis GEO sorted-set scores into coordinates.
+
+    Redis stores each member as a 52-bit interleaved geohash (latitude in the
+    even bits, longitude in the odd bits). Decoding locally lets a whole
+    ZRANGE WITHSCORES snapshot be turned into positions without GEOPOS.
+
+    Args:
+        scores: Sequence of sorted-set scores
+
+    Returns:
+        tuple: (lng, lat) float arrays holding the cell centres, as GEOPOS would
+    """
+    bits = np.asarray(scores, dtype=np.float64).astype(np.uint64)
+    lat_cells = _compact_bits(bits).astype(np.float64)
+    lng_cells = _compact_bits(bits >> np.uint64(1)).astype(np.float64)
+    scale = float(1 << GEO_STEP)
+    lat = GEO_LAT_MIN + (lat_cells + 0.5) * (GEO_LAT_MAX - GEO_LAT_MIN) / scale
+    lng = GEO_LNG_MIN + (lng_cells + 0.5) * (GEO_LNG_MAX - GEO_LNG_MIN) / scale
+    return lng, lat
+
+
+GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def geohash_encode(lng, lat, precision):
+    """
+    Encode a point as a base32 geohash string of ``precision`` characters.
+    """
+    lat_lo, lat_hi = -90.0, 90.0
+    lng_lo, lng_hi = -180.0, 180.0
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        if even:
+            mid = (lng_lo + lng_hi) / 2
+            if lng >= mid:
+                value = (value << 1) | 1
+                lng_lo = mid
+            else:
+                value <<= 1
+                lng_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if lat >= mid:
+                value = (value << 1) | 1
+                lat_lo = mid
+            else:
+                value <<= 1
+                lat_hi = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_BASE32[value])
+            bits, value = 0, 0
+    return ''.join(chars)
+
+
+def geohash_bbox(cell):
+    """
+    Bounding box of a geohash cell.
+
+    Returns:
+        tuple: (min_lng, min_lat, max_lng, max_lat)
+    """
+    lat_lo, lat_hi = -90.0, 90.0
+    lng_lo, lng_hi = -180.0, 180.0
+    even = True
+    for char in cell:
+        value = GEOHASH_BASE32.index(char)
+        for shift in range(4, -1, -1):
+            bit = (value >> shift) & 1
+            if even:
+                mid = (lng_lo + lng_hi) / 2
+                lng_lo, lng_hi = (mid, lng_hi) if bit else (lng_lo, mid)
+            else:
+                mid = (lat_lo + lat_hi) / 2
+                lat_lo, lat_hi = (mid, lat_hi) if bit else (lat_lo, mid)
+            even = not even
+    return lng_lo, lat_lo, lng_hi, lat_hi
+
+
+def geohash_cell_size(precision):
+    """
+    Size of a geohash cell in degrees.
+
+    Returns:
+        tuple: (lng_degrees, lat_degrees)
+    """
+    total_bits = 5 * precision
+    lng_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 360.0 / (1 << lng_bits), 180.0 / (1 << lat_bits)
+
+
+def geohash_cells(min_lng, min_lat, max_lng, max_lat, precision):
+    """
+    Geohash cells of ``precision`` characters overlapping a bounding box.
+
+    Returns:
+        list: Geohash strings, each cell listed once
+    """
+    cell_lng, cell_lat = geohash_cell_size(precision)
+    min_lat, max_lat = max(min_lat, -90.0), min(max_lat, 90.0)
+    # Insertion-ordered set: boxes wider than the globe revisit cells
+    cells = {}
+    lat = (np.floor((min_lat + 90.0) / cell_lat) + 0.5) * cell_lat - 90.0
+    while lat - cell_lat / 2 <= max_lat and lat < 90.0:
+        lng = (np.floor((min_lng + 180.0) / cell_lng) + 0.5) * cell_lng - 180.0
+        while lng - cell_lng / 2 <= max_lng:
+            # Wrap across the antimeridian
+            wrapped = (lng + 180.0) % 360.0 - 180.0
+            cells[geohash_encode(wrapped, lat, precision)] = None
+            lng += cell_lng
+        lat += cell_lat
+    return list(cells)
+
+
+def geohash_encode_many(lng, lat, precision):
+    """
+    Vectorized geohash_encode over coordinate arrays.
+
+    Returns:
+        ndarray: Geohash strings, one per point
+    """
+    lng = np.asarray(lng, dtype=float).ravel()
+    lat = np.asarray(lat, dtype=float).ravel()
+    total_bits = 5 * precision
+    lng_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    lng_q = np.clip(np.floor((lng + 180.0) / 360.0 * (1 << lng_bits)), 0, (1 << lng_bits) - 1).astype(np.uint64)
+    lat_q = np.clip(np.floor((lat + 90.0) / 180.0 * (1 << lat_bits)), 0, (1 << lat_bits) - 1).astype(np.uint64)
+
+    # Interleave from the most significant bit, longitude first
+    value = np.zeros(len(lng), dtype=np.uint64)
+    for k in range(total_bits):
+        if k % 2 == 0:
+            bit = (lng_q >> np.uint64(lng_bits - 1 - k // 2)) & np.uint64(1)
+        else:
+            bit = (lat_q >> np.uint64(lat_bits - 1 - k // 2)) & np.uint64(1)
+        value = (value << np.uint64(1)) | bit
+
+    alphabet = np.array(list(GEOHASH_BASE32))
+    shifts = np.arange(precision - 1, -1, -1, dtype=np.uint64) * np.uint64(5)
+    chars = alphabet[((value[:, None] >> shifts[None, :]) & np.uint64(31)).astype(np.intp)]
+    return np.ascontiguousarray(chars).view(f'U{precision}').ravel()
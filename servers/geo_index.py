@@ -0,0 +1,239 @@
+import json
+import math
+import time
+import logging
+import threading
+import numpy as np
+import redis
+from django.conf import settings
+from servers.geo import haversine, bounding_box, decode_geo_scores
+
+logger = logging.getLogger(__name__)
+
+
+class GeoIndex:
+    """
+    Per-process grid index over driver positions, mirrored from Redis.
+
+    Members are bucketed into square lat/lng cells; a nearby query gathers
+    the cells overlapping the search circle and ranks the candidates with a
+    vectorized haversine. Each geo shard is seeded from a snapshot and then
+    followed through its own change feed. A driver moving between shards
+    shows up in both feeds in no fixed order, so every member remembers the
+    shard and fix timestamp it was indexed from: older fixes from another
+    shard and removals from a shard it has left are ignored. Queries return
+    None once the last successful sync is older than the staleness bound so
+    callers can fall back to GEOSEARCH.
+    """
+
+    def __init__(self, shards_key, shard_keys, cell_deg, sync_interval, max_staleness):
+        self.shards_key = shards_key
+        self.shard_keys = shard_keys
+        self.cell_deg = cell_deg
+        self.sync_interval = sync_interval
+        self.max_staleness = max_staleness
+        self._positions = {}
+        self._cells = {}
+        self._cell_arrays = {}
+        self._last_ids = {}
+        self._synced_at = 0.0
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+
+    def _cell(self, lng, lat):
+        return math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg)
+
+    def _add(self, member, lng, lat, ts, shard):
+        previous = self._positions.get(member)
+        if previous is not None and previous[4] != shard and previous[2] > ts:
+            return
+        self._remove(member)
+        cell = self._cell(lng, lat)
+        self._positions[member] = (lng, lat, ts, cell, shard)
+        self._cells.setdefault(cell, set()).add(member)
+        self._cell_arrays.pop(cell, None)
+
+    def _remove(self, member, shard=None):
+        previous = self._positions.get(member)
+        if previous is None or shard not in (None, previous[4]):
+            return
+        del self._positions[member]
+        cell = previous[3]
+        members = self._cells.get(cell)
+        if members is not None:
+            members.discard(member)
+            if not members:
+                del self._cells[cell]
+        self._cell_arrays.pop(cell, None)
+
+    def _apply(self, shard, entries):
+        for _, fields in entries:
+            data = json.loads(fields['d'])
+            if fields['op'] == 'add':
+                for member, lng, lat, ts in data:
+                    self._add(member, lng, lat, ts, shard)
+            else:
+                for member in data:
+                    self._remove(member, shard)
+
+    def _load_shards(self, client, shards):
+        # Each feed position is read before its shard, so anything written
+        # while the snapshot is taken is replayed on top of it.
+        pipe = client.pipeline(transaction=False)
+        for shard in shards:
+            keys = self.shard_keys(shard)
+            pipe.xrevrange(keys.changes, count=1)
+            pipe.zrange(keys.geo, 0, -1, withscores=True)
+            pipe.zrange(keys.seen, 0, -1, withscores=True)
+        replies = iter(pipe.execute())
+
+        now, loaded = time.time(), 0
+        with self._lock:
+            shards = set(shards)
+            for member in [m for m, position in self._positions.items() if position[4] in shards]:
+                self._remove(member)
+            for shard in shards:
+                latest, members, seen = next(replies), next(replies), dict(next(replies))
+                lng, lat = decode_geo_scores([score for _, score in members])
+                for (member, _), x, y in zip(members, lng.tolist(), lat.tolist()):
+                    self._add(member, x, y, seen.get(member, now), shard)
+                self._last_ids[shard] = latest[0][0] if latest else '0-0'
+                loaded += len(members)
+        logger.debug("Geo index snapshot loaded: %d members from %d shards", loaded, len(shards))
+
+    def sync(self, client):
+        """
+        Bring the index up to date with Redis.
+
+        Loads shards it has not seen yet, then reads each shard's change
+        feed after the last applied entry; a shard whose feed has been
+        trimmed past that point is reloaded from a snapshot.
+        """
+        shards = client.smembers(self.shards_key)
+        new = [shard for shard in shards if shard not in self._last_ids]
+        pending = [shard for shard in self._last_ids if shard not in new]
+        if new:
+            self._load_shards(client, new)
+
+        batch = settings.GEO_INDEX_SYNC_BATCH
+        while pending:
+            pipe = client.pipeline(transaction=False)
+            for shard in pending:
+                changes = self.shard_keys(shard).changes
+                pipe.xrange(changes, count=1)
+                pipe.xrange(changes, min=f'({self._last_ids[shard]}', count=batch)
+            replies = iter(pipe.execute())
+
+            trimmed, more = [], []
+            with self._lock:
+                for shard in pending:
+                    oldest, entries = next(replies), next(replies)
+                    last_id = self._last_ids[shard]
+                    if oldest and last_id != '0-0' and _stream_id(oldest[0][0]) > _stream_id(last_id):
+                        trimmed.append(shard)
+                        continue
+                    if entries:
+                        self._apply(shard, entries)
+                        self._last_ids[shard] = entries[-1][0]
+                    if len(entries) == batch:
+                        more.append(shard)
+            if trimmed:
+                logger.info("Geo index change feed trimmed past last sync, reloading %d shards", len(trimmed))
+                self._load_shards(client, trimmed)
+            pending = more
+        self._synced_at = time.monotonic()
+
+    def _maybe_sync(self, client):
+        if time.monotonic() - self._synced_at < self.sync_interval:
+            return
+        # Only one thread syncs; the others keep serving the current view
+        if not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            self.sync(client)
+        except redis.RedisError as e:
+            logger.warning(f"Geo index sync failed: {str(e)}")
+        finally:
+            self._sync_lock.release()
+
+    def _cell_array(self, cell):
+        cached = self._cell_arrays.get(cell)
+        if cached is None:
+            members = list(self._cells[cell])
+            coords = np.array([self._positions[m][:3] for m in members], dtype=float).reshape(-1, 3)
+            cached = self._cell_arrays[cell] = (members, coords)
+        return cached
+
+    def nearby(self, client, lng, lat, radius, count, min_seen=None):
+        """
+        Search the index the way GEOSEARCH ... ASC WITHDIST WITHCOORD would.
+
+        Args:
+            min_seen: Optional epoch cutoff; drivers last seen earlier are skipped
+
+        Returns:
+            list: [member, distance_m, (lng, lat)] entries, nearest first
+            None: If the index is older than the staleness bound
+        """
+        self._maybe_sync(client)
+        if time.monotonic() - self._synced_at > self.max_staleness:
+            return None
+
+        min_lng, min_lat, max_lng, max_lat = bounding_box(lng, lat, radius)
+        lat_lo, lng_lo = self._cell(min_lng, min_lat)
+        lat_hi, lng_hi = self._cell(max_lng, max_lat)
+
+        members, blocks = [], []
+        with self._lock:
+            for cell_lat in range(lat_lo, lat_hi + 1):
+                for cell_lng in range(lng_lo, lng_hi + 1):
+                    if (cell_lat, cell_lng) in self._cells:
+                        cell_members, coords = self._cell_array((cell_lat, cell_lng))
+                        members.extend(cell_members)
+                        blocks.append(coords)
+        if not members:
+            return []
+
+        coords = np.concatenate(blocks)
+        dist = haversine(lng, lat, coords[:, 0], coords[:, 1])
+        mask = dist <= radius
+        if min_seen is not None:
+            mask &= coords[:, 2] >= min_seen
+        hits = np.flatnonzero(mask)
+        hits = hits[np.argsort(dist[hits], kind='stable')][:count]
+        return [
+            [members[i], round(float(dist[i]), 4), (float(coords[i, 0]), float(coords[i, 1]))]
+            for i in hits
+        ]
+
+
+def _stream_id(entry_id):
+    ms, _, seq = entry_id.partition('-')
+    return int(ms), int(seq or 0)
+
+
+_geo_index = None
+_geo_index_lock = threading.Lock()
+
+
+def get_geo_index(shards_key, shard_keys):
+    """
+    Return this process's geo index, creating it on first use.
+
+    Args:
+        shards_key: Redis set listing every geo shard cell
+        shard_keys: Callable mapping a shard cell to its keys (geo, seen
+            and changes)
+    """
+    global _geo_index
+    if _geo_index is None:
+        with _geo_index_lock:
+            if _geo_index is None:
+                _geo_index = GeoIndex(
+                    shards_key,
+                    shard_keys,
+                    cell_deg=settings.GEO_INDEX_CELL_DEG,
+                    sync_interval=settings.GEO_INDEX_SYNC_INTERVAL,
+                    max_staleness=settings.GEO_INDEX_MAX_STALENESS,
+                )
+    return _geo_index
@@ -0,0 +1,140 @@
+import logging
+import numpy as np
+from django.conf import settings
+from base.cache import LRUCache, SingleFlight
+from servers.geo import geohash_bbox, geohash_encode, haversine
+from servers.redis import _check_nearby_args, nearby_drivers
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+_results = LRUCache(maxsize=settings.NEARBY_CACHE_SIZE, ttl=settings.NEARBY_CACHE_TTL)
+_flights = SingleFlight()
+
+
+def _bucket(value, buckets):
+    return next((b for b in buckets if b >= value), None)
+
+
+def _fetch_count(count):
+    return min(count * settings.NEARBY_CACHE_OVERFETCH, settings.NEARBY_MAX_COUNT)
+
+
+def _load(key):
+    """
+    Run one covering search for a cache key and store the result.
+
+    The search is centred on the cell and widened by its half diagonal, so
+    it contains every driver within the bucket radius of any point in the
+    cell. It over-fetches so that callers off-centre still get their own
+    nearest drivers after re-ranking.
+    """
+    # Another flight may have filled the key between our miss and our turn
+    drivers = _results.get(key, _MISSING)
+    if drivers is not _MISSING:
+        return drivers
+
+    cell, radius, count, max_age = key
+    min_lng, min_lat, max_lng, max_lat = geohash_bbox(cell)
+    lng, lat = (min_lng + max_lng) / 2, (min_lat + max_lat) / 2
+    half_diagonal = float(haversine(min_lng, min_lat, lng, lat))
+    drivers = nearby_drivers(
+        lng, lat,
+        radius=radius + half_diagonal,
+        count=_fetch_count(count),
+        max_age=max_age,
+    )
+    if drivers is not None:
+        _results.set(key, drivers)
+    return drivers
+
+
+def _rerank(drivers, key, lng, lat, radius, count):
+    """
+    Distances from the caller's own point, filtered to its radius and
+    trimmed to its count.
+
+    Returns:
+        list: Nearby drivers for the caller
+        None: If the cached search was truncated and a driver it left out
+            could still be among the caller's nearest
+    """
+    if not drivers:
+        return []
+    coords = np.array([coords for _, _, coords in drivers], dtype=float)
+    distances = haversine(lng, lat, coords[:, 0], coords[:, 1])
+    order = np.argsort(distances, kind='stable')
+    ranked = []
+    for i in order[:count]:
+        if distances[i] > radius:
+            break
+        member, _, position = drivers[i]
+        ranked.append([member, round(float(distances[i]), 4), position])
+
+    if len(drivers) >= _fetch_count(key[2]):
+        # Drivers the search left out are at least as far from the cell
+        # centre as its last result, so at least that minus our offset from
+        # the centre away from us
+        min_lng, min_lat, max_lng, max_lat = geohash_bbox(key[0])
+        offset = float(haversine(lng, lat, (min_lng + max_lng) / 2, (min_lat + max_lat) / 2))
+        bound = float(drivers[-1][1]) - offset
+        if (ranked[-1][1] if len(ranked) == count else radius) > bound:
+            return None
+    return ranked
+
+
+def cached_nearby_drivers(lng, lat, radius=1000, count=10, max_age=None):
+    """
+    nearby_drivers behind a short-lived in-process result cache.
+
+    Requests are keyed on the geohash cell of the point plus the radius and
+    count rounded up to the configured buckets, so riders in the same
+    neighbourhood share one Redis search per NEARBY_CACHE_TTL. Concurrent
+    misses for a key wait on a single search instead of each running their
+    own. Distances are recomputed from the caller's point; when the shared
+    result cannot prove it holds the caller's nearest drivers the caller
+    searches Redis directly. Requests beyond the largest bucket, or with
+    NEARBY_CACHE_TTL at 0, go straight to Redis.
+
+    Args:
+        lng: Longitude coordinate
+        lat: Latitude coordinate
+        radius: Search radius in meters (default: 1000)
+        count: Maximum number of results (default: 10)
+        max_age: Skip drivers whose last fix is older than this many seconds
+
+    Returns:
+        list: List of nearby drivers with distance and coordinates
+        None: If operation fails
+    """
+    radius_bucket = _bucket(radius, settings.NEARBY_CACHE_RADII)
+    count_bucket = _bucket(count, settings.NEARBY_CACHE_COUNTS)
+    if settings.NEARBY_CACHE_TTL <= 0 or radius_bucket is None or count_bucket is None:
+        return nearby_drivers(lng, lat, radius=radius, count=count, max_age=max_age)
+
+    try:
+        _check_nearby_args(lng, lat, radius, count, max_age)
+    except ValueError as e:
+        logger.warning(f"Validation error in cached_nearby_drivers: {str(e)}")
+        return None
+
+    lng, lat = float(lng), float(lat)
+    key = (geohash_encode(lng, lat, settings.NEARBY_CACHE_PRECISION), radius_bucket, count_bucket, max_age)
+    drivers = _results.get(key, _MISSING)
+    if drivers is _MISSING:
+        drivers = _flights.do(key, lambda: _load(key))
+    if drivers is None:
+        return None
+    ranked = _rerank(drivers, key, lng, lat, radius, count)
+    if ranked is None:
+        return nearby_drivers(lng, lat, radius=radius, count=count, max_age=max_age)
+    return ranked
+
+
+def cache_stats():
+    """
+    Returns:
+        dict: Hit and miss counters and current size of the result cache
+    """
+    return _results.stats()
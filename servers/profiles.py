@@ -0,0 +1,103 @@
+import logging
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from base.cache import TwoTierCache
+from servers.driver.models import Driver
+from servers.rider.models import Rider
+
+logger = logging.getLogger(__name__)
+
+User = get_user_model()
+
+# Driver/Rider rows keyed by "<profile>:<user id>"; None records "no profile"
+PROFILES = TwoTierCache(
+    'profile',
+    maxsize=settings.PROFILE_CACHE_LOCAL_SIZE,
+    local_ttl=settings.PROFILE_CACHE_LOCAL_TTL,
+    remote_ttl=settings.PROFILE_CACHE_TTL,
+)
+
+_MODELS = {'driver': Driver, 'rider': Rider}
+_MISSING = object()
+
+
+def _key(name, user_id):
+    return f'{name}:{user_id}'
+
+
+def _get_profile(name, user):
+    if not isinstance(user, User):
+        # Token users already carry the profile id
+        return getattr(user, name)
+
+    key = _key(name, user.pk)
+    profile = PROFILES.get(key, _MISSING)
+    if profile is _MISSING:
+        profile = _MODELS[name].objects.filter(user_id=user.pk).first()
+        PROFILES.set(key, profile)
+    if profile is None:
+        raise AttributeError(f"User has no {name} profile")
+    return profile
+
+
+def get_driver_profile(user):
+    """
+    Driver profile of a user, read through the profile cache.
+
+    Args:
+        user: request.user, a User or a user built from token claims
+
+    Returns:
+        Driver: The cached row, or a ProfileRef for token users
+
+    Raises:
+        AttributeError: If the user has no driver profile, like user.driver
+    """
+    return _get_profile('driver', user)
+
+
+def get_rider_profile(user):
+    """
+    Rider profile of a user, read through the profile cache.
+
+    Args:
+        user: request.user, a User or a user built from token claims
+
+    Returns:
+        Rider: The cached row, or a ProfileRef for token users
+
+    Raises:
+        AttributeError: If the user has no rider profile, like user.rider
+    """
+    return _get_profile('rider', user)
+
+
+def invalidate_profile(name, user_id):
+    """
+    Drop a cached profile now and again once the current transaction
+    commits, so a concurrent read can't re-cache the uncommitted state.
+    Other processes keep their copy for up to PROFILE_CACHE_LOCAL_TTL.
+    """
+    key = _key(name, user_id)
+    PROFILES.delete(key)
+    transaction.on_commit(lambda: PROFILES.delete(key))
+
+
+def _invalidate_driver(sender, instance, **kwargs):
+    invalidate_profile('driver', instance.user_id_id)
+
+
+def _invalidate_rider(sender, instance, **kwargs):
+    invalidate_profile('rider', instance.user_id_id)
+
+
+def connect():
+    """
+    Invalidate cached profiles whenever a Driver or Rider is saved or deleted.
+    """
+    post_save.connect(_invalidate_driver, sender=Driver, dispatch_uid='profile_driver_saved')
+    post_delete.connect(_invalidate_driver, sender=Driver, dispatch_uid='profile_driver_deleted')
+    post_save.connect(_invalidate_rider, sender=Rider, dispatch_uid='profile_rider_saved')
+    post_delete.connect(_invalidate_rider, sender=Rider, dispatch_uid='profile_rider_deleted')
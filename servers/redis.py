@@ -1,26 +1,426 @@
+import zlib
 import redis
+import time
+import heapq
 import logging
+from collections import namedtuple
+import numpy as np
 from django.conf import settings
+from base.redis_metrics import register_key_prefixes
+from servers.geo import geohash_encode, geohash_cells, bounding_box, decode_geo_scores
+from servers.geo_index import get_geo_index
+from servers.redis_pool import get_redis_client, script_client
 
 logger = logging.getLogger(__name__)
 
-# Initialize Redis client with connection pool and error handling
-try:
-    redis_client = redis.Redis.from_url(
-        settings.REDIS_URL + '/2',
-        decode_responses=True,
-        socket_connect_timeout=5,
-        socket_keepalive=True,
-        socket_keepalive_options={} if hasattr(redis, 'SOCKET_KEEPALIVE_OPTIONS') else None
+# Every key below carries a hash tag, and each script and multi-key command
+# only touches keys sharing one tag, so the store can be spread over a Redis
+# Cluster. Searchable positions are sharded by geohash cell; per-driver state
+# is partitioned into GEO_OWNER_BUCKETS buckets by driver.
+GEO_KEY = 'drivers:geo'
+# Set of every shard cell in use
+GEO_SHARDS_KEY = 'drivers:geo:shards'
+# Bucket keys: member -> shard cell the driver is searchable in, and
+# member -> epoch seconds of the driver's latest location fix
+GEO_OWNER_KEY = 'drivers:geo:owner'
+GEO_SEEN_KEY = 'drivers:geo:seen'
+# Bucket keys for reserved drivers: member -> reservation expiry (epoch
+# seconds, +inf once held for an active ride), the ride holding them, and
+# their positions and cells while out of the searchable shards
+GEO_RESERVED_KEY = 'drivers:geo:reserved'
+GEO_RESERVED_RIDE_KEY = 'drivers:geo:reserved:ride'
+GEO_RESERVED_POS_KEY = 'drivers:geo:reserved:pos'
+GEO_RESERVED_CELL_KEY = 'drivers:geo:reserved:cell'
+
+# Cell of the only shard when GEO_SHARD_PRECISION is 0; never a geohash
+GLOBAL_CELL = 'all'
+
+register_key_prefixes(
+    GEO_KEY, GEO_SHARDS_KEY, GEO_OWNER_KEY, GEO_SEEN_KEY,
+    GEO_RESERVED_KEY, GEO_RESERVED_RIDE_KEY, GEO_RESERVED_POS_KEY, GEO_RESERVED_CELL_KEY,
+)
+
+# Keys of one shard: searchable positions, member -> timestamp of the fix
+# they were written with, member -> time they were last moved out (so a
+# delayed older write can't put them back), and the change feed
+ShardKeys = namedtuple('ShardKeys', 'geo seen gone changes')
+# Keys of one owner bucket, in script KEYS order
+BucketKeys = namedtuple('BucketKeys', 'owner seen reserved ride pos cell')
+
+# With a freshness filter, GEOSEARCH starts at this many times the wanted
+# count and grows by the same factor while stale drivers crowd out fresh ones
+STALE_OVERFETCH = 2
+
+# Redis stores positions as 52-bit geohashes and rejects latitudes outside
+# this band, which would fail a whole multi-member GEOADD.
+GEO_LAT_LIMIT = 85.05112878
+
+# Location writes go through the driver's owner bucket first. ARGV: now,
+# then member, cell, lng, lat, ts per entry. Per entry, returns 0 for a fix
+# older than the newest one seen, 1 for a reserved driver (only their
+# reserved position moves), or else the cell they were searchable in
+# before ('' if none) after recording the new one.
+_OWNER_WRITE_LUA = """
+local now = tonumber(ARGV[1])
+local out = {}
+for i = 2, #ARGV, 5 do
+    local member, cell, lng, lat, ts = ARGV[i], ARGV[i + 1], ARGV[i + 2], ARGV[i + 3], tonumber(ARGV[i + 4])
+    local seen = redis.call('ZSCORE', KEYS[2], member)
+    if seen and tonumber(seen) > ts then
+        out[#out + 1] = 0
+    else
+        redis.call('ZADD', KEYS[2], ts, member)
+        local reserved = redis.call('ZSCORE', KEYS[3], member)
+        if reserved and tonumber(reserved) > now then
+            redis.call('GEOADD', KEYS[5], lng, lat, member)
+            redis.call('HSET', KEYS[6], member, cell)
+            out[#out + 1] = 1
+        else
+            if reserved then
+                redis.call('ZREM', KEYS[3], member)
+                redis.call('HDEL', KEYS[4], member)
+                redis.call('ZREM', KEYS[5], member)
+                redis.call('HDEL', KEYS[6], member)
+            end
+            out[#out + 1] = redis.call('HGET', KEYS[1], member) or ''
+            redis.call('HSET', KEYS[1], member, cell)
+        end
+    end
+end
+return out
+"""
+
+# Apply adds and removals to one shard. ARGV: prune cutoff for tombstones,
+# publish flag, stream maxlen, then op, member, lng, lat, ts per entry.
+# "a" adds a fix newer than both the shard's copy and its tombstone, "f"
+# (a released reservation) also one exactly as new; "r" removes a member
+# whose copy is no newer than ts and leaves a tombstone at ts. Cross-shard
+# moves are ordered by these timestamps instead of one atomic step.
+# Returns whether the shard was created, and the add and removal counts.
+_SHARD_WRITE_LUA = """
+local publish, maxlen = ARGV[2] == '1', ARGV[3]
+local function score(key, member)
+    local value = redis.call('ZSCORE', key, member)
+    return value and tonumber(value) or -math.huge
+end
+local created = redis.call('EXISTS', KEYS[1]) == 0
+redis.call('ZREMRANGEBYSCORE', KEYS[3], '-inf', ARGV[1])
+local added, removed = {}, {}
+for i = 4, #ARGV, 5 do
+    local op, member, ts = ARGV[i], ARGV[i + 1], tonumber(ARGV[i + 4])
+    local seen = score(KEYS[2], member)
+    if op == 'r' then
+        if seen <= ts then
+            if redis.call('ZREM', KEYS[1], member) == 1 then removed[#removed + 1] = member end
+            redis.call('ZREM', KEYS[2], member)
+        end
+        redis.call('ZADD', KEYS[3], 'GT', ts, member)
+    else
+        local gone = score(KEYS[3], member)
+        local newest = math.max(seen, gone)
+        if ts > newest or (op == 'f' and ts == newest) then
+            local lng, lat = ARGV[i + 2], ARGV[i + 3]
+            redis.call('GEOADD', KEYS[1], lng, lat, member)
+            redis.call('ZADD', KEYS[2], ts, member)
+            if gone > -math.huge then redis.call('ZREM', KEYS[3], member) end
+            added[#added + 1] = {member, tonumber(lng), tonumber(lat), ts}
+        end
+    end
+end
+if publish and #added > 0 then
+    redis.call('XADD', KEYS[4], 'MAXLEN', '~', maxlen, '*', 'op', 'add', 'd', cjson.encode(added))
+end
+if publish and #removed > 0 then
+    redis.call('XADD', KEYS[4], 'MAXLEN', '~', maxlen, '*', 'op', 'rem', 'd', cjson.encode(removed))
+end
+return {(created and #added > 0) and 1 or 0, #added, #removed}
+"""
+
+# ARGV: now, ttl, then member, ride, cell, lng, lat per driver; cell is the
+# shard the caller found the driver in and lng/lat their position there.
+# A driver is taken only if not already reserved and still searchable in
+# that cell. Returns, per driver, the timestamp of their latest fix (the
+# fence for removing them from the shard) or 0 if not taken.
+_OWNER_RESERVE_LUA = """
+local now, ttl = tonumber(ARGV[1]), tonumber(ARGV[2])
+local taken = {}
+for i = 3, #ARGV, 5 do
+    local member, ride, cell, lng, lat = ARGV[i], ARGV[i + 1], ARGV[i + 2], ARGV[i + 3], ARGV[i + 4]
+    local reserved = redis.call('ZSCORE', KEYS[3], member)
+    local ok = 0
+    if cell ~= '' and (not reserved or tonumber(reserved) <= now) and redis.call('HGET', KEYS[1], member) == cell then
+        redis.call('HDEL', KEYS[1], member)
+        redis.call('ZADD', KEYS[3], now + ttl, member)
+        redis.call('HSET', KEYS[4], member, ride)
+        redis.call('GEOADD', KEYS[5], lng, lat, member)
+        redis.call('HSET', KEYS[6], member, cell)
+        ok = redis.call('ZSCORE', KEYS[2], member) or tostring(now)
+    end
+    taken[#taken + 1] = ok
+end
+return taken
+"""
+
+# ARGV: member, ride ('' for any). Returns 0 if not released, else the
+# cell, position and latest fix timestamp to put back into that cell's
+# shard.
+_OWNER_RELEASE_LUA = """
+local member, ride = ARGV[1], ARGV[2]
+if ride ~= '' and redis.call('HGET', KEYS[4], member) ~= ride then return 0 end
+local pos = redis.call('GEOPOS', KEYS[5], member)[1]
+local cell = redis.call('HGET', KEYS[6], member)
+redis.call('ZREM', KEYS[3], member)
+redis.call('HDEL', KEYS[4], member)
+redis.call('ZREM', KEYS[5], member)
+redis.call('HDEL', KEYS[6], member)
+if not pos or not cell then return 0 end
+redis.call('HSET', KEYS[1], member, cell)
+return {cell, pos[1], pos[2], redis.call('ZSCORE', KEYS[2], member) or '0'}
+"""
+
+# ARGV: member/ride pairs. Drops the expiry of reservations still held by
+# the given ride, so they last until released. KEYS are a bucket's
+# reserved and ride keys.
+_HOLD_LUA = """
+local held = {}
+for i = 1, #ARGV, 2 do
+    local ok = 0
+    if redis.call('HGET', KEYS[2], ARGV[i]) == ARGV[i + 1] and redis.call('ZSCORE', KEYS[1], ARGV[i]) then
+        redis.call('ZADD', KEYS[1], '+inf', ARGV[i])
+        ok = 1
+    end
+    held[#held + 1] = ok
+end
+return held
+"""
+
+# ARGV: member. Drops the driver's bucket state; returns the cell they were
+# searchable in ('' if none) and whether they were reserved.
+_OWNER_REMOVE_LUA = """
+local member = ARGV[1]
+local cell = redis.call('HGET', KEYS[1], member) or ''
+redis.call('HDEL', KEYS[1], member)
+redis.call('ZREM', KEYS[2], member)
+redis.call('ZREM', KEYS[3], member)
+redis.call('HDEL', KEYS[4], member)
+redis.call('HDEL', KEYS[6], member)
+return {cell, redis.call('ZREM', KEYS[5], member)}
+"""
+
+# ARGV: now, cutoff, then members. Drops the bucket state of drivers whose
+# latest fix is still no newer than cutoff. Per member, returns the cell
+# they were searchable in ('' if none), 0 if kept for an unexpired
+# reservation, or -1 if they pinged since.
+_OWNER_EVICT_LUA = """
+local now, cutoff = tonumber(ARGV[1]), tonumber(ARGV[2])
+local out = {}
+for i = 3, #ARGV do
+    local member = ARGV[i]
+    local seen = redis.call('ZSCORE', KEYS[2], member)
+    local reserved = redis.call('ZSCORE', KEYS[3], member)
+    if not seen or tonumber(seen) > cutoff then
+        out[#out + 1] = -1
+    elseif reserved and tonumber(reserved) > now then
+        out[#out + 1] = 0
+    else
+        out[#out + 1] = redis.call('HGET', KEYS[1], member) or ''
+        redis.call('HDEL', KEYS[1], member)
+        redis.call('ZREM', KEYS[2], member)
+        redis.call('ZREM', KEYS[3], member)
+        redis.call('HDEL', KEYS[4], member)
+        redis.call('ZREM', KEYS[5], member)
+        redis.call('HDEL', KEYS[6], member)
+    end
+end
+return out
+"""
+
+LUA_SCRIPTS = {
+    'owner_write': _OWNER_WRITE_LUA,
+    'shard_write': _SHARD_WRITE_LUA,
+    'owner_reserve': _OWNER_RESERVE_LUA,
+    'owner_release': _OWNER_RELEASE_LUA,
+    'owner_hold': _HOLD_LUA,
+    'owner_remove': _OWNER_REMOVE_LUA,
+    'owner_evict': _OWNER_EVICT_LUA,
+}
+_scripts = {name: script_client().register_script(source) for name, source in LUA_SCRIPTS.items()}
+
+
+def _cell(lng, lat):
+    """
+    Shard cell owning a position: its geohash of GEO_SHARD_PRECISION
+    characters, or GLOBAL_CELL with a precision of 0.
+    """
+    precision = settings.GEO_SHARD_PRECISION
+    if precision <= 0:
+        return GLOBAL_CELL
+    return geohash_encode(lng, lat, precision)
+
+
+def _shard_keys(cell):
+    key = f'{GEO_KEY}:{{{cell}}}'
+    return ShardKeys(key, f'{key}:seen', f'{key}:gone', f'{key}:changes')
+
+
+def _shard_key(lng, lat):
+    """
+    Geo key a position is searchable in.
+    """
+    return _shard_keys(_cell(lng, lat)).geo
+
+
+def _search_cells(lng, lat, radius):
+    """
+    Shard cells overlapping a search circle.
+    """
+    precision = settings.GEO_SHARD_PRECISION
+    if precision <= 0:
+        return [GLOBAL_CELL]
+    return geohash_cells(*bounding_box(lng, lat, radius), precision)
+
+
+def _bucket(member):
+    return zlib.crc32(member.encode()) % settings.GEO_OWNER_BUCKETS
+
+
+def _bucket_keys(bucket):
+    tag = f'{{o{bucket}}}'
+    return BucketKeys(
+        f'{GEO_OWNER_KEY}:{tag}', f'{GEO_SEEN_KEY}:{tag}', f'{GEO_RESERVED_KEY}:{tag}',
+        f'{GEO_RESERVED_RIDE_KEY}:{tag}', f'{GEO_RESERVED_POS_KEY}:{tag}', f'{GEO_RESERVED_CELL_KEY}:{tag}',
     )
-    # Test the connection
-    redis_client.ping()
-    logger.info("Redis connection established successfully")
-except (redis.ConnectionError, redis.TimeoutError, Exception) as e:
-    logger.error(f"Failed to connect to Redis: {str(e)}")
-    redis_client = None
 
-GEO_KEY = 'drivers:geo'
+
+def _member_keys(member):
+    """
+    Owner bucket keys holding a driver's state.
+    """
+    return _bucket_keys(_bucket(member))
+
+
+def _by_bucket(items, member=lambda item: item[0]):
+    """
+    Group items by the owner bucket of their member, keeping input order
+    within each group.
+    """
+    groups = {}
+    for item in items:
+        groups.setdefault(_bucket(member(item)), []).append(item)
+    return groups
+
+
+def _run_steps(client, steps):
+    """
+    Drive a store protocol on a sync client.
+
+    Protocols are generators yielding lists of (name, keys, args) calls:
+    a script from LUA_SCRIPTS, or any other name as a client command
+    taking keys then args. Each list runs as one pipeline, whose replies
+    are sent back into the generator; its return value is returned.
+    """
+    replies = None
+    while True:
+        try:
+            calls = steps.send(replies)
+        except StopIteration as stop:
+            return stop.value
+        pipe = client.pipeline(transaction=False)
+        for name, keys, args in calls:
+            script = _scripts.get(name)
+            if script is None:
+                getattr(pipe, name)(*keys, *args)
+            else:
+                script(keys=keys, args=args, client=pipe)
+        replies = pipe.execute()
+
+
+def _shard_steps(ops, now):
+    """
+    Apply (op, member, lng, lat, ts) entries to their shards, one script
+    call per cell; see _SHARD_WRITE_LUA. Newly created shards are added
+    to GEO_SHARDS_KEY.
+
+    Args:
+        ops: Dict of cell -> list of entries
+        now: Epoch time of the operation
+
+    Returns:
+        tuple: (added, removed) member counts
+    """
+    cells = list(ops)
+    if not cells:
+        return 0, 0
+    head = [now - settings.DRIVER_LOCATION_TTL, '1' if settings.GEO_INDEX_ENABLED else '0', settings.GEO_CHANGES_MAXLEN]
+    calls = []
+    for cell in cells:
+        args = list(head)
+        for op in ops[cell]:
+            args.extend(op)
+        calls.append(('shard_write', list(_shard_keys(cell)), args))
+    replies = yield calls
+
+    created = [cell for cell, (new, _, _) in zip(cells, replies) if new]
+    if created:
+        yield [('sadd', [GEO_SHARDS_KEY], created)]
+    return sum(reply[1] for reply in replies), sum(reply[2] for reply in replies)
+
+
+def _write_steps(entries):
+    """
+    Protocol writing (member, lng, lat, ts) entries.
+
+    Each driver's owner bucket decides first: it drops fixes older than
+    the newest one seen, keeps reserved drivers out of the searchable
+    shards and records the cell the driver is in now. The shards then add
+    drivers to that cell and drop those that left another.
+
+    Returns:
+        int: Drivers added to a searchable shard
+    """
+    now = time.time()
+    groups = _by_bucket([(member, _cell(lng, lat), lng, lat, ts) for member, lng, lat, ts in entries])
+    calls = []
+    for bucket, group in groups.items():
+        args = [now]
+        for entry in group:
+            args.extend(entry)
+        calls.append(('owner_write', list(_bucket_keys(bucket)), args))
+    replies = yield calls
+
+    ops = {}
+    for group, reply in zip(groups.values(), replies):
+        for (member, cell, lng, lat, ts), previous in zip(group, reply):
+            # Stale fixes and reserved drivers don't touch the shards
+            if not isinstance(previous, str):
+                continue
+            ops.setdefault(cell, []).append(('a', member, lng, lat, ts))
+            if previous and previous != cell:
+                ops.setdefault(previous, []).append(('r', member, 0, 0, ts))
+    added, _ = yield from _shard_steps(ops, now)
+    return added
+
+
+def _remove_steps(member):
+    """
+    Protocol removing a driver from the store.
+
+    Returns:
+        bool: Whether the driver was searchable or reserved
+    """
+    now = time.time()
+    (cell, reserved), = yield [('owner_remove', list(_member_keys(member)), [member])]
+    removed = 0
+    if cell:
+        _, removed = yield from _shard_steps({cell: [('r', member, 0, 0, now)]}, now)
+    return bool(removed or reserved)
+
+
+def _write_locations(client, entries):
+    """
+    Write (member, lng, lat, ts) entries to their owning geo shards.
+    """
+    _run_steps(client, _write_steps(entries))
 
 
 def _validate_coordinates(lng, lat):
@@ -29,7 +429,7 @@ def _validate_coordinates(lng, lat):
     
     Args:
         lng: Longitude value (-180 to 180)
-        lat: Latitude value (-90 to 90)
+        lat: Latitude value (within GEO_LAT_LIMIT, which Redis GEO accepts)
     
     Returns:
         tuple: (is_valid, error_message)
@@ -42,12 +442,14 @@ def _validate_coordinates(lng, lat):
     
     if not (-180 <= lng <= 180):
         return False, "Longitude must be between -180 and 180"
-    if not (-90 <= lat <= 90):
-        return False, "Latitude must be between -90 and 90"
+    if not (-GEO_LAT_LIMIT <= lat <= GEO_LAT_LIMIT):
+        return False, f"Latitude must be between -{GEO_LAT_LIMIT} and {GEO_LAT_LIMIT}"
     
     return True, None
 
 
+
+
 def add_driver_location(driver_id, lng, lat):
     """
     Add or update driver location in Redis geospatial index.
@@ -64,7 +466,8 @@ def add_driver_location(driver_id, lng, lat):
         ValueError: If coordinates are invalid
         redis.RedisError: If Redis operation fails
     """
-    if redis_client is None:
+    client = get_redis_client()
+    if client is None:
         logger.error("Redis client not available")
         return {"success": False, "error": "Redis connection unavailable"}
     
@@ -78,14 +481,10 @@ def add_driver_location(driver_id, lng, lat):
             raise ValueError(error_msg)
         
         member = f'driver:{driver_id}'
-        result = redis_client.geoadd(GEO_KEY, [(lng, lat, member)])
+        _write_locations(client, [(member, float(lng), float(lat), time.time())])
         
-        if result is not None:
-            logger.info(f"Driver {driver_id} location updated: lng={lng}, lat={lat}")
-            return {"success": True, "message": "Location added successfully"}
-        else:
-            logger.warning(f"Failed to add driver {driver_id} location")
-            return {"success": False, "error": "Failed to add location"}
+        logger.debug("Driver %s location updated: lng=%s, lat=%s", driver_id, lng, lat)
+        return {"success": True, "message": "Location added successfully"}
             
     except ValueError as e:
         logger.warning(f"Validation error for driver {driver_id}: {str(e)}")
@@ -98,51 +497,287 @@ def add_driver_location(driver_id, lng, lat):
         return {"success": False, "error": "An unexpected error occurred"}
 
 
-def nearby_drivers(lng, lat, radius=1000, count=10):
+
+def _timestamp_window(now):
     """
-    Search for nearby drivers within a specified radius.
+    Oldest and newest client timestamps accepted at epoch time now.
+    
+    A fix older than DRIVER_LOCATION_TTL would be evicted straight away,
+    and one from the future would keep a driver looking fresh after they
+    went offline.
+    """
+    return now - settings.DRIVER_LOCATION_TTL, now + settings.DRIVER_LOCATION_MAX_FUTURE
+
+
+def _coerce_float(value):
+    """
+    Convert a value to float, mapping anything unparsable to NaN.
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _validate_location_batch(items):
+    """
+    Validate a batch of location tuples in one vectorized pass.
     
     Args:
-        lng: Longitude coordinate
-        lat: Latitude coordinate
-        radius: Search radius in meters (default: 1000)
-        count: Maximum number of results (default: 10)
+        items: Sequence of (driver_id, lng, lat, ts) tuples
     
     Returns:
-        list: List of nearby drivers with distance and coordinates
-        None: If operation fails
+        tuple: (lng, lat, ts, errors) where the first three are float arrays
+        and errors holds None for valid rows or an error message otherwise
     """
-    if redis_client is None:
-        logger.error("Redis client not available for nearby_drivers query")
-        return None
+    now = time.time()
+    values = np.array(
+        [
+            (
+                _coerce_float(lng),
+                _coerce_float(lat),
+                now if ts is None else _coerce_float(ts),
+            )
+            for _, lng, lat, ts in items
+        ],
+        dtype=float,
+    ).reshape(-1, 3)
+    lng, lat, ts = values[:, 0], values[:, 1], values[:, 2]
+    
+    errors = np.full(len(items), None, dtype=object)
+    earliest, latest = _timestamp_window(now)
+    errors[ts < earliest] = f"Timestamp must be within the last {settings.DRIVER_LOCATION_TTL} seconds"
+    errors[ts > latest] = "Timestamp must not be in the future"
+    errors[~np.isfinite(ts)] = "Timestamp must be a valid epoch number"
+    errors[np.abs(lat) > GEO_LAT_LIMIT] = f"Latitude must be between -{GEO_LAT_LIMIT} and {GEO_LAT_LIMIT}"
+    errors[np.abs(lng) > 180] = "Longitude must be between -180 and 180"
+    errors[~(np.isfinite(lng) & np.isfinite(lat))] = "Longitude and latitude must be valid numbers"
+    errors[np.array([not driver_id for driver_id, *_ in items], dtype=bool)] = "driver_id cannot be empty"
+    
+    return lng, lat, ts, errors
+
+
+def _prepare_location_batch(items):
+    """
+    Validate a batch and keep the newest valid fix per driver.
+    
+    Returns:
+        tuple: ((member, lng, lat, ts) entries to write, per-item results)
+    """
+    lng, lat, ts, errors = _validate_location_batch(items)
+    
+    # Keep the newest valid fix per driver
+    latest = {}
+    for index, (driver_id, *_) in enumerate(items):
+        if errors[index] is not None:
+            continue
+        previous = latest.get(driver_id)
+        if previous is None or ts[index] >= ts[previous]:
+            latest[driver_id] = index
+    
+    results = []
+    for index, (driver_id, *_) in enumerate(items):
+        if errors[index] is not None:
+            results.append({"driver_id": driver_id, "success": False, "error": errors[index]})
+        elif latest[driver_id] != index:
+            results.append({"driver_id": driver_id, "success": True, "message": "Superseded by a newer location"})
+        else:
+            results.append({"driver_id": driver_id, "success": True, "message": "Location added successfully"})
+    
+    entries = [
+        (f'driver:{driver_id}', float(lng[index]), float(lat[index]), float(ts[index]))
+        for driver_id, index in latest.items()
+    ]
+    return entries, results
+
+
+def add_driver_locations(items):
+    """
+    Add or update many driver locations with a single pipelined GEOADD.
+    
+    When a driver appears more than once in the batch only the entry with
+    the newest timestamp is written; older ones are reported as superseded.
+    
+    Args:
+        items: Sequence of (driver_id, lng, lat, ts) tuples, ts being an
+            epoch timestamp in seconds or None for "now"
+    
+    Returns:
+        dict: Status, accepted count and per-item results in input order
+    """
+    client = get_redis_client()
+    if client is None:
+        logger.error("Redis client not available")
+        return {"success": False, "error": "Redis connection unavailable"}
+    
+    items = list(items)
+    if not items:
+        return {"success": True, "accepted": 0, "results": []}
     
     try:
-        # Validate inputs
-        is_valid, error_msg = _validate_coordinates(lng, lat)
-        if not is_valid:
-            raise ValueError(error_msg)
-        
-        if radius <= 0:
-            raise ValueError("Radius must be greater than 0")
-        
-        if count <= 0:
-            raise ValueError("Count must be greater than 0")
+        entries, results = _prepare_location_batch(items)
+        if entries:
+            _write_locations(client, entries)
         
-        drivers = redis_client.geosearch(
-            GEO_KEY,
+        logger.debug("Batch location update: %d stored, %d skipped", len(entries), len(items) - len(entries))
+        return {"success": True, "accepted": len(entries), "results": results}
+    
+    except redis.RedisError as e:
+        logger.error(f"Redis error during batch location update: {str(e)}")
+        return {"success": False, "error": "Database operation failed"}
+    except Exception as e:
+        logger.error(f"Unexpected error during batch location update: {str(e)}")
+        return {"success": False, "error": "An unexpected error occurred"}
+
+
+
+def _check_nearby_args(lng, lat, radius, count, max_age):
+    """
+    Validate nearby search arguments.
+    
+    Returns:
+        float: Epoch cutoff for the freshness filter, or None
+    
+    Raises:
+        ValueError: If an argument is invalid
+    """
+    is_valid, error_msg = _validate_coordinates(lng, lat)
+    if not is_valid:
+        raise ValueError(error_msg)
+    
+    if not 0 < radius <= settings.NEARBY_MAX_RADIUS:
+        raise ValueError(f"Radius must be greater than 0 and at most {settings.NEARBY_MAX_RADIUS}")
+    
+    if not 0 < count <= settings.NEARBY_MAX_COUNT:
+        raise ValueError(f"Count must be greater than 0 and at most {settings.NEARBY_MAX_COUNT}")
+    
+    if max_age is not None and max_age <= 0:
+        raise ValueError("max_age must be greater than 0")
+    
+    return None if max_age is None else time.time() - max_age
+
+
+def _queue_nearby_search(pipe, lng, lat, radius, fetch):
+    """
+    Queue a GEOSEARCH on every shard the search circle overlaps.
+
+    Returns:
+        list: Cells searched, in queue order
+    """
+    cells = _search_cells(float(lng), float(lat), radius)
+    for cell in cells:
+        pipe.geosearch(
+            _shard_keys(cell).geo,
             longitude=lng,
             latitude=lat,
             radius=radius,
-            count=count,
+            count=fetch,
             unit='m',
             sort='ASC',
             withdist=True,
             withcoord=True
         )
-        
-        logger.info(f"Found {len(drivers) if drivers else 0} nearby drivers at lng={lng}, lat={lat}")
+    return cells
+
+
+def _queue_seen(pipe, cells, replies):
+    """
+    Queue a lookup of the fix timestamps of each shard's search results.
+    """
+    for cell, reply in zip(cells, replies):
+        if reply:
+            pipe.zmscore(_shard_keys(cell).seen, [member for member, *_ in reply])
+
+
+def _filter_fresh(replies, seen, min_seen):
+    """
+    Drop drivers last seen before min_seen from per-shard replies, given
+    the _queue_seen replies.
+    """
+    seen = iter(seen)
+    return [
+        [d for d, ts in zip(reply, next(seen)) if ts is not None and ts >= min_seen] if reply else []
+        for reply in replies
+    ]
+
+
+def _merge_nearby(replies, count):
+    """
+    Merge per-shard GEOSEARCH replies by distance.
+
+    A driver caught in two shards while moving between them is kept once,
+    at the nearer position.
+    """
+    merged, members = [], set()
+    for driver in heapq.merge(*replies, key=lambda d: d[1]):
+        if len(merged) == count:
+            break
+        if driver[0] not in members:
+            members.add(driver[0])
+            merged.append(driver)
+    return merged
+
+
+def _search_exhausted(replies, fetch):
+    """
+    Whether per-shard GEOSEARCH replies hold everyone inside the radius.
+    """
+    return all(len(reply) < fetch for reply in replies)
+
+
+def nearby_drivers(lng, lat, radius=1000, count=10, max_age=None):
+    """
+    Search for nearby drivers within a specified radius.
+
+    Args:
+        lng: Longitude coordinate
+        lat: Latitude coordinate
+        radius: Search radius in meters (default: 1000)
+        count: Maximum number of results (default: 10)
+        max_age: Skip drivers whose last fix is older than this many seconds
+            (default: None, no freshness filter)
+
+    Returns:
+        list: List of nearby drivers with distance and coordinates
+        None: If operation fails
+    """
+    client = get_redis_client()
+    if client is None:
+        logger.error("Redis client not available for nearby_drivers query")
+        return None
+
+    try:
+        min_seen = _check_nearby_args(lng, lat, radius, count, max_age)
+
+        if settings.GEO_INDEX_ENABLED:
+            drivers = get_geo_index(GEO_SHARDS_KEY, _shard_keys).nearby(
+                client, float(lng), float(lat), radius, count, min_seen=min_seen
+            )
+            if drivers is not None:
+                return drivers
+            logger.warning("Geo index is stale, falling back to GEOSEARCH")
+
+        fetch = count if min_seen is None else count * STALE_OVERFETCH
+        while True:
+            # Fan out to every shard the search circle overlaps and merge by distance
+            pipe = client.pipeline(transaction=False)
+            cells = _queue_nearby_search(pipe, lng, lat, radius, fetch)
+            replies = pipe.execute()
+            if min_seen is None:
+                drivers = _merge_nearby(replies, count)
+                break
+
+            # Widen the search until enough drivers are fresh or none are left
+            pipe = client.pipeline(transaction=False)
+            _queue_seen(pipe, cells, replies)
+            drivers = _merge_nearby(_filter_fresh(replies, pipe.execute(), min_seen), count)
+            if len(drivers) == count or _search_exhausted(replies, fetch):
+                break
+            fetch *= STALE_OVERFETCH
+
+        logger.debug("Found %d nearby drivers at lng=%s, lat=%s", len(drivers), lng, lat)
         return drivers if drivers else []
-        
+
     except ValueError as e:
         logger.warning(f"Validation error in nearby_drivers: {str(e)}")
         return None
@@ -157,31 +792,29 @@ def nearby_drivers(lng, lat, radius=1000, count=10):
 def remove_driver(driver_id):
     """
     Remove driver from geospatial index.
-    
+
     Args:
         driver_id: Unique driver identifier
-    
+
     Returns:
         dict: Status and message
     """
-    if redis_client is None:
+    client = get_redis_client()
+    if client is None:
         logger.error("Redis client not available")
         return {"success": False, "error": "Redis connection unavailable"}
-    
+
     try:
         if not driver_id:
             raise ValueError("driver_id cannot be empty")
-        
-        member = f'driver:{driver_id}'
-        result = redis_client.zrem(GEO_KEY, member)
-        
-        if result > 0:
+
+        if _run_steps(client, _remove_steps(f'driver:{driver_id}')):
             logger.info(f"Driver {driver_id} removed from geo index")
             return {"success": True, "message": "Driver removed successfully"}
         else:
             logger.warning(f"Driver {driver_id} not found in geo index")
             return {"success": False, "error": "Driver not found"}
-            
+
     except ValueError as e:
         logger.warning(f"Validation error for driver {driver_id}: {str(e)}")
         return {"success": False, "error": str(e)}
@@ -191,3 +824,299 @@ def remove_driver(driver_id):
     except Exception as e:
         logger.error(f"Unexpected error removing driver {driver_id}: {str(e)}")
         return {"success": False, "error": "An unexpected error occurred"}
+
+
+def _reserve_steps(pairs, ttl):
+    """
+    Protocol reserving (member, ride_id) pairs: find the shard each driver
+    is searchable in and their position there, take them in their owner
+    bucket, then drop them from the shard.
+
+    Returns:
+        list: Per pair, whether the driver was taken
+    """
+    now = time.time()
+    members = [member for member, _ in pairs]
+    groups = _by_bucket(members, member=lambda member: member)
+    replies = yield [('hmget', [_bucket_keys(bucket).owner], [group]) for bucket, group in groups.items()]
+    owners = {}
+    for group, reply in zip(groups.values(), replies):
+        owners.update(zip(group, reply))
+
+    located = [member for member in members if owners[member]]
+    replies = yield [('geopos', [_shard_keys(owners[member]).geo], [member]) for member in located]
+    positions = {member: reply[0] for member, reply in zip(located, replies)}
+
+    groups = _by_bucket(list(enumerate(pairs)), member=lambda item: item[1][0])
+    calls = []
+    for bucket, group in groups.items():
+        args = [now, ttl]
+        for _, (member, ride_id) in group:
+            position = positions.get(member)
+            if position:
+                args.extend((member, str(ride_id), owners[member], *position))
+            else:
+                args.extend((member, str(ride_id), '', '', ''))
+        calls.append(('owner_reserve', list(_bucket_keys(bucket)), args))
+    replies = yield calls
+
+    taken, ops = [False] * len(pairs), {}
+    for group, reply in zip(groups.values(), replies):
+        for (index, (member, _)), fence in zip(group, reply):
+            if fence:
+                taken[index] = True
+                ops.setdefault(owners[member], []).append(('r', member, 0, 0, fence))
+    yield from _shard_steps(ops, now)
+    return taken
+
+
+def reserve_drivers(pairs, ttl=30):
+    """
+    Atomically reserve specific drivers, e.g. the result of a batch match.
+
+    Each driver is taken only if they are not already reserved and are
+    still in the shard they were found in; the check and the reservation
+    happen in one step in the driver's owner bucket, so no other
+    reservation can interleave.
+
+    Args:
+        pairs: Sequence of (driver_id, ride_id)
+        ttl: Reservation lifetime in seconds (default: 30)
+
+    Returns:
+        dict: Status and a per-pair list of whether the driver was taken
+    """
+    client = get_redis_client()
+    if client is None:
+        logger.error("Redis client not available")
+        return {"success": False, "error": "Redis connection unavailable"}
+
+    pairs = [(f'driver:{driver_id}', ride_id) for driver_id, ride_id in pairs]
+    if not pairs:
+        return {"success": True, "taken": []}
+
+    try:
+        return {"success": True, "taken": _run_steps(client, _reserve_steps(pairs, ttl))}
+
+    except redis.RedisError as e:
+        logger.error(f"Redis error while reserving drivers: {str(e)}")
+        return {"success": False, "error": "Database operation failed"}
+
+
+def _hold_steps(pairs):
+    """
+    Protocol holding (member, ride_id) reservations; see hold_drivers.
+
+    Returns:
+        list: Per pair, whether the reservation is held
+    """
+    groups = _by_bucket(list(enumerate(pairs)), member=lambda item: item[1][0])
+    calls = []
+    for bucket, group in groups.items():
+        keys = _bucket_keys(bucket)
+        args = [value for _, (member, ride_id) in group for value in (member, str(ride_id))]
+        calls.append(('owner_hold', [keys.reserved, keys.ride], args))
+    replies = yield calls
+
+    held = [False] * len(pairs)
+    for group, reply in zip(groups.values(), replies):
+        for (index, _), ok in zip(group, reply):
+            held[index] = bool(ok)
+    return held
+
+
+def hold_drivers(pairs):
+    """
+    Keep reservations made by reserve_drivers for as long as their rides
+    are active. The short reservation TTL only covers the gap until the
+    ride is assigned; after that the driver stays out of the searchable
+    shards until release_driver is called.
+
+    Args:
+        pairs: Sequence of (driver_id, ride_id)
+
+    Returns:
+        dict: Status and a per-pair list of whether the reservation is held
+    """
+    client = get_redis_client()
+    if client is None:
+        logger.error("Redis client not available")
+        return {"success": False, "error": "Redis connection unavailable"}
+
+    pairs = [(f'driver:{driver_id}', ride_id) for driver_id, ride_id in pairs]
+    if not pairs:
+        return {"success": True, "held": []}
+
+    try:
+        return {"success": True, "held": _run_steps(client, _hold_steps(pairs))}
+
+    except redis.RedisError as e:
+        logger.error(f"Redis error while holding drivers: {str(e)}")
+        return {"success": False, "error": "Database operation failed"}
+
+
+def _release_steps(member, ride_id):
+    """
+    Protocol ending a reservation: clear it in the driver's owner bucket,
+    then put the driver back into the shard of their latest position.
+
+    Returns:
+        bool: Whether the driver was released
+    """
+    (released,) = yield [('owner_release', list(_member_keys(member)), [member, '' if ride_id is None else str(ride_id)])]
+    if not released:
+        return False
+    cell, lng, lat, seen = released
+    yield from _shard_steps({cell: [('f', member, lng, lat, seen)]}, time.time())
+    return True
+
+
+def release_driver(driver_id, ride_id=None):
+    """
+    End a reservation and make the driver searchable again.
+
+    Args:
+        driver_id: Unique driver identifier
+        ride_id: Only release if the driver is held for this ride
+            (default: None, whatever ride holds them)
+
+    Returns:
+        dict: Status and message
+    """
+    client = get_redis_client()
+    if client is None:
+        logger.error("Redis client not available")
+        return {"success": False, "error": "Redis connection unavailable"}
+
+    try:
+        if not _run_steps(client, _release_steps(f'driver:{driver_id}', ride_id)):
+            return {"success": False, "error": "Driver not reserved"}
+        logger.info(f"Driver {driver_id} released")
+        return {"success": True, "message": "Driver released successfully"}
+
+    except redis.RedisError as e:
+        logger.error(f"Redis error while releasing driver {driver_id}: {str(e)}")
+        return {"success": False, "error": "Database operation failed"}
+
+
+def _evict_steps(keys, members, now, cutoff):
+    """
+    Protocol evicting stale members of one owner bucket.
+
+    Returns:
+        tuple: (evicted, kept) counts, kept being drivers still stale but
+            held by an unexpired reservation
+    """
+    (reply,) = yield [('owner_evict', list(keys), [now, cutoff, *members])]
+    ops, evicted, kept = {}, 0, 0
+    for member, cell in zip(members, reply):
+        if cell == 0:
+            kept += 1
+        elif cell != -1:
+            evicted += 1
+            if cell:
+                ops.setdefault(cell, []).append(('r', member, 0, 0, cutoff))
+    yield from _shard_steps(ops, now)
+    return evicted, kept
+
+
+def evict_stale_drivers(max_age, batch_size=1000):
+    """
+    Remove drivers whose latest location fix is older than max_age.
+
+    Each owner bucket's last-seen index is read in batches; every batch is
+    re-checked and cleared in the bucket in one step, then dropped from
+    the geo shards. A driver that pings in between is kept, and a fix
+    that reaches a shard after the eviction is only written if it is
+    newer than the cutoff.
+
+    Drivers holding an unexpired reservation are kept: they are on a ride
+    and only become evictable once it is released.
+
+    Args:
+        max_age: Age in seconds after which a driver counts as offline
+        batch_size: Members read per round trip (default: 1000)
+
+    Returns:
+        dict: Status and number of evicted drivers
+    """
+    client = get_redis_client()
+    if client is None:
+        logger.error("Redis client not available")
+        return {"success": False, "error": "Redis connection unavailable"}
+
+    try:
+        now = time.time()
+        cutoff = now - max_age
+        evicted = 0
+        for bucket in range(settings.GEO_OWNER_BUCKETS):
+            keys = _bucket_keys(bucket)
+            skipped = 0
+            while True:
+                # Kept members stay at the front of the index, so page past them
+                batch = client.zrangebyscore(keys.seen, '-inf', cutoff, start=skipped, num=batch_size)
+                if not batch:
+                    break
+                removed, kept = _run_steps(client, _evict_steps(keys, batch, now, cutoff))
+                evicted += removed
+                skipped += kept
+                if len(batch) < batch_size:
+                    break
+
+        if evicted:
+            logger.info(f"Evicted {evicted} stale drivers from geo index")
+        return {"success": True, "evicted": evicted}
+
+    except redis.RedisError as e:
+        logger.error(f"Redis error while evicting stale drivers: {str(e)}")
+        return {"success": False, "error": "Database operation failed"}
+    except Exception as e:
+        logger.error(f"Unexpected error evicting stale drivers: {str(e)}")
+        return {"success": False, "error": "An unexpected error occurred"}
+
+
+def driver_positions(max_age=None):
+    """
+    Read every searchable driver position across all geo shards.
+
+    Args:
+        max_age: Only include drivers seen within this many seconds
+            (default: None, everyone in the geo shards)
+
+    Returns:
+        tuple: (members, lng, lat) with members a list and lng/lat float arrays
+        None: If operation fails
+    """
+    client = get_redis_client()
+    if client is None:
+        logger.error("Redis client not available for driver_positions")
+        return None
+
+    try:
+        cells = list(client.smembers(GEO_SHARDS_KEY))
+        pipe = client.pipeline(transaction=False)
+        for cell in cells:
+            keys = _shard_keys(cell)
+            pipe.zrange(keys.geo, 0, -1, withscores=True)
+            if max_age is not None:
+                pipe.zrangebyscore(keys.seen, time.time() - max_age, '+inf')
+        replies = iter(pipe.execute())
+
+        # A driver caught mid-move between two shards is counted once
+        entries, members = [], set()
+        for _ in cells:
+            shard = next(replies)
+            fresh = None if max_age is None else set(next(replies))
+            for member, score in shard:
+                if member not in members and (fresh is None or member in fresh):
+                    members.add(member)
+                    entries.append((member, score))
+        lng, lat = decode_geo_scores([score for _, score in entries])
+        return [member for member, _ in entries], lng, lat
+
+    except redis.RedisError as e:
+        logger.error(f"Redis error while reading driver positions: {str(e)}")
+        return None
+    except Exception as e:
+        logger.error(f"Unexpected error reading driver positions: {str(e)}")
+        return None
@@ -0,0 +1,205 @@
+import time
+import asyncio
+import logging
+import redis
+from django.conf import settings
+from servers import redis as geo_store
+from servers.geo_index import get_geo_index
+from servers.redis_pool import async_script_client, get_async_redis_client, get_redis_client
+
+logger = logging.getLogger(__name__)
+
+_scripts = {name: async_script_client().register_script(source) for name, source in geo_store.LUA_SCRIPTS.items()}
+
+
+async def _run_steps(client, steps):
+    """
+    Async servers.redis._run_steps, driving the same store protocols.
+    """
+    replies = None
+    while True:
+        try:
+            calls = steps.send(replies)
+        except StopIteration as stop:
+            return stop.value
+        pipe = client.pipeline(transaction=False)
+        for name, keys, args in calls:
+            script = _scripts.get(name)
+            if script is None:
+                getattr(pipe, name)(*keys, *args)
+            else:
+                await script(keys=keys, args=args, client=pipe)
+        replies = await pipe.execute()
+
+
+async def _write_locations(client, entries):
+    await _run_steps(client, geo_store._write_steps(entries))
+
+
+async def aadd_driver_location(driver_id, lng, lat):
+    """
+    Async add_driver_location.
+
+    Args:
+        driver_id: Unique driver identifier
+        lng: Longitude coordinate
+        lat: Latitude coordinate
+
+    Returns:
+        dict: Status and message
+    """
+    client = get_async_redis_client()
+    if client is None:
+        logger.error("Redis client not available")
+        return {"success": False, "error": "Redis connection unavailable"}
+
+    try:
+        if not driver_id:
+            raise ValueError("driver_id cannot be empty")
+
+        is_valid, error_msg = geo_store._validate_coordinates(lng, lat)
+        if not is_valid:
+            raise ValueError(error_msg)
+
+        member = f'driver:{driver_id}'
+        await _write_locations(client, [(member, float(lng), float(lat), time.time())])
+
+        logger.debug("Driver %s location updated: lng=%s, lat=%s", driver_id, lng, lat)
+        return {"success": True, "message": "Location added successfully"}
+
+    except ValueError as e:
+        logger.warning(f"Validation error for driver {driver_id}: {str(e)}")
+        return {"success": False, "error": str(e)}
+    except redis.RedisError as e:
+        logger.error(f"Redis error while adding driver {driver_id} location: {str(e)}")
+        return {"success": False, "error": "Database operation failed"}
+    except Exception as e:
+        logger.error(f"Unexpected error adding driver {driver_id} location: {str(e)}")
+        return {"success": False, "error": "An unexpected error occurred"}
+
+
+async def aadd_driver_locations(items):
+    """
+    Async add_driver_locations.
+
+    Args:
+        items: Sequence of (driver_id, lng, lat, ts) tuples
+
+    Returns:
+        dict: Status, accepted count and per-item results in input order
+    """
+    client = get_async_redis_client()
+    if client is None:
+        logger.error("Redis client not available")
+        return {"success": False, "error": "Redis connection unavailable"}
+
+    items = list(items)
+    if not items:
+        return {"success": True, "accepted": 0, "results": []}
+
+    try:
+        entries, results = geo_store._prepare_location_batch(items)
+        if entries:
+            await _write_locations(client, entries)
+
+        logger.debug("Batch location update: %d stored, %d skipped", len(entries), len(items) - len(entries))
+        return {"success": True, "accepted": len(entries), "results": results}
+
+    except redis.RedisError as e:
+        logger.error(f"Redis error during batch location update: {str(e)}")
+        return {"success": False, "error": "Database operation failed"}
+    except Exception as e:
+        logger.error(f"Unexpected error during batch location update: {str(e)}")
+        return {"success": False, "error": "An unexpected error occurred"}
+
+
+async def anearby_drivers(lng, lat, radius=1000, count=10, max_age=None):
+    """
+    Async nearby_drivers.
+
+    With GEO_INDEX_ENABLED the in-process index answers; it is queried on a
+    worker thread because it occasionally syncs from Redis.
+
+    Returns:
+        list: List of nearby drivers with distance and coordinates
+        None: If operation fails
+    """
+    try:
+        min_seen = geo_store._check_nearby_args(lng, lat, radius, count, max_age)
+
+        sync_client = get_redis_client() if settings.GEO_INDEX_ENABLED else None
+        if sync_client is not None:
+            index = get_geo_index(geo_store.GEO_SHARDS_KEY, geo_store._shard_keys)
+            drivers = await asyncio.to_thread(
+                index.nearby, sync_client, float(lng), float(lat), radius, count, min_seen
+            )
+            if drivers is not None:
+                return drivers
+            logger.warning("Geo index is stale, falling back to GEOSEARCH")
+
+        client = get_async_redis_client()
+        if client is None:
+            logger.error("Redis client not available for nearby_drivers query")
+            return None
+        fetch = count if min_seen is None else count * geo_store.STALE_OVERFETCH
+        while True:
+            pipe = client.pipeline(transaction=False)
+            cells = geo_store._queue_nearby_search(pipe, lng, lat, radius, fetch)
+            replies = await pipe.execute()
+            if min_seen is None:
+                drivers = geo_store._merge_nearby(replies, count)
+                break
+
+            pipe = client.pipeline(transaction=False)
+            geo_store._queue_seen(pipe, cells, replies)
+            fresh = geo_store._filter_fresh(replies, await pipe.execute(), min_seen)
+            drivers = geo_store._merge_nearby(fresh, count)
+            if len(drivers) == count or geo_store._search_exhausted(replies, fetch):
+                break
+            fetch *= geo_store.STALE_OVERFETCH
+
+        logger.debug("Found %d nearby drivers at lng=%s, lat=%s", len(drivers), lng, lat)
+        return drivers
+
+    except ValueError as e:
+        logger.warning(f"Validation error in anearby_drivers: {str(e)}")
+        return None
+    except redis.RedisError as e:
+        logger.error(f"Redis error during nearby drivers search: {str(e)}")
+        return None
+    except Exception as e:
+        logger.error(f"Unexpected error during nearby drivers search: {str(e)}")
+        return None
+
+
+async def aremove_driver(driver_id):
+    """
+    Async remove_driver.
+
+    Returns:
+        dict: Status and message
+    """
+    client = get_async_redis_client()
+    if client is None:
+        logger.error("Redis client not available")
+        return {"success": False, "error": "Redis connection unavailable"}
+
+    try:
+        if not driver_id:
+            raise ValueError("driver_id cannot be empty")
+
+        if await _run_steps(client, geo_store._remove_steps(f'driver:{driver_id}')):
+            logger.info(f"Driver {driver_id} removed from geo index")
+            return {"success": True, "message": "Driver removed successfully"}
+        logger.warning(f"Driver {driver_id} not found in geo index")
+        return {"success": False, "error": "Driver not found"}
+
+    except ValueError as e:
+        logger.warning(f"Validation error for driver {driver_id}: {str(e)}")
+        return {"success": False, "error": str(e)}
+    except redis.RedisError as e:
+        logger.error(f"Redis error while removing driver {driver_id}: {str(e)}")
+        return {"success": False, "error": "Database operation failed"}
+    except Exception as e:
+        logger.error(f"Unexpected error removing driver {driver_id}: {str(e)}")
+        return {"success": False, "error": "An unexpected error occurred"}
@@ -0,0 +1,291 @@
+import time
+import logging
+import threading
+import redis
+import redis.asyncio as aioredis
+from redis.asyncio.retry import Retry as AsyncRetry
+from redis.backoff import ExponentialBackoff
+from redis.connection import Connection
+from redis.retry import Retry
+from django.conf import settings
+from base.redis_metrics import InstrumentedRedis
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """
+    Fail-fast guard in front of Redis.
+
+    After ``threshold`` consecutive connection failures the breaker opens
+    and callers are turned away without touching the network. Once the
+    backoff has passed a single caller is let through as a probe: success
+    closes the breaker, failure reopens it with the backoff doubled up to
+    ``max_backoff``.
+
+    Args:
+        threshold: Consecutive failures that open the breaker
+        backoff: Initial open period in seconds
+        max_backoff: Longest open period in seconds
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, threshold, backoff, max_backoff):
+        self.threshold = threshold
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened = 0
+        self._current_backoff = backoff
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        if self.state == self.CLOSED:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            if self.state != self.CLOSED and now >= self._retry_at:
+                # Let this caller probe; everyone else keeps failing fast.
+                # A probe that never reports back is replaced after a backoff.
+                self.state = self.HALF_OPEN
+                self._retry_at = now + self._current_backoff
+                return True
+            return self.state == self.CLOSED
+
+    def record_success(self):
+        if self.state == self.CLOSED and not self.failures:
+            return
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("Redis is reachable again, closing circuit breaker")
+            self.state = self.CLOSED
+            self.failures = 0
+            self._current_backoff = self.backoff
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN:
+                self._current_backoff = min(self._current_backoff * 2, self.max_backoff)
+            elif self.state == self.OPEN or self.failures < self.threshold:
+                return
+            self.state = self.OPEN
+            self.opened += 1
+            self._retry_at = time.monotonic() + self._current_backoff
+            logger.error(f"Redis unavailable, failing fast for {self._current_backoff:.1f}s")
+
+
+class _BreakerConnection(Connection):
+    """
+    Connection that reports socket-level outcomes to the circuit breaker.
+    """
+
+    breaker = None
+
+    def _guard(self, call, *args, **kwargs):
+        try:
+            result = call(*args, **kwargs)
+        except (redis.ConnectionError, redis.TimeoutError):
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        return result
+
+    def connect(self):
+        return self._guard(super().connect)
+
+    def send_packed_command(self, command, check_health=True):
+        return self._guard(super().send_packed_command, command, check_health)
+
+    def read_response(self, *args, **kwargs):
+        return self._guard(super().read_response, *args, **kwargs)
+
+
+class _AsyncBreakerConnection(aioredis.Connection):
+    """
+    asyncio connection that reports socket-level outcomes to the circuit
+    breaker.
+    """
+
+    breaker = None
+
+    async def _guard(self, call, *args, **kwargs):
+        try:
+            result = await call(*args, **kwargs)
+        except (redis.ConnectionError, redis.TimeoutError):
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        return result
+
+    async def connect(self):
+        return await self._guard(super().connect)
+
+    async def send_packed_command(self, command, check_health=True):
+        return await self._guard(super().send_packed_command, command, check_health)
+
+    async def read_response(self, *args, **kwargs):
+        return await self._guard(super().read_response, *args, **kwargs)
+
+
+class _TrackedPool(redis.BlockingConnectionPool):
+    """
+    Bounded pool that counts connections in use and callers waiting.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._stats_lock = threading.Lock()
+        self.in_use = 0
+        self.waiting = 0
+        super().__init__(*args, **kwargs)
+
+    def get_connection(self, *args, **kwargs):
+        with self._stats_lock:
+            self.waiting += 1
+        try:
+            connection = super().get_connection(*args, **kwargs)
+        finally:
+            with self._stats_lock:
+                self.waiting -= 1
+        with self._stats_lock:
+            self.in_use += 1
+        return connection
+
+    def release(self, connection):
+        super().release(connection)
+        with self._stats_lock:
+            self.in_use = max(self.in_use - 1, 0)
+
+
+class _AsyncTrackedPool(aioredis.BlockingConnectionPool):
+    """
+    asyncio counterpart of _TrackedPool. Counters are only touched from the
+    event loop, so they need no lock.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.in_use = 0
+        self.waiting = 0
+        super().__init__(*args, **kwargs)
+
+    async def get_connection(self, *args, **kwargs):
+        self.waiting += 1
+        try:
+            connection = await super().get_connection(*args, **kwargs)
+        finally:
+            self.waiting -= 1
+        self.in_use += 1
+        return connection
+
+    async def release(self, connection):
+        await super().release(connection)
+        self.in_use = max(self.in_use - 1, 0)
+
+
+_breaker = CircuitBreaker(
+    threshold=settings.REDIS_BREAKER_THRESHOLD,
+    backoff=settings.REDIS_BREAKER_BACKOFF,
+    max_backoff=settings.REDIS_BREAKER_MAX_BACKOFF,
+)
+_BreakerConnection.breaker = _breaker
+_AsyncBreakerConnection.breaker = _breaker
+
+# Connections are opened lazily on first use and re-opened by the pool
+# after a failure, so nothing here touches the network.
+_pool = _TrackedPool.from_url(
+    settings.REDIS_URL + '/2',
+    connection_class=_BreakerConnection,
+    max_connections=settings.REDIS_MAX_CONNECTIONS,
+    timeout=settings.REDIS_POOL_TIMEOUT,
+    socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+    socket_connect_timeout=settings.REDIS_CONNECT_TIMEOUT,
+    socket_keepalive=True,
+    health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+    # One quick retry covers a dropped idle connection; longer outages are
+    # the circuit breaker's job
+    retry=Retry(ExponentialBackoff(cap=0.1, base=0.01), 1),
+    decode_responses=True,
+)
+_client = InstrumentedRedis(connection_pool=_pool)
+
+# The asyncio client used by the websocket handlers shares the socket
+# settings and the breaker, with its own connection limit
+_async_pool = _AsyncTrackedPool.from_url(
+    settings.REDIS_URL + '/2',
+    connection_class=_AsyncBreakerConnection,
+    max_connections=settings.REDIS_ASYNC_MAX_CONNECTIONS,
+    timeout=settings.REDIS_ASYNC_POOL_TIMEOUT,
+    socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+    socket_connect_timeout=settings.REDIS_CONNECT_TIMEOUT,
+    socket_keepalive=True,
+    health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+    retry=AsyncRetry(ExponentialBackoff(cap=0.1, base=0.01), 1),
+    decode_responses=True,
+)
+_async_client = aioredis.Redis(connection_pool=_async_pool)
+
+
+def get_redis_client():
+    """
+    Redis client for the geo store database.
+
+    Returns:
+        redis.Redis: Client backed by the shared bounded pool
+        None: While the circuit breaker is open, so callers fail fast
+    """
+    if not _breaker.allow():
+        return None
+    return _client
+
+
+def get_async_redis_client():
+    """
+    asyncio Redis client for the geo store database.
+
+    Returns:
+        redis.asyncio.Redis: Client backed by the shared bounded async pool
+        None: While the circuit breaker is open, so callers fail fast
+    """
+    if not _breaker.allow():
+        return None
+    return _async_client
+
+
+def script_client():
+    """
+    The pooled client regardless of breaker state, for registering Lua
+    scripts at import time. Registration does not touch the network.
+    """
+    return _client
+
+
+def async_script_client():
+    """
+    script_client for scripts run from asyncio code.
+    """
+    return _async_client
+
+
+def pool_stats():
+    """
+    Returns:
+        dict: Connections in use, callers waiting for one, connections
+        created and the pool limit, for the sync and asyncio pools, and the
+        circuit breaker state
+    """
+    return {
+        "in_use": _pool.in_use,
+        "waiting": _pool.waiting,
+        "created": len(_pool._connections),
+        "max_connections": _pool.max_connections,
+        "async_in_use": _async_pool.in_use,
+        "async_waiting": _async_pool.waiting,
+        "async_created": len(_async_pool._in_use_connections) + len(_async_pool._available_connections),
+        "async_max_connections": _async_pool.max_connections,
+        "breaker": _breaker.state,
+        "breaker_failures": _breaker.failures,
+        "breaker_opened": _breaker.opened,
+    }
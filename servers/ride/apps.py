@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class RideConfig(AppConfig):
     name = 'servers.ride'
+
+    def ready(self):
+        from . import signals
+        signals.connect()
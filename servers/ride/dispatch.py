@@ -0,0 +1,271 @@
+import json
+import logging
+import numpy as np
+import redis
+from django.conf import settings
+from django.db import transaction
+from base.redis_metrics import register_key_prefixes
+from servers import redis as geo_store
+from servers.driver.models import Vehicle
+from servers.geo import geohash_encode, geohash_bbox, haversine
+from servers.redis_pool import get_redis_client
+from .eta import estimate_dist_duration
+from .utils import get_distance_matrix
+from .models import Ride
+
+logger = logging.getLogger(__name__)
+
+# Pending requests per dispatch cell, and the set of cells with pending work
+PENDING_KEY = 'dispatch:pending:{cell}'
+PENDING_CELLS_KEY = 'dispatch:cells'
+register_key_prefixes('dispatch:pending', PENDING_CELLS_KEY)
+
+
+def enqueue_ride(ride):
+    """
+    Queue a requested ride for the next dispatch window of its pickup cell.
+
+    Args:
+        ride: Ride in "requested" status
+
+    Returns:
+        bool: Whether the ride was queued
+    """
+    client = get_redis_client()
+    if client is None:
+        logger.error("Redis client not available for dispatch")
+        return False
+    cell = geohash_encode(ride.src_lng, ride.src_lat, settings.DISPATCH_PRECISION)
+    payload = json.dumps({
+        'ride_id': str(ride.id),
+        'lat': ride.src_lat,
+        'lng': ride.src_lng,
+        'vehicle_type': ride.vehicle_type,
+        'attempts': 0,
+    })
+    try:
+        pipe = client.pipeline(transaction=False)
+        pipe.rpush(PENDING_KEY.format(cell=cell), payload)
+        pipe.sadd(PENDING_CELLS_KEY, cell)
+        pipe.execute()
+        return True
+    except redis.RedisError as e:
+        logger.error(f"Failed to queue ride {ride.id} for dispatch: {str(e)}")
+        return False
+
+
+def _take_pending(client, cell):
+    """
+    Atomically take every pending request queued for a cell.
+    """
+    key = PENDING_KEY.format(cell=cell)
+    pipe = client.pipeline(transaction=True)
+    pipe.lrange(key, 0, -1)
+    pipe.delete(key)
+    pipe.srem(PENDING_CELLS_KEY, cell)
+    items = pipe.execute()[0]
+    return [json.loads(item) for item in items]
+
+
+def greedy_assignment(cost):
+    """
+    Assign rows to columns by repeatedly taking the cheapest free pair.
+
+    Args:
+        cost: (requests x drivers) matrix, inf where a pair is not allowed
+
+    Returns:
+        list: (row, column) pairs
+    """
+    pairs = []
+    if not cost.size:
+        return pairs
+    used_rows = np.zeros(cost.shape[0], dtype=bool)
+    used_cols = np.zeros(cost.shape[1], dtype=bool)
+    flat = cost.ravel()
+    for index in np.argsort(flat, kind='stable'):
+        if not np.isfinite(flat[index]):
+            break
+        row, col = divmod(int(index), cost.shape[1])
+        if used_rows[row] or used_cols[col]:
+            continue
+        used_rows[row] = used_cols[col] = True
+        pairs.append((row, col))
+        if used_rows.all() or used_cols.all():
+            break
+    return pairs
+
+
+def _candidates(cell):
+    """
+    Drivers around a dispatch cell. Reserved drivers are out of the
+    searchable shards, so everyone returned is available.
+
+    One nearby_drivers query covers every request in the cell: it is
+    centred on the cell and its radius grows by the cell's half diagonal.
+
+    Returns:
+        list: [member, dist, (lng, lat)] entries
+    """
+    min_lng, min_lat, max_lng, max_lat = geohash_bbox(cell)
+    center_lng, center_lat = (min_lng + max_lng) / 2, (min_lat + max_lat) / 2
+    half_diagonal = float(haversine(min_lng, min_lat, center_lng, center_lat))
+
+    return geo_store.nearby_drivers(
+        center_lng, center_lat,
+        radius=settings.DISPATCH_RADIUS + half_diagonal,
+        count=settings.DISPATCH_CANDIDATES,
+        max_age=settings.NEARBY_DRIVERS_MAX_AGE or None,
+    ) or []
+
+
+def _road_eta(eta, allowed, req_lat, req_lng, drv_lat, drv_lng):
+    """
+    Replace offline ETAs with distance matrix durations for the pairs that
+    can be matched. One batched matrix call covers the whole cell; pairs
+    the provider has no route for keep an offline estimate.
+    """
+    rows = np.flatnonzero(allowed.any(axis=1))
+    cols = np.flatnonzero(allowed.any(axis=0))
+    if not cols.size:
+        return eta
+    origins = [(drv_lat[0, col], drv_lng[0, col]) for col in cols]
+    destinations = [(req_lat[row, 0], req_lng[row, 0]) for row in rows]
+    _, duration = get_distance_matrix(origins, destinations)
+    eta = eta.copy()
+    eta[np.ix_(rows, cols)] = duration.T
+    return eta
+
+
+def dispatch_cell(cell, requests):
+    """
+    Match one cell's pending requests to nearby drivers in a single batch.
+
+    Pickup ETAs for every request/driver pair come from the offline ETA
+    model, or with DISPATCH_ROAD_ETA from the distance matrix API; pairs
+    whose driver has no vehicle of the requested type or is outside
+    DISPATCH_RADIUS are excluded, and the matrix is assigned greedily by
+    lowest ETA. Drivers are reserved for DISPATCH_RESERVATION_TTL
+    while their rides are updated, then held until the ride completes or is
+    cancelled.
+
+    Returns:
+        tuple: (assigned ride ids, requests to retry)
+    """
+    drivers = _candidates(cell)
+    if not drivers:
+        return [], requests
+
+    driver_ids = [member.split(':', 1)[1] for member, *_ in drivers]
+    vehicles = {}
+    for vehicle in Vehicle.objects.filter(driver_id__in=driver_ids).only('id', 'driver_id', 'vehicle_type'):
+        vehicles.setdefault(str(vehicle.driver_id_id), {}).setdefault(vehicle.vehicle_type, vehicle.id)
+
+    req_lat = np.array([r['lat'] for r in requests], dtype=float)[:, None]
+    req_lng = np.array([r['lng'] for r in requests], dtype=float)[:, None]
+    drv_lng = np.array([coords[0] for _, _, coords in drivers], dtype=float)[None, :]
+    drv_lat = np.array([coords[1] for _, _, coords in drivers], dtype=float)[None, :]
+
+    _, eta = estimate_dist_duration(drv_lat, drv_lng, req_lat, req_lng)
+    straight = haversine(req_lng, req_lat, drv_lng, drv_lat)
+    allowed = straight <= settings.DISPATCH_RADIUS
+    allowed &= np.array([
+        [r['vehicle_type'] in vehicles.get(driver_id, {}) for driver_id in driver_ids]
+        for r in requests
+    ], dtype=bool).reshape(allowed.shape)
+    if settings.DISPATCH_ROAD_ETA:
+        eta = _road_eta(eta, allowed, req_lat, req_lng, drv_lat, drv_lng)
+    cost = np.where(allowed, eta, np.inf)
+
+    pairs = greedy_assignment(cost)
+    if not pairs:
+        return [], requests
+
+    # The geo index may lag behind reservations made elsewhere; the
+    # reservation script has the final say on who is still available
+    reserved = geo_store.reserve_drivers(
+        [(driver_ids[col], requests[row]['ride_id']) for row, col in pairs],
+        ttl=settings.DISPATCH_RESERVATION_TTL,
+    )
+    if not reserved['success']:
+        return [], requests
+    taken = reserved['taken']
+    assigned, matched_rows, holds = [], set(), []
+    with transaction.atomic():
+        for (row, col), ok in zip(pairs, taken):
+            if not ok:
+                continue
+            request = requests[row]
+            driver_id = driver_ids[col]
+            updated = Ride.objects.filter(id=request['ride_id'], status='requested').update(
+                driver_id=driver_id,
+                vehicle_id=vehicles[driver_id][request['vehicle_type']],
+                status='assigned',
+            )
+            if updated:
+                assigned.append(request['ride_id'])
+                holds.append((driver_id, request['ride_id']))
+                matched_rows.add(row)
+            else:
+                # Cancelled meanwhile: let the driver go again
+                geo_store.release_driver(driver_id, request['ride_id'])
+                matched_rows.add(row)
+    # Committed: keep the drivers reserved until their rides end
+    if holds:
+        held = geo_store.hold_drivers(holds)
+        if not held['success'] or not all(held['held']):
+            logger.warning(f"Could not hold every reservation for cell {cell}: {held}")
+    retry = [r for i, r in enumerate(requests) if i not in matched_rows]
+    return assigned, retry
+
+
+def run_dispatch():
+    """
+    Run one dispatch window over every cell with pending requests.
+
+    Requests left unmatched are queued for the next window until
+    DISPATCH_MAX_ATTEMPTS, after which the ride is marked unassigned.
+
+    Returns:
+        dict: Status with assigned, retried and unassigned counts
+    """
+    client = get_redis_client()
+    if client is None:
+        return {"success": False, "error": "Redis connection unavailable"}
+
+    assigned = retried = unassigned = 0
+    try:
+        for cell in client.smembers(PENDING_CELLS_KEY):
+            requests = _take_pending(client, cell)
+            if not requests:
+                continue
+            try:
+                done, retry = dispatch_cell(cell, requests)
+            except Exception as e:
+                logger.error(f"Dispatch failed for cell {cell}: {str(e)}")
+                done, retry = [], requests
+            assigned += len(done)
+
+            give_up = []
+            pipe = client.pipeline(transaction=False)
+            for request in retry:
+                request['attempts'] += 1
+                if request['attempts'] >= settings.DISPATCH_MAX_ATTEMPTS:
+                    give_up.append(request['ride_id'])
+                else:
+                    pipe.rpush(PENDING_KEY.format(cell=cell), json.dumps(request))
+            if len(retry) > len(give_up):
+                pipe.sadd(PENDING_CELLS_KEY, cell)
+            pipe.execute()
+            retried += len(retry) - len(give_up)
+
+            if give_up:
+                unassigned += Ride.objects.filter(id__in=give_up, status='requested').update(status='unassigned')
+
+        if assigned or unassigned:
+            logger.info(f"Dispatch window: {assigned} assigned, {retried} retrying, {unassigned} unassigned")
+        return {"success": True, "assigned": assigned, "retried": retried, "unassigned": unassigned}
+
+    except redis.RedisError as e:
+        logger.error(f"Redis error during dispatch: {str(e)}")
+        return {"success": False, "error": "Database operation failed"}
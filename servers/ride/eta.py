@@ -0,0 +1,49 @@
+import logging
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+from servers.geo import haversine
+
+logger = logging.getLogger(__name__)
+
+
+def _region_circuity(lng, lat):
+    """
+    Road-circuity factor (road distance / straight-line distance) for each
+    origin, taken from the first ETA_REGIONS bounding box that contains it.
+    """
+    circuity = np.full(np.shape(lng), settings.ETA_DEFAULT_CIRCUITY, dtype=float)
+    assigned = np.zeros(np.shape(lng), dtype=bool)
+    for region in settings.ETA_REGIONS:
+        min_lng, min_lat, max_lng, max_lat = region['bbox']
+        inside = ~assigned & (lng >= min_lng) & (lng <= max_lng) & (lat >= min_lat) & (lat <= max_lat)
+        circuity[inside] = region['circuity']
+        assigned |= inside
+    return circuity
+
+
+def estimate_dist_duration(src_lat, src_lng, dest_lat, dest_lng, when=None):
+    """
+    Estimate road distance and travel time without calling the distance API.
+
+    Straight-line distance is scaled by the origin region's circuity factor
+    and divided by the typical speed for the hour of day. All coordinate
+    arguments may be scalars or equally shaped arrays, so thousands of
+    origin/destination pairs are scored in one call.
+
+    Args:
+        src_lat, src_lng: Origin coordinates
+        dest_lat, dest_lng: Destination coordinates
+        when: Datetime the trip starts (default: now, local time)
+
+    Returns:
+        tuple: (dist, duration) float arrays in meters and seconds
+    """
+    src_lat, src_lng, dest_lat, dest_lng = (
+        np.asarray(v, dtype=float) for v in (src_lat, src_lng, dest_lat, dest_lng)
+    )
+    when = timezone.localtime(when or timezone.now())
+    speed_mps = settings.ETA_SPEED_BY_HOUR[when.hour] / 3.6
+
+    dist = haversine(src_lng, src_lat, dest_lng, dest_lat) * _region_circuity(src_lng, src_lat)
+    return dist, dist / speed_mps
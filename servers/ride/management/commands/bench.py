@@ -0,0 +1,396 @@
+import json
+import time
+import uuid
+import random
+import logging
+import platform
+import threading
+from pathlib import Path
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from http.server import ThreadingHTTPServer
+import numpy as np
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from base.metrics import Histogram
+from servers import redis as geo_store
+from servers.auth_user.authentication import tokens_for_user
+from servers.redis_pool import get_redis_client
+from servers.driver.models import Driver
+from servers.ride.models import Ride
+from servers.ride import surge
+from servers.ride import utils as ride_utils
+from servers.ride.dispatch import PENDING_CELLS_KEY, PENDING_KEY
+from servers.ride.management.commands.distance_matrix_stub import StubHandler
+from servers.rider.models import Rider
+
+logger = logging.getLogger(__name__)
+
+SCENARIOS = ('ingest', 'nearby', 'auth', 'ride')
+DEFAULT_BASELINE = Path(settings.BASE_DIR) / 'benchmarks' / 'baseline.json'
+# Phone numbers of every account the benchmark creates start with this
+PHONE_PREFIX = '+1999'
+
+
+class SyntheticCity:
+    """
+    Driver positions for a city: most drivers cluster around a few hotspots,
+    the rest are spread evenly over the city disc.
+
+    Args:
+        lng, lat: City centre
+        radius_km: City radius
+        rng: numpy Generator
+    """
+
+    def __init__(self, lng, lat, radius_km, rng, hotspots=5):
+        self.lng, self.lat = lng, lat
+        self.radius_deg = radius_km / 111.32
+        self.rng = rng
+        self.hotspots = self._uniform(hotspots)
+
+    def _uniform(self, n):
+        r = self.radius_deg * np.sqrt(self.rng.random(n))
+        theta = self.rng.random(n) * 2 * np.pi
+        lng = self.lng + r * np.cos(theta) / np.cos(np.radians(self.lat))
+        return np.column_stack([lng, self.lat + r * np.sin(theta)])
+
+    def points(self, n, clustered=0.7):
+        n_clustered = int(n * clustered)
+        centres = self.hotspots[self.rng.integers(len(self.hotspots), size=n_clustered)]
+        spread = self.rng.normal(scale=self.radius_deg / 10, size=(n_clustered, 2))
+        return np.vstack([centres + spread, self._uniform(n - n_clustered)])
+
+    def point(self, rnd, clustered=0.7):
+        """
+        One point drawn with a per-thread random.Random, since numpy
+        Generators must not be shared between threads.
+        """
+        if rnd.random() < clustered:
+            lng, lat = self.hotspots[rnd.randrange(len(self.hotspots))]
+            return (float(lng) + rnd.gauss(0, self.radius_deg / 10),
+                    float(lat) + rnd.gauss(0, self.radius_deg / 10))
+        r = self.radius_deg * rnd.random() ** 0.5
+        theta = rnd.random() * 2 * np.pi
+        return (self.lng + r * np.cos(theta) / np.cos(np.radians(self.lat)),
+                self.lat + r * np.sin(theta))
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the hot endpoints (driver ingest, nearby search, OTP login, "
+        "ride request) in-process against the configured database and Redis "
+        "with a synthetic city, report p50/p95/p99 and throughput, and compare "
+        "against or save a baseline (benchmarks/baseline.json, recorded with the "
+        "default options; --save-baseline rewrites it). Creates and then removes its own users, "
+        "drivers and rides; refuses to run with DEBUG off unless --force."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drivers', type=int, default=5000, help='Drivers placed in the geo store')
+        parser.add_argument('--accounts', type=int, default=100,
+                            help='Driver and rider accounts created for authenticated requests')
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per scenario')
+        parser.add_argument('--concurrency', type=int, default=8, help='Client threads')
+        parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                            help=f'Comma separated subset of {",".join(SCENARIOS)}')
+        parser.add_argument('--city', default='77.5946,12.9716,15',
+                            help='Centre lng,lat and radius in km of the synthetic city')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--baseline', default=str(DEFAULT_BASELINE))
+        parser.add_argument('--save-baseline', action='store_true',
+                            help='Write this run as the new baseline')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Allowed relative regression of p95/p99 and throughput')
+        parser.add_argument('--force', action='store_true', help='Run even with DEBUG off')
+        parser.add_argument('--real-distance-api', action='store_true',
+                            help='Call GMAPS_DISTANCE_MATRIX_URL instead of an in-process distance matrix stub')
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options['force']:
+            raise CommandError("bench writes to the configured database and Redis; use --force outside DEBUG")
+        scenarios = [s.strip() for s in options['scenarios'].split(',') if s.strip()]
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+        if options['accounts'] < options['concurrency']:
+            raise CommandError("--accounts must be at least --concurrency")
+        try:
+            lng, lat, radius_km = (float(v) for v in options['city'].split(','))
+        except ValueError:
+            raise CommandError("--city must be lng,lat,radius_km")
+
+        self.rng = np.random.default_rng(options['seed'])
+        self.city = SyntheticCity(lng, lat, radius_km, self.rng)
+        self.concurrency = options['concurrency']
+        self.phone_counter = iter(range(10 ** 8))
+        self.ride_ids = []
+        self.demand = []
+        self.synthetic_drivers = []
+
+        with ExitStack() as stack:
+            if not options['real_distance_api']:
+                stack.enter_context(self._distance_stub())
+            # The SMS gateway is not part of what we measure
+            stack.enter_context(mock.patch('servers.auth_user.views.send_otp_via_sns.delay', return_value='bench'))
+            stack.enter_context(mock.patch('servers.ride.views.record_demand', self._record_demand))
+            try:
+                self._seed(options['drivers'], options['accounts'])
+                results = {}
+                for name in scenarios:
+                    results[name] = self._run(name, options['requests'])
+                    self._report(name, results[name])
+            finally:
+                self._cleanup()
+
+        run = {
+            'meta': {
+                'drivers': options['drivers'],
+                'requests': options['requests'],
+                'concurrency': options['concurrency'],
+                'database': connections['default'].vendor,
+                'python': platform.python_version(),
+                'timestamp': int(time.time()),
+            },
+            'scenarios': results,
+        }
+        self._compare(run, Path(options['baseline']), options['tolerance'], options['save_baseline'])
+
+    def _seed(self, n_drivers, n_accounts):
+        self.stdout.write(f"Seeding {n_drivers} drivers and {n_accounts} driver/rider accounts")
+        User = get_user_model()
+        users = [
+            User(username=f'bench-{uuid.uuid4().hex[:12]}', phone=self._phone(), role=role, is_verified=True)
+            for role in ('driver', 'rider') for _ in range(n_accounts)
+        ]
+        User.objects.bulk_create(users)
+        drivers = Driver.objects.bulk_create(
+            [Driver(user_id=user, is_active=True) for user in users if user.role == 'driver']
+        )
+        Rider.objects.bulk_create([Rider(user_id=user) for user in users if user.role == 'rider'])
+        self.driver_tokens = [str(tokens_for_user(user)[0]) for user in users if user.role == 'driver']
+        self.rider_tokens = [str(tokens_for_user(user)[0]) for user in users if user.role == 'rider']
+        self.rider_phones = [user.phone for user in users if user.role == 'rider']
+
+        # Account drivers start in the city too, the rest exist only in Redis
+        self.synthetic_drivers = [str(uuid.uuid4()) for _ in range(max(n_drivers - len(drivers), 0))]
+        driver_ids = [str(d.id) for d in drivers] + self.synthetic_drivers
+        points = self.city.points(len(driver_ids))
+        now = time.time()
+        for start in range(0, len(driver_ids), settings.DRIVER_LOCATION_BATCH_MAX):
+            batch = [
+                (driver_id, float(lng), float(lat), now)
+                for driver_id, (lng, lat) in zip(
+                    driver_ids[start:start + settings.DRIVER_LOCATION_BATCH_MAX],
+                    points[start:start + settings.DRIVER_LOCATION_BATCH_MAX],
+                )
+            ]
+            result = geo_store.add_driver_locations(batch)
+            if not result.get('success'):
+                raise CommandError(f"Could not seed driver locations: {result.get('error')}")
+        self.account_driver_ids = [str(d.id) for d in drivers]
+
+    def _distance_stub(self):
+        """
+        Serve the distance matrix stub on a free local port and point the
+        route lookups at it for the duration of the run.
+        """
+        server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        stack = ExitStack()
+        stack.callback(server.server_close)
+        stack.callback(server.shutdown)
+        stack.enter_context(mock.patch.object(ride_utils, 'GMAPS_URL', f'http://127.0.0.1:{server.server_port}/'))
+        return stack
+
+    def _record_demand(self, lat, lng):
+        # Note the surge demand each ride request adds, so _cleanup can take it back out
+        self.demand.append((int(time.time() // settings.SURGE_BUCKET_SECONDS), surge._cell(lat, lng)))
+        surge.record_demand(lat, lng)
+
+    def _phone(self):
+        return f'{PHONE_PREFIX}{next(self.phone_counter):08d}'
+
+    def _step(self, name, client, rnd, phones):
+        """
+        Issue one scenario request.
+
+        Returns:
+            list: (label, seconds, ok) per HTTP request made
+        """
+        if name == 'ingest':
+            lng, lat = self.city.point(rnd)
+            token = rnd.choice(self.driver_tokens)
+            return [self._timed('ingest', lambda: client.post(
+                '/api/v1/driver/add/', {'lng': lng, 'lat': lat},
+                content_type='application/json', HTTP_AUTHORIZATION=f'Bearer {token}',
+            ))]
+        if name == 'nearby':
+            lng, lat = self.city.point(rnd)
+            token = rnd.choice(self.rider_tokens)
+            radius = rnd.choice((500, 1000, 2000))
+            return [self._timed('nearby', lambda: client.get(
+                '/api/v1/rider/nearby/', {'lng': lng, 'lat': lat, 'radius': radius, 'count': 10},
+                HTTP_AUTHORIZATION=f'Bearer {token}',
+            ))]
+        if name == 'auth':
+            # Returning riders logging in again, the common case
+            phone = rnd.choice(phones)
+            otp = self._timed('auth_otp', lambda: client.post(
+                '/api/v1/auth/otp/', {'phone_number': phone, 'role': 'rider'},
+                content_type='application/json',
+            ))
+            code = (cache.get(f'otp_role_{phone}') or {}).get('otp', '')
+            login = self._timed('auth_login', lambda: client.post(
+                '/api/v1/auth/login/', {'phone_number': phone, 'otp': code},
+                content_type='application/json',
+            ))
+            return [otp, login]
+        lng, lat = self.city.point(rnd)
+        dest_lng, dest_lat = self.city.point(rnd)
+        token = rnd.choice(self.rider_tokens)
+        step = self._timed('ride', lambda: client.post(
+            '/api/v1/ride/ride-request/',
+            {'src_lat': lat, 'src_lng': lng, 'dest_lat': dest_lat, 'dest_lng': dest_lng,
+             'vehicle_type': rnd.choice(list(settings.FARE_RATE_CARD))},
+            content_type='application/json', HTTP_AUTHORIZATION=f'Bearer {token}',
+        ))
+        return [step]
+
+    def _timed(self, label, call):
+        start = time.perf_counter()
+        response = call()
+        elapsed = time.perf_counter() - start
+        if label == 'ride' and response.status_code == 201:
+            self.ride_ids.append(response.json().get('data', {}).get('ride_id'))
+        return label, elapsed, 200 <= response.status_code < 300
+
+    def _run(self, name, n_requests):
+        histograms, errors = {}, {}
+        lock = threading.Lock()
+        per_worker = [n_requests // self.concurrency + (i < n_requests % self.concurrency)
+                      for i in range(self.concurrency)]
+
+        def worker(index):
+            client = Client()
+            rnd = random.Random(index)
+            # Each worker logs in its own riders so OTPs never race
+            phones = self.rider_phones[index::self.concurrency]
+            try:
+                for _ in range(per_worker[index]):
+                    for label, elapsed, ok in self._step(name, client, rnd, phones):
+                        with lock:
+                            histograms.setdefault(label, Histogram()).record(elapsed)
+                            errors[label] = errors.get(label, 0) + (not ok)
+            finally:
+                connections.close_all()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(self.concurrency) as pool:
+            list(pool.map(worker, range(self.concurrency)))
+        wall = time.perf_counter() - start
+
+        return {
+            label: {
+                'requests': histogram.count,
+                'errors': errors[label],
+                'rps': round(histogram.count / wall, 1),
+                'p50_ms': round(histogram.quantile(0.50) * 1000, 2),
+                'p95_ms': round(histogram.quantile(0.95) * 1000, 2),
+                'p99_ms': round(histogram.quantile(0.99) * 1000, 2),
+            }
+            for label, histogram in histograms.items()
+        }
+
+    def _report(self, name, result):
+        for label, stats in result.items():
+            self.stdout.write(
+                f"{label:<12} {stats['requests']:>7} req {stats['rps']:>9.1f} req/s  "
+                f"p50 {stats['p50_ms']:>8.2f} ms  p95 {stats['p95_ms']:>8.2f} ms  "
+                f"p99 {stats['p99_ms']:>8.2f} ms  errors {stats['errors']}"
+            )
+
+    def _cleanup(self):
+        self.stdout.write("Removing benchmark data")
+        ride_ids = {ride_id for ride_id in self.ride_ids if ride_id}
+        Ride.objects.filter(id__in=ride_ids).delete()
+        for driver_id in self.synthetic_drivers + getattr(self, 'account_driver_ids', []):
+            geo_store.remove_driver(driver_id)
+        get_user_model().objects.filter(phone__startswith=PHONE_PREFIX).delete()
+        client = get_redis_client()
+        if client is None:
+            self.stderr.write("Redis unavailable, dispatch queue and surge demand not cleaned up")
+            return
+        self._cleanup_dispatch(client, ride_ids)
+        self._cleanup_demand(client)
+
+    def _cleanup_dispatch(self, client, ride_ids):
+        """
+        Drop the benchmark's rides from the dispatch queues.
+        """
+        for cell in client.smembers(PENDING_CELLS_KEY):
+            key = PENDING_KEY.format(cell=cell)
+            for payload in client.lrange(key, 0, -1):
+                if json.loads(payload).get('ride_id') in ride_ids:
+                    client.lrem(key, 0, payload)
+            if not client.llen(key):
+                client.srem(PENDING_CELLS_KEY, cell)
+
+    def _cleanup_demand(self, client):
+        """
+        Take the benchmark's ride requests back out of the surge demand
+        buckets and republish multipliers without them.
+        """
+        if not self.demand:
+            return
+        counts = {}
+        for bucket_cell in self.demand:
+            counts[bucket_cell] = counts.get(bucket_cell, 0) + 1
+        pipe = client.pipeline(transaction=False)
+        for bucket, cell in counts:
+            pipe.hincrby(surge.DEMAND_KEY.format(bucket=bucket), cell, -counts[bucket, cell])
+        left = pipe.execute()
+        pipe = client.pipeline(transaction=False)
+        for (bucket, cell), remaining in zip(counts, left):
+            if remaining <= 0:
+                pipe.hdel(surge.DEMAND_KEY.format(bucket=bucket), cell)
+        pipe.execute()
+        surge.compute_surge()
+
+    def _compare(self, run, path, tolerance, save):
+        if not path.exists() and not save:
+            self.stdout.write(f"No baseline at {path}; rerun with --save-baseline to create one")
+        if path.exists():
+            baseline = json.loads(path.read_text())
+            differing = [
+                key for key in ('drivers', 'requests', 'concurrency', 'database')
+                if baseline.get('meta', {}).get(key) != run['meta'][key]
+            ]
+            if differing:
+                self.stdout.write(self.style.WARNING(
+                    f"Baseline was recorded with different {', '.join(differing)}; numbers may not compare"
+                ))
+            regressions = []
+            for name, labels in run['scenarios'].items():
+                for label, stats in labels.items():
+                    base = baseline.get('scenarios', {}).get(name, {}).get(label)
+                    if base is None:
+                        continue
+                    for key in ('p95_ms', 'p99_ms'):
+                        if stats[key] > base[key] * (1 + tolerance):
+                            regressions.append(f"{label} {key} {base[key]} -> {stats[key]}")
+                    if stats['rps'] < base['rps'] * (1 - tolerance):
+                        regressions.append(f"{label} rps {base['rps']} -> {stats['rps']}")
+            if regressions and not save:
+                raise CommandError("Regressions against baseline:\n  " + "\n  ".join(regressions))
+            self.stdout.write(f"No regressions beyond {tolerance:.0%} against {path}"
+                              if not regressions else "Regressions accepted into the new baseline")
+        if save:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(run, indent=2) + '\n')
+            self.stdout.write(f"Baseline written to {path}")
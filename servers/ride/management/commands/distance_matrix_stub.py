@@ -0,0 +1,98 @@
+import json
+import time
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+from django.core.management.base import BaseCommand
+from servers.geo import haversine
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_points(value):
+    """
+    Parse a "lng,lat|lng,lat" parameter into (lng, lat) arrays.
+    """
+    points = np.array(
+        [[float(part) for part in point.split(',')] for point in value.split('|') if point],
+        dtype=float
+    ).reshape(-1, 2)
+    return points[:, 0], points[:, 1]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Answers distance matrix requests with straight-line estimates.
+    """
+    circuity = 1.3
+    speed_kmph = 25.0
+    latency = 0.0
+
+    def do_GET(self):
+        params = parse_qs(urlparse(self.path).query)
+        try:
+            o_lng, o_lat = _parse_points(params.get('origins', [''])[0])
+            d_lng, d_lat = _parse_points(params.get('destinations', [''])[0])
+        except ValueError:
+            self._send(400, {'status': 'INVALID_REQUEST', 'rows': []})
+            return
+
+        dist = haversine(o_lng[:, None], o_lat[:, None], d_lng[None, :], d_lat[None, :]) * self.circuity
+        duration = dist / (self.speed_kmph / 3.6)
+        rows = [
+            {'elements': [
+                {
+                    'status': 'OK',
+                    'distance': {'value': int(dist[i, j])},
+                    'duration': {'value': int(duration[i, j])},
+                }
+                for j in range(dist.shape[1])
+            ]}
+            for i in range(dist.shape[0])
+        ]
+        if self.latency:
+            time.sleep(self.latency)
+        self._send(200, {'status': 'OK', 'rows': rows})
+
+    def _send(self, code, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+class Command(BaseCommand):
+    help = (
+        "Run a local distance matrix stub for offline testing and benchmarks. "
+        "Point GMAPS_DISTANCE_MATRIX_URL at http://<host>:<port>/"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency-ms', type=float, default=0.0,
+                            help='Artificial delay added to every response')
+        parser.add_argument('--circuity', type=float, default=1.3,
+                            help='Road distance / straight-line distance ratio')
+        parser.add_argument('--speed-kmph', type=float, default=25.0)
+
+    def handle(self, *args, **options):
+        handler = type('ConfiguredStubHandler', (StubHandler,), {
+            'circuity': options['circuity'],
+            'speed_kmph': options['speed_kmph'],
+            'latency': options['latency_ms'] / 1000.0,
+        })
+        server = ThreadingHTTPServer((options['host'], options['port']), handler)
+        self.stdout.write(f"Distance matrix stub listening on http://{options['host']}:{options['port']}/")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
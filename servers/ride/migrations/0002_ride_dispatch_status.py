@@ -0,0 +1,45 @@
+# Generated by Django 6.0 on 2026-10-16 23:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('driver', '0003_alter_driver_rating'),
+        ('ride', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ride',
+            name='status',
+            field=models.CharField(choices=[('requested', 'Requested'), ('assigned', 'Assigned'), ('unassigned', 'Unassigned'), ('cancelled', 'Cancelled'), ('completed', 'Completed')], default='requested'),
+        ),
+        migrations.AddField(
+            model_name='ride',
+            name='vehicle_type',
+            field=models.CharField(choices=[('bike', 'Bike'), ('car', 'Car'), ('auto', 'Auto')], default='auto'),
+        ),
+        migrations.AlterField(
+            model_name='ride',
+            name='actual_amount',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='ride',
+            name='driver_id',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='driver', to='driver.driver'),
+        ),
+        migrations.AlterField(
+            model_name='ride',
+            name='surge_mult',
+            field=models.DecimalField(decimal_places=2, default=1, max_digits=3),
+        ),
+        migrations.AlterField(
+            model_name='ride',
+            name='vehicle_id',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='vehicle', to='driver.vehicle'),
+        ),
+    ]
@@ -9,11 +9,18 @@ class Ride(models.Model):
     src_lng=models.FloatField()
     dest_lat=models.FloatField()
     dest_lng=models.FloatField()
-    vehicle_id=models.ForeignKey(Vehicle,on_delete=models.DO_NOTHING,related_name='vehicle')
-    driver_id=models.ForeignKey(Driver,on_delete=models.DO_NOTHING,related_name='driver')
+    vehicle_type=models.CharField(choices=[
+        ('bike','Bike'),('car','Car'),('auto','Auto')
+    ],default='auto')
+    status=models.CharField(choices=[
+        ('requested','Requested'),('assigned','Assigned'),('unassigned','Unassigned'),
+        ('cancelled','Cancelled'),('completed','Completed')
+    ],default='requested')
+    vehicle_id=models.ForeignKey(Vehicle,on_delete=models.DO_NOTHING,related_name='vehicle',null=True,blank=True)
+    driver_id=models.ForeignKey(Driver,on_delete=models.DO_NOTHING,related_name='driver',null=True,blank=True)
     rider_id=models.ManyToManyField(Rider,related_name='riders')
     is_shared=models.BooleanField()
     estimated_amount=models.FloatField()
-    actual_amount=models.FloatField()
-    surge_mult=models.DecimalField(max_digits=3,decimal_places=2)
+    actual_amount=models.FloatField(null=True,blank=True)
+    surge_mult=models.DecimalField(max_digits=3,decimal_places=2,default=1)
     
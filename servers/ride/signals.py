@@ -0,0 +1,31 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from servers import redis as geo_store
+from .models import Ride
+
+# Ride statuses after which the assigned driver is free again
+_FINISHED = ('completed', 'cancelled')
+
+
+def _release(driver_id, ride_id):
+    # Only drops a reservation held for this ride, so repeated saves are harmless
+    transaction.on_commit(lambda: geo_store.release_driver(driver_id, ride_id))
+
+
+def _release_on_finish(sender, instance, **kwargs):
+    if instance.driver_id_id and instance.status in _FINISHED:
+        _release(instance.driver_id_id, instance.id)
+
+
+def _release_on_delete(sender, instance, **kwargs):
+    if instance.driver_id_id:
+        _release(instance.driver_id_id, instance.id)
+
+
+def connect():
+    """
+    Release a ride's driver reservation once the ride is completed,
+    cancelled or deleted.
+    """
+    post_save.connect(_release_on_finish, sender=Ride, dispatch_uid='ride_release_finished')
+    post_delete.connect(_release_on_delete, sender=Ride, dispatch_uid='ride_release_deleted')
@@ -0,0 +1,176 @@
+import time
+import logging
+import threading
+import numpy as np
+import redis
+from django.conf import settings
+from base.redis_metrics import register_key_prefixes
+from servers import redis as geo_store
+from servers.geo import geohash_encode, geohash_encode_many
+from servers.redis_pool import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+# One hash per time bucket: cell -> ride requests in that bucket
+DEMAND_KEY = 'surge:demand:{bucket}'
+# Published cell -> multiplier map and its version counter
+SURGE_MAP_KEY = 'surge:map'
+SURGE_VERSION_KEY = 'surge:version'
+register_key_prefixes('surge:demand', SURGE_MAP_KEY, SURGE_VERSION_KEY)
+
+
+def _cell(lat, lng):
+    return geohash_encode(float(lng), float(lat), settings.SURGE_PRECISION)
+
+
+def record_demand(lat, lng):
+    """
+    Count a ride request against its pickup cell in the current time bucket.
+
+    Errors are logged and swallowed; surge is best effort.
+    """
+    client = get_redis_client()
+    if client is None:
+        return
+    bucket = int(time.time() // settings.SURGE_BUCKET_SECONDS)
+    key = DEMAND_KEY.format(bucket=bucket)
+    try:
+        pipe = client.pipeline(transaction=False)
+        pipe.hincrby(key, _cell(lat, lng), 1)
+        pipe.expire(key, settings.SURGE_WINDOW_SECONDS + settings.SURGE_BUCKET_SECONDS)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Failed to record surge demand: {str(e)}")
+
+
+def surge_multipliers(supply, demand):
+    """
+    Map per-cell supply and demand counts to surge multipliers.
+
+    Multipliers grow linearly with SURGE_SENSITIVITY once demand per driver
+    passes SURGE_THRESHOLD, are rounded down to SURGE_STEP and capped at
+    SURGE_MAX.
+
+    Args:
+        supply: Array of online drivers per cell
+        demand: Array of ride requests per cell over the window
+
+    Returns:
+        ndarray: Multipliers, 1.0 where there is no surge
+    """
+    ratio = np.asarray(demand, dtype=float) / np.maximum(np.asarray(supply, dtype=float), 1.0)
+    mult = 1.0 + settings.SURGE_SENSITIVITY * (ratio - settings.SURGE_THRESHOLD)
+    mult = np.floor(mult / settings.SURGE_STEP) * settings.SURGE_STEP
+    return np.round(np.clip(mult, 1.0, settings.SURGE_MAX), 2)
+
+
+def compute_surge():
+    """
+    Recompute and publish the cell -> surge multiplier map.
+
+    Supply is the number of recently seen drivers per cell; demand is the
+    number of ride requests per cell over the last SURGE_WINDOW_SECONDS.
+    Only cells with a multiplier above 1 are published.
+
+    Returns:
+        dict: Status and number of surging cells
+    """
+    client = get_redis_client()
+    if client is None:
+        return {"success": False, "error": "Redis connection unavailable"}
+
+    try:
+        positions = geo_store.driver_positions(max_age=settings.NEARBY_DRIVERS_MAX_AGE or None)
+        if positions is None:
+            return {"success": False, "error": "Failed to read driver positions"}
+        _, lng, lat = positions
+        supply_cells, supply_counts = np.unique(
+            geohash_encode_many(lng, lat, settings.SURGE_PRECISION), return_counts=True
+        )
+        supply = dict(zip(supply_cells.tolist(), supply_counts.tolist()))
+
+        now_bucket = int(time.time() // settings.SURGE_BUCKET_SECONDS)
+        window = max(1, settings.SURGE_WINDOW_SECONDS // settings.SURGE_BUCKET_SECONDS)
+        pipe = client.pipeline(transaction=False)
+        for bucket in range(now_bucket - window + 1, now_bucket + 1):
+            pipe.hgetall(DEMAND_KEY.format(bucket=bucket))
+        demand = {}
+        for counts in pipe.execute():
+            for cell, count in counts.items():
+                demand[cell] = demand.get(cell, 0) + int(count)
+
+        cells = list(demand)
+        mult = surge_multipliers([supply.get(cell, 0) for cell in cells], [demand[cell] for cell in cells])
+        surging = {cell: float(m) for cell, m in zip(cells, mult) if m > 1.0}
+
+        # Swap the whole map in at once so readers never see a partial one
+        tmp_key = f'{SURGE_MAP_KEY}:tmp'
+        pipe = client.pipeline(transaction=True)
+        pipe.delete(tmp_key)
+        if surging:
+            pipe.hset(tmp_key, mapping=surging)
+            pipe.rename(tmp_key, SURGE_MAP_KEY)
+        else:
+            pipe.delete(SURGE_MAP_KEY)
+        pipe.incr(SURGE_VERSION_KEY)
+        pipe.execute()
+
+        logger.info(f"Surge map published: {len(surging)} surging cells of {len(cells)} with demand")
+        return {"success": True, "cells": len(surging)}
+
+    except redis.RedisError as e:
+        logger.error(f"Redis error while computing surge: {str(e)}")
+        return {"success": False, "error": "Database operation failed"}
+    except Exception as e:
+        logger.error(f"Unexpected error computing surge: {str(e)}")
+        return {"success": False, "error": "An unexpected error occurred"}
+
+
+class SurgeMap:
+    """
+    In-process copy of the published surge map.
+
+    The version counter is checked at most every SURGE_REFRESH_INTERVAL
+    seconds and the map is reloaded only when it changed, so a lookup is a
+    dict access on the request path.
+    """
+
+    def __init__(self):
+        self._multipliers = {}
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _refresh(self, client):
+        if time.monotonic() - self._checked_at < settings.SURGE_REFRESH_INTERVAL:
+            return
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            version = client.get(SURGE_VERSION_KEY)
+            if version != self._version:
+                self._multipliers = {
+                    cell: float(m) for cell, m in client.hgetall(SURGE_MAP_KEY).items()
+                }
+                self._version = version
+            self._checked_at = time.monotonic()
+        except redis.RedisError as e:
+            logger.warning(f"Failed to refresh surge map: {str(e)}")
+        finally:
+            self._lock.release()
+
+    def get(self, lat, lng):
+        client = get_redis_client()
+        if client is not None:
+            self._refresh(client)
+        return self._multipliers.get(_cell(lat, lng), 1.0)
+
+
+_surge_map = SurgeMap()
+
+
+def get_surge_multiplier(lat, lng):
+    """
+    Current surge multiplier for a pickup point (1.0 when not surging).
+    """
+    return _surge_map.get(lat, lng)
@@ -0,0 +1,38 @@
+import logging
+from celery import shared_task
+from .dispatch import run_dispatch
+from .surge import compute_surge
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def publish_surge():
+    """
+    Periodically recompute the surge multiplier map.
+    
+    Scheduled by celery beat every SURGE_INTERVAL seconds.
+    
+    Returns:
+        dict: Status and number of surging cells
+    """
+    result = compute_surge()
+    if not result.get('success'):
+        logger.error(f"Surge computation failed: {result.get('error')}")
+    return result
+
+
+@shared_task
+def dispatch_rides():
+    """
+    Match pending ride requests to drivers, one window per run.
+
+    Scheduled by celery beat every DISPATCH_INTERVAL seconds.
+
+    Returns:
+        dict: Status with assigned, retried and unassigned counts
+    """
+    result = run_dispatch()
+    if not result.get('success'):
+        logger.error(f"Dispatch window failed: {result.get('error')}")
+    return result
@@ -1,3 +1,313 @@
-from django.test import TestCase
+import json
+import time
+import uuid
+from unittest import mock
+import numpy as np
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.test import APIClient
+from base.testing import RedisTestMixin
+from servers import redis as geo_store
+from servers.geo import geohash_bbox, geohash_encode
+from servers.redis_pool import get_redis_client
+from servers.driver.models import Driver, Vehicle
+from .dispatch import (
+    PENDING_CELLS_KEY, PENDING_KEY, _take_pending, dispatch_cell, enqueue_ride, greedy_assignment, run_dispatch,
+)
+from .models import Ride
+from .utils import estimate_amount
+from .surge import DEMAND_KEY, SurgeMap, _cell, compute_surge, record_demand, surge_multipliers
 
-# Create your tests here.
+User = get_user_model()
+
+
+class ReservationTests(RedisTestMixin, SimpleTestCase):
+
+    def setUp(self):
+        self.redis = get_redis_client()
+        self.driver_id = str(uuid.uuid4())
+        self.member = f'driver:{self.driver_id}'
+        self.keys = geo_store._member_keys(self.member)
+        self.point = (20.0 + uuid.uuid4().int % 1000 / 1000, 11.0)
+        geo_store.add_driver_location(self.driver_id, *self.point)
+
+    def tearDown(self):
+        geo_store.remove_driver(self.driver_id)
+
+    def _searchable(self):
+        drivers = geo_store.nearby_drivers(*self.point, radius=100)
+        return self.member in [member for member, *_ in drivers]
+
+    def test_driver_is_reserved_once(self):
+        first = geo_store.reserve_drivers([(self.driver_id, 'ride-a')], ttl=60)
+        second = geo_store.reserve_drivers([(self.driver_id, 'ride-b')], ttl=60)
+        self.assertEqual(first['taken'], [True])
+        self.assertEqual(second['taken'], [False])
+        self.assertEqual(self.redis.hget(self.keys.ride, self.member), 'ride-a')
+        self.assertFalse(self._searchable())
+
+    def test_expired_reservation_frees_driver_on_next_fix(self):
+        self.assertEqual(geo_store.reserve_drivers([(self.driver_id, 'ride-a')], ttl=-1)['taken'], [True])
+        geo_store.add_driver_location(self.driver_id, *self.point)
+
+        self.assertTrue(self._searchable())
+        self.assertIsNone(self.redis.zscore(self.keys.reserved, self.member))
+        self.assertEqual(geo_store.reserve_drivers([(self.driver_id, 'ride-b')], ttl=60)['taken'], [True])
+
+    def test_release_only_for_holding_ride(self):
+        geo_store.reserve_drivers([(self.driver_id, 'ride-a')], ttl=60)
+        self.assertFalse(geo_store.release_driver(self.driver_id, 'ride-b')['success'])
+        self.assertFalse(self._searchable())
+
+        self.assertTrue(geo_store.release_driver(self.driver_id, 'ride-a')['success'])
+        self.assertTrue(self._searchable())
+        self.assertIsNone(self.redis.hget(self.keys.ride, self.member))
+
+    def test_hold_keeps_reservation_until_release(self):
+        geo_store.reserve_drivers([(self.driver_id, 'ride-a')], ttl=60)
+        held = geo_store.hold_drivers([(self.driver_id, 'ride-b'), (self.driver_id, 'ride-a')])
+        self.assertEqual(held['held'], [False, True])
+        self.assertEqual(self.redis.zscore(self.keys.reserved, self.member), float('inf'))
+
+        geo_store.add_driver_location(self.driver_id, *self.point)
+        self.assertFalse(self._searchable())
+
+
+class RideReleaseSignalTests(RedisTestMixin, TestCase):
+
+    def setUp(self):
+        user = User.objects.create(
+            username=f'test-{uuid.uuid4().hex[:12]}', phone=f'+1{uuid.uuid4().int % 10 ** 10:010d}', role='driver'
+        )
+        self.driver = Driver.objects.create(user_id=user)
+        self.member = f'driver:{self.driver.id}'
+        self.point = (21.0 + uuid.uuid4().int % 1000 / 1000, 11.0)
+        geo_store.add_driver_location(str(self.driver.id), *self.point)
+        self.ride = Ride.objects.create(
+            src_lat=self.point[1], src_lng=self.point[0], dest_lat=11.1, dest_lng=self.point[0],
+            is_shared=False, estimated_amount=100, driver_id=self.driver, status='assigned',
+        )
+        geo_store.reserve_drivers([(self.driver.id, self.ride.id)], ttl=60)
+        geo_store.hold_drivers([(self.driver.id, self.ride.id)])
+
+    def tearDown(self):
+        geo_store.remove_driver(str(self.driver.id))
+
+    def _reserved(self):
+        return get_redis_client().zscore(geo_store._member_keys(self.member).reserved, self.member) is not None
+
+    def test_completing_ride_releases_driver(self):
+        self.ride.status = 'completed'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ride.save()
+        self.assertFalse(self._reserved())
+        drivers = geo_store.nearby_drivers(*self.point, radius=100)
+        self.assertIn(self.member, [member for member, *_ in drivers])
+
+    def test_active_ride_keeps_driver(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ride.save()
+        self.assertTrue(self._reserved())
+
+    def test_deleting_ride_releases_driver(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ride.delete()
+        self.assertFalse(self._reserved())
+
+
+class GreedyAssignmentTests(SimpleTestCase):
+
+    def test_cheapest_pairs_are_taken_first(self):
+        cost = np.array([[5.0, 1.0], [2.0, 9.0]])
+        self.assertEqual(greedy_assignment(cost), [(0, 1), (1, 0)])
+
+    def test_greedy_leaves_rows_without_a_free_column(self):
+        cost = np.array([[1.0, 2.0], [1.5, np.inf]])
+        self.assertEqual(greedy_assignment(cost), [(0, 0)])
+
+    def test_nothing_allowed(self):
+        self.assertEqual(greedy_assignment(np.full((2, 3), np.inf)), [])
+        self.assertEqual(greedy_assignment(np.empty((0, 3))), [])
+
+
+class DispatchTests(RedisTestMixin, TestCase):
+
+    def setUp(self):
+        self.redis = get_redis_client()
+        # Centre of a dispatch cell, so nearby pickups share its queue
+        self.cell = geohash_encode(23.0 + uuid.uuid4().int % 1000 / 1000, 11.0, settings.DISPATCH_PRECISION)
+        min_lng, min_lat, max_lng, max_lat = geohash_bbox(self.cell)
+        self.point = ((min_lng + max_lng) / 2, (min_lat + max_lat) / 2)
+        self.drivers = []
+
+    def tearDown(self):
+        for driver in self.drivers:
+            geo_store.remove_driver(str(driver.id))
+        self.redis.delete(PENDING_KEY.format(cell=self.cell))
+        self.redis.srem(PENDING_CELLS_KEY, self.cell)
+
+    def _driver(self, lng_offset):
+        user = User.objects.create(
+            username=f'test-{uuid.uuid4().hex[:12]}', phone=f'+1{uuid.uuid4().int % 10 ** 10:010d}', role='driver'
+        )
+        driver = Driver.objects.create(user_id=user)
+        Vehicle.objects.create(driver_id=driver, vehicle_type='auto', model='Test', reg_num='KA01', capacity=3)
+        geo_store.add_driver_location(str(driver.id), self.point[0] + lng_offset, self.point[1])
+        self.drivers.append(driver)
+        return driver
+
+    def _ride(self, lng_offset=0.0):
+        ride = Ride.objects.create(
+            src_lat=self.point[1], src_lng=self.point[0] + lng_offset, dest_lat=11.1, dest_lng=self.point[0],
+            is_shared=False, estimated_amount=100,
+        )
+        self.assertTrue(enqueue_ride(ride))
+        return ride
+
+    def _reserved_for(self, driver):
+        member = f'driver:{driver.id}'
+        return self.redis.hget(geo_store._member_keys(member).ride, member)
+
+    def test_take_pending_empties_the_cell(self):
+        rides = [self._ride(), self._ride()]
+        requests = _take_pending(self.redis, self.cell)
+        self.assertEqual([r['ride_id'] for r in requests], [str(ride.id) for ride in rides])
+        self.assertEqual({r['attempts'] for r in requests}, {0})
+        self.assertFalse(self.redis.exists(PENDING_KEY.format(cell=self.cell)))
+        self.assertFalse(self.redis.sismember(PENDING_CELLS_KEY, self.cell))
+        self.assertEqual(_take_pending(self.redis, self.cell), [])
+
+    def test_rides_get_their_nearest_driver(self):
+        near, far = self._driver(0.001), self._driver(0.004)
+        first, second = self._ride(), self._ride(0.004)
+
+        assigned, retry = dispatch_cell(self.cell, _take_pending(self.redis, self.cell))
+        self.assertEqual(sorted(assigned), sorted([str(first.id), str(second.id)]))
+        self.assertEqual(retry, [])
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.driver_id, first.status), (near, 'assigned'))
+        self.assertEqual(second.driver_id, far)
+        member = f'driver:{near.id}'
+        self.assertEqual(self.redis.zscore(geo_store._member_keys(member).reserved, member), float('inf'))
+
+    def test_conflicting_reservation_requeues_ride(self):
+        driver = self._driver(0.001)
+        ride = self._ride()
+        # A stale candidate list, e.g. from a lagging geo index
+        candidates = geo_store.nearby_drivers(*self.point, radius=1000)
+        geo_store.reserve_drivers([(driver.id, 'other-ride')], ttl=60)
+
+        with mock.patch('servers.ride.dispatch._candidates', return_value=candidates):
+            result = run_dispatch()
+        self.assertTrue(result['success'])
+        ride.refresh_from_db()
+        self.assertEqual((ride.status, ride.driver_id), ('requested', None))
+        self.assertEqual(self._reserved_for(driver), 'other-ride')
+        pending = [json.loads(item) for item in self.redis.lrange(PENDING_KEY.format(cell=self.cell), 0, -1)]
+        self.assertEqual([(r['ride_id'], r['attempts']) for r in pending], [(str(ride.id), 1)])
+        self.assertTrue(self.redis.sismember(PENDING_CELLS_KEY, self.cell))
+
+    def test_failed_update_releases_reservation(self):
+        driver = self._driver(0.001)
+        ride = self._ride()
+        requests = _take_pending(self.redis, self.cell)
+        Ride.objects.filter(id=ride.id).update(status='cancelled')
+
+        self.assertEqual(dispatch_cell(self.cell, requests), ([], []))
+        self.assertIsNone(self._reserved_for(driver))
+        drivers = geo_store.nearby_drivers(*self.point, radius=1000)
+        self.assertIn(f'driver:{driver.id}', [member for member, *_ in drivers])
+
+
+@override_settings(SURGE_THRESHOLD=1.0, SURGE_SENSITIVITY=0.5, SURGE_STEP=0.1, SURGE_MAX=3.0)
+class SurgeMultiplierTests(SimpleTestCase):
+
+    def test_multipliers_step_and_cap(self):
+        mult = surge_multipliers([2, 0, 1, 4], [2, 3, 10, 7])
+        self.assertEqual(mult.tolist(), [1.0, 2.0, 3.0, 1.3])
+
+    def test_no_demand_means_no_surge(self):
+        self.assertEqual(surge_multipliers([5, 0], [0, 0]).tolist(), [1.0, 1.0])
+
+
+@override_settings(SURGE_THRESHOLD=1.0, SURGE_SENSITIVITY=0.5, SURGE_STEP=0.1, SURGE_REFRESH_INTERVAL=0)
+class SurgeComputeTests(RedisTestMixin, SimpleTestCase):
+
+    def setUp(self):
+        self.redis = get_redis_client()
+        self.point = (24.0 + uuid.uuid4().int % 1000 / 1000, 11.0)
+        self.driver_ids = []
+        self._add_driver()
+
+    def tearDown(self):
+        for driver_id in self.driver_ids:
+            geo_store.remove_driver(driver_id)
+        bucket = int(time.time() // settings.SURGE_BUCKET_SECONDS)
+        for key in (DEMAND_KEY.format(bucket=bucket), DEMAND_KEY.format(bucket=bucket - 1)):
+            self.redis.hdel(key, _cell(self.point[1], self.point[0]))
+
+    def _add_driver(self):
+        driver_id = str(uuid.uuid4())
+        self.driver_ids.append(driver_id)
+        geo_store.add_driver_location(driver_id, *self.point)
+
+    def test_demand_over_supply_is_published(self):
+        surge = SurgeMap()
+        lng, lat = self.point
+        self.assertEqual(surge.get(lat, lng), 1.0)
+        for _ in range(3):
+            record_demand(lat, lng)
+
+        self.assertTrue(compute_surge()['success'])
+        self.assertEqual(surge.get(lat, lng), 2.0)
+        self.assertEqual(surge.get(lat + 1, lng), 1.0)
+
+    def test_new_supply_ends_surge(self):
+        surge = SurgeMap()
+        lng, lat = self.point
+        for _ in range(3):
+            record_demand(lat, lng)
+        compute_surge()
+        self.assertEqual(surge.get(lat, lng), 2.0)
+
+        self._add_driver()
+        self._add_driver()
+        compute_surge()
+        self.assertEqual(surge.get(lat, lng), 1.0)
+
+
+@override_settings(FARE_RATE_CARD={
+    'bike': {'base_fare': 20, 'per_km': 6, 'per_min': 1, 'min_fare': 25},
+    'car': {'base_fare': 50, 'per_km': 16, 'per_min': 2, 'min_fare': 80},
+})
+class FareTests(TestCase):
+
+    def test_quotes_follow_rate_card(self):
+        self.assertEqual(estimate_amount(10000, 1200), {'bike': 100.0, 'car': 250.0})
+        self.assertEqual(estimate_amount(0, 0), {'bike': 25.0, 'car': 80.0})
+        self.assertEqual(estimate_amount(10000, 1200, surge_mult=1.5, type_of='car'), 375.0)
+
+    def test_vectorized_quotes_match_scalar_ones(self):
+        quotes = estimate_amount(np.array([0, 10000]), np.array([0, 1200]), surge_mult=np.array([1.0, 1.5]))
+        self.assertEqual(quotes['car'].tolist(), [80.0, 375.0])
+        self.assertEqual(quotes['bike'].tolist(), [25.0, 150.0])
+
+    def test_estimate_view_uses_offline_eta(self):
+        user = User.objects.create(
+            username=f'test-{uuid.uuid4().hex[:12]}', phone=f'+1{uuid.uuid4().int % 10 ** 10:010d}', role='rider'
+        )
+        client = APIClient()
+        client.force_authenticate(user)
+        trip = {'src_lat': 12.97, 'src_lng': 77.59, 'dest_lat': 12.93, 'dest_lng': 77.62}
+        with mock.patch('servers.ride.utils._fetch_dist_duration') as fetch, \
+                mock.patch('servers.ride.views.get_surge_multiplier', return_value=1.5):
+            response = client.post('/api/v1/ride/estimate/', trip, format='json')
+        fetch.assert_not_called()
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()['data']
+        self.assertGreater(data['distance'], 0)
+        self.assertEqual(data['surge_mult'], 1.5)
+        self.assertEqual(data['quotes'], estimate_amount(data['distance'], data['duration'], surge_mult=1.5))
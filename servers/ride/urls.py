@@ -1,5 +1,6 @@
 from django.urls import path
-from .views import ride_request
+from .views import ride_request,fare_estimate
 urlpatterns=[
-    path('ride-request/',ride_request)
+    path('ride-request/',ride_request),
+    path('estimate/',fare_estimate)
 ]
\ No newline at end of file
@@ -1,19 +1,47 @@
 import requests as re
 import os
 import logging
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from base.cache import TwoTierCache
+from servers.geo import geohash_encode
+from .eta import estimate_dist_duration
 logger=logging.getLogger(__name__)
 GMAPS_API=os.environ.get('GMAPS_API')
 GMAPS_URL:str=os.environ.get('GMAPS_DISTANCE_MATRIX_URL','')
 SESSION=re.session()
+# Let concurrent matrix chunks reuse pooled connections
+SESSION.mount('http://',HTTPAdapter(pool_maxsize=settings.DISTANCE_MATRIX_CONCURRENCY))
+SESSION.mount('https://',HTTPAdapter(pool_maxsize=settings.DISTANCE_MATRIX_CONCURRENCY))
 
-def get_dist_duration(src_lat,src_lng,dest_lat,dest_lng):
-    result=SESSION.get(GMAPS_URL,params={
-        'destinations':f'{dest_lng},{dest_lat}',
-        'origins':f'{src_lng},{src_lat}',
-        'key':GMAPS_API
-    })
-    result_respose=result.json()
+# Route results keyed by snapped origin/destination cells
+DISTANCE_CACHE=TwoTierCache(
+    'dm',
+    maxsize=settings.DISTANCE_CACHE_LOCAL_SIZE,
+    local_ttl=settings.DISTANCE_CACHE_LOCAL_TTL,
+    remote_ttl=settings.DISTANCE_CACHE_TTL,
+)
+
+def _route_key(src_lat,src_lng,dest_lat,dest_lng):
+    """
+    Cache key for a route, with both ends snapped to geohash cells of
+    DISTANCE_CACHE_PRECISION characters (7 is roughly 150 m).
+    """
+    precision=settings.DISTANCE_CACHE_PRECISION
+    src=geohash_encode(float(src_lng),float(src_lat),precision)
+    dest=geohash_encode(float(dest_lng),float(dest_lat),precision)
+    return f'{src}:{dest}'
+
+def _fetch_dist_duration(src_lat,src_lng,dest_lat,dest_lng):
     try:
+        result=SESSION.get(GMAPS_URL,params={
+            'destinations':f'{dest_lng},{dest_lat}',
+            'origins':f'{src_lng},{src_lat}',
+            'key':GMAPS_API
+        },timeout=settings.DISTANCE_MATRIX_TIMEOUT)
+        result_respose=result.json()
         row=result_respose.get('rows')[0]
         ele=row.get('elements')[0]
         dist=ele.get('distance').get('value')
@@ -23,5 +51,175 @@ def get_dist_duration(src_lat,src_lng,dest_lat,dest_lng):
     except Exception as e:
         logger.error('Unexpected error occured '+str(e))
         return 0,0
-def estimate_amount(dist,dur,base_fare=20,type_of='auto'):
-    pass
\ No newline at end of file
+
+def _estimate(src_lat,src_lng,dest_lat,dest_lng):
+    dist,duration=estimate_dist_duration(float(src_lat),float(src_lng),float(dest_lat),float(dest_lng))
+    return int(dist),int(duration)
+
+def get_dist_duration(src_lat,src_lng,dest_lat,dest_lng,fast=False):
+    """
+    Road distance (m) and duration (s) between two points.
+
+    Answers come from the in-process cache, then Redis, and only then the
+    distance matrix API. If the API fails the offline ETA model answers
+    instead; those estimates are not cached. With fast=True the offline
+    model is used directly, e.g. for fare previews.
+    """
+    if fast:
+        return _estimate(src_lat,src_lng,dest_lat,dest_lng)
+    key=_route_key(src_lat,src_lng,dest_lat,dest_lng)
+    cached=DISTANCE_CACHE.get(key)
+    if cached is not None:
+        return cached
+    dist,duration=_fetch_dist_duration(src_lat,src_lng,dest_lat,dest_lng)
+    if not (dist or duration):
+        logger.warning('Distance API unavailable, using offline ETA estimate')
+        return _estimate(src_lat,src_lng,dest_lat,dest_lng)
+    DISTANCE_CACHE.set(key,(dist,duration))
+    return dist,duration
+
+def _matrix_chunks(n_origins,n_destinations):
+    """
+    Split an origins x destinations matrix into blocks within the provider's
+    per-request limits.
+
+    Yields:
+        tuple: (origin_slice, destination_slice)
+    """
+    # Pick the block shape that needs the fewest requests
+    best=None
+    for dest_step in range(1,min(n_destinations,settings.DISTANCE_MATRIX_MAX_DESTINATIONS)+1):
+        origin_step=min(
+            n_origins,
+            settings.DISTANCE_MATRIX_MAX_ORIGINS,
+            max(1,settings.DISTANCE_MATRIX_MAX_ELEMENTS//dest_step),
+        )
+        requests=-(-n_origins//origin_step)*-(-n_destinations//dest_step)
+        if best is None or requests<best[0]:
+            best=(requests,origin_step,dest_step)
+    _,origin_step,dest_step=best
+    for o in range(0,n_origins,origin_step):
+        for d in range(0,n_destinations,dest_step):
+            yield slice(o,o+origin_step),slice(d,d+dest_step)
+
+def _fetch_matrix_chunk(origins,destinations):
+    """
+    Request one distance matrix block.
+
+    Returns:
+        tuple: (dist, duration) float arrays shaped (len(origins), len(destinations)),
+        NaN where the provider returned no route
+    """
+    dist=np.full((len(origins),len(destinations)),np.nan)
+    duration=np.full_like(dist,np.nan)
+    try:
+        result=SESSION.get(GMAPS_URL,params={
+            'destinations':'|'.join(f'{lng},{lat}' for lat,lng in destinations),
+            'origins':'|'.join(f'{lng},{lat}' for lat,lng in origins),
+            'key':GMAPS_API
+        },timeout=settings.DISTANCE_MATRIX_TIMEOUT)
+        for i,row in enumerate(result.json().get('rows',[])[:len(origins)]):
+            for j,ele in enumerate(row.get('elements',[])[:len(destinations)]):
+                if ele.get('status','OK')!='OK':
+                    continue
+                dist[i,j]=ele['distance']['value']
+                duration[i,j]=ele['duration']['value']
+    except Exception as e:
+        logger.error('Distance matrix chunk failed '+str(e))
+    return dist,duration
+
+def get_distance_matrix(origins,destinations):
+    """
+    Road distances and durations from every origin to every destination.
+
+    The matrix is split into blocks within the provider's per-request limits
+    and the blocks are requested concurrently. Pairs already in this
+    process's route cache are not requested again.
+
+    Args:
+        origins: Sequence of (lat, lng) points
+        destinations: Sequence of (lat, lng) points
+
+    Returns:
+        tuple: (dist, duration) float arrays shaped (len(origins), len(destinations))
+        in meters and seconds; pairs the provider had no route for are
+        filled in by the offline ETA model
+    """
+    dist=np.full((len(origins),len(destinations)),np.nan)
+    duration=np.full_like(dist,np.nan)
+    if not len(origins) or not len(destinations):
+        return dist,duration
+
+    keys=[[_route_key(o[0],o[1],d[0],d[1]) for d in destinations] for o in origins]
+    missing=np.zeros(dist.shape,dtype=bool)
+    for i,row in enumerate(keys):
+        for j,key in enumerate(row):
+            cached=DISTANCE_CACHE.local.get(key)
+            if cached is None:
+                missing[i,j]=True
+            else:
+                dist[i,j],duration[i,j]=cached
+
+    chunks=[
+        (o,d) for o,d in _matrix_chunks(len(origins),len(destinations))
+        if missing[o,d].any()
+    ]
+    if chunks:
+        with ThreadPoolExecutor(max_workers=settings.DISTANCE_MATRIX_CONCURRENCY) as pool:
+            results=pool.map(lambda c:_fetch_matrix_chunk(origins[c[0]],destinations[c[1]]),chunks)
+            for (o,d),(chunk_dist,chunk_duration) in zip(chunks,results):
+                dist[o,d]=np.where(missing[o,d],chunk_dist,dist[o,d])
+                duration[o,d]=np.where(missing[o,d],chunk_duration,duration[o,d])
+
+    for i,j in zip(*np.nonzero(missing&~np.isnan(dist))):
+        DISTANCE_CACHE.local.set(keys[i][j],(float(dist[i,j]),float(duration[i,j])))
+
+    failed=np.isnan(dist)
+    if failed.any():
+        logger.warning(f'No route for {int(failed.sum())} matrix pairs, using offline ETA estimates')
+        o=np.asarray(origins,dtype=float).reshape(-1,2)
+        d=np.asarray(destinations,dtype=float).reshape(-1,2)
+        est_dist,est_duration=estimate_dist_duration(o[:,None,0],o[:,None,1],d[None,:,0],d[None,:,1])
+        dist[failed]=est_dist[failed]
+        duration[failed]=est_duration[failed]
+    return dist,duration
+
+def _rate_card_arrays():
+    card=settings.FARE_RATE_CARD
+    types=list(card)
+    columns={
+        field:np.array([card[t][field] for t in types],dtype=float)[:,None]
+        for field in ('base_fare','per_km','per_min','min_fare')
+    }
+    return types,columns
+
+def estimate_amount(dist,dur,surge_mult=1.0,type_of=None):
+    """
+    Fare quotes for every vehicle type in one vectorized pass.
+
+    fare = max(base_fare + per_km * km + per_min * minutes, min_fare) * surge_mult,
+    with the rates taken from FARE_RATE_CARD.
+
+    Args:
+        dist: Trip distance in meters (scalar or array)
+        dur: Trip duration in seconds (scalar or array)
+        surge_mult: Surge multiplier (scalar or array matching dist)
+        type_of: Only return the quote for this vehicle type
+
+    Returns:
+        dict: vehicle type -> fare rounded to 2 decimals (float for scalar
+        input, array otherwise), or the single fare when type_of is given
+    """
+    scalar=np.ndim(dist)==0 and np.ndim(dur)==0 and np.ndim(surge_mult)==0
+    km=np.atleast_1d(np.asarray(dist,dtype=float))/1000.0
+    minutes=np.atleast_1d(np.asarray(dur,dtype=float))/60.0
+    surge=np.atleast_1d(np.asarray(surge_mult,dtype=float))
+
+    types,rates=_rate_card_arrays()
+    fares=rates['base_fare']+rates['per_km']*km+rates['per_min']*minutes
+    fares=np.round(np.maximum(fares,rates['min_fare'])*surge,2)
+
+    quotes={t:(float(row[0]) if scalar else row) for t,row in zip(types,fares)}
+    if type_of is not None:
+        return quotes[type_of]
+    return quotes
@@ -1,30 +1,154 @@
-from django.shortcuts import render
+import logging
+from django.conf import settings
 from rest_framework import status
 from base.utils import success_response,error_response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import api_view,permission_classes
 from servers.ride.models import Ride
 from django.db import transaction
-from .utils import estimate_amount
-# Create your views here.
+from .utils import estimate_amount,get_dist_duration
+from .surge import get_surge_multiplier,record_demand
+from .dispatch import enqueue_ride
+from servers.profiles import get_rider_profile
+
+logger=logging.getLogger(__name__)
+
+
+def _parse_trip(data):
+    """
+    Read and validate trip coordinates from request data.
+
+    Returns:
+        tuple: ((src_lat, src_lng, dest_lat, dest_lng), error_response or None)
+    """
+    try:
+        coords=tuple(float(data.get(key)) for key in ('src_lat','src_lng','dest_lat','dest_lng'))
+    except (TypeError,ValueError):
+        return None,error_response(
+            code='MISSING_FIELDS',
+            message='Source and destination coordinates are required',
+            field='coordinates',
+            issue='src_lat, src_lng, dest_lat and dest_lng must be numbers',
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    src_lat,src_lng,dest_lat,dest_lng=coords
+    if not (-90<=src_lat<=90 and -90<=dest_lat<=90 and -180<=src_lng<=180 and -180<=dest_lng<=180):
+        return None,error_response(
+            code='INVALID_COORDINATES',
+            message='Coordinates are out of range',
+            field='coordinates',
+            issue='Latitude must be within +-90 and longitude within +-180',
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    return coords,None
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def fare_estimate(request):
+    """
+    Quote a trip for every vehicle type.
+
+    Quotes are previews, so distance and duration come from the offline
+    ETA model rather than the distance API; ride_request prices the trip
+    it books against the road route.
+
+    Expected request data:
+    {
+        "src_lat": float,
+        "src_lng": float,
+        "dest_lat": float,
+        "dest_lng": float
+    }
+    """
+    try:
+        coords,error=_parse_trip(request.data)
+        if error:
+            return error
+        dist,duration=get_dist_duration(*coords,fast=True)
+        surge_mult=get_surge_multiplier(coords[0],coords[1])
+        quotes=estimate_amount(dist,duration,surge_mult=surge_mult)
+        return success_response(
+            {'distance':dist,'duration':duration,'surge_mult':surge_mult,'quotes':quotes},
+            status.HTTP_200_OK
+        )
+    except Exception as e:
+        logger.error(f"Unexpected error estimating fare: {str(e)}")
+        return error_response(
+            code='INTERNAL_ERROR',
+            message='An unexpected error occurred',
+            field='general',
+            issue=str(e),
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def ride_request(request):
-    src_lat: float=request.data.get('src_lat')
-    src_lng:float=request.data.get('src_lng')
-    dest_lat:float=request.data.get('dest_lat')
-    dest_lng:float=request.data.get('dest_lng')
-    is_shared=request.data.get('is_shared',False)
-    # implemented from here
-    if not (src_lat or src_lng):
-        return error_response()
-    if not (dest_lat or dest_lng):
-        return error_response()
-    estimated_amount=get_estimated_amount()
+    """
+    Request a ride.
+
+    Expected request data:
+    {
+        "src_lat": float,
+        "src_lng": float,
+        "dest_lat": float,
+        "dest_lng": float,
+        "vehicle_type": str (bike, car or auto),
+        "is_shared": bool (optional, default: false)
+    }
+    """
     try:
+        coords,error=_parse_trip(request.data)
+        if error:
+            return error
+        src_lat,src_lng,dest_lat,dest_lng=coords
+        vehicle_type=request.data.get('vehicle_type')
+        is_shared=request.data.get('is_shared',False)
+        if vehicle_type not in settings.FARE_RATE_CARD:
+            return error_response(
+                code='INVALID_VEHICLE_TYPE',
+                message=f'vehicle_type must be one of {list(settings.FARE_RATE_CARD)}',
+                field='vehicle_type',
+                issue='Unknown vehicle type',
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        record_demand(src_lat,src_lng)
+        dist,duration=get_dist_duration(src_lat,src_lng,dest_lat,dest_lng)
+        surge_mult=get_surge_multiplier(src_lat,src_lng)
+        estimated_amount=estimate_amount(dist,duration,surge_mult=surge_mult,type_of=vehicle_type)
+
         with transaction.atomic():
-            ride_obj=Ride.objects.create(src_lat=src_lat,src_lng=src_lng,dest_lat=dest_lat,dest_lng=dest_lng,estimated_amount=estimated_amount,is_shared=is_shared,rider_id=request.user.rider)
-            pass
+            ride_obj=Ride.objects.create(
+                src_lat=src_lat,src_lng=src_lng,dest_lat=dest_lat,dest_lng=dest_lng,
+                estimated_amount=estimated_amount,surge_mult=surge_mult,is_shared=is_shared,
+                vehicle_type=vehicle_type
+            )
+            ride_obj.rider_id.add(get_rider_profile(request.user).id)
+            # Queue only once the ride is committed so dispatch can see it
+            transaction.on_commit(lambda:enqueue_ride(ride_obj))
+
+        return success_response(
+            {'ride_id':str(ride_obj.id),'status':ride_obj.status,'estimated_amount':estimated_amount,'distance':dist,'duration':duration},
+            status.HTTP_201_CREATED
+        )
+    except AttributeError as e:
+        logger.error(f"Rider profile error: {str(e)}")
+        return error_response(
+            code='PROFILE_ERROR',
+            message='Rider profile not found',
+            field='user',
+            issue='User does not have a rider profile',
+            status=status.HTTP_400_BAD_REQUEST
+        )
     except Exception as e:
-        pass
-    
\ No newline at end of file
+        logger.error(f"Unexpected error creating ride request: {str(e)}")
+        return error_response(
+            code='INTERNAL_ERROR',
+            message='An unexpected error occurred',
+            field='general',
+            issue=str(e),
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
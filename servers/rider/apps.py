@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class RiderConfig(AppConfig):
     name = 'servers.rider'
+
+    def ready(self):
+        from . import favorites
+        favorites.connect()
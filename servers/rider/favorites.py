@@ -0,0 +1,115 @@
+import time
+import logging
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from base.cache import TwoTierCache
+from base.renderers import dumps
+from .models import FavoriteLocation
+from .serializers import FavoriteLocationSerializer
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'favorites:version:{rider_id}'
+
+# Serialized favorite lists keyed by "<rider id>:<version>"; a new version
+# means a new key, so entries never need invalidating
+FAVORITES = TwoTierCache(
+    'favorites',
+    maxsize=settings.FAVORITES_CACHE_LOCAL_SIZE,
+    local_ttl=settings.FAVORITES_CACHE_LOCAL_TTL,
+    remote_ttl=settings.FAVORITES_CACHE_TTL,
+)
+
+
+def _initial_version():
+    # Starting from the clock keeps versions (and ETags) unique even after
+    # the version key has been evicted or the cache flushed
+    return int(time.time() * 1000)
+
+
+def get_favorites_version(rider_id):
+    """
+    Returns:
+        int: Current version of a rider's favorite locations, or None if the
+        shared cache is unreachable
+    """
+    key = VERSION_KEY.format(rider_id=rider_id)
+    try:
+        version = cache.get(key)
+        if version is None:
+            cache.add(key, _initial_version(), settings.FAVORITES_CACHE_TTL)
+            version = cache.get(key)
+        return version
+    except Exception as e:
+        logger.warning(f"Could not read favorites version for rider {rider_id}: {str(e)}")
+        return None
+
+
+def bump_favorites_version(rider_id):
+    """
+    Move a rider's favorites to a new version, so cached lists and ETags
+    handed out so far are stale.
+    """
+    key = VERSION_KEY.format(rider_id=rider_id)
+    try:
+        try:
+            cache.incr(key)
+            cache.touch(key, settings.FAVORITES_CACHE_TTL)
+        except ValueError:
+            cache.set(key, _initial_version(), settings.FAVORITES_CACHE_TTL)
+    except Exception as e:
+        logger.error(f"Could not bump favorites version for rider {rider_id}: {str(e)}")
+
+
+def favorites_etag(rider_id, version):
+    return f'"{rider_id}-{version}"'
+
+
+def render_favorites(rider_id):
+    """
+    Query and serialize a rider's favorite locations.
+
+    Returns:
+        bytes: JSON-encoded list of locations
+    """
+    query_set = FavoriteLocation.objects.filter(rider_id=rider_id)
+    return dumps(FavoriteLocationSerializer(query_set, many=True).data)
+
+
+def get_favorites_json(rider_id, version):
+    """
+    Serialized favorite locations of a rider at a version, read through the
+    favorites cache.
+
+    Args:
+        rider_id: Rider id
+        version: Version from get_favorites_version, or None to skip the cache
+
+    Returns:
+        bytes: JSON-encoded list of locations
+    """
+    if version is None:
+        return render_favorites(rider_id)
+    key = f'{rider_id}:{version}'
+    data = FAVORITES.get(key)
+    if data is None:
+        data = render_favorites(rider_id)
+        FAVORITES.set(key, data)
+    return data
+
+
+def _bump_on_change(sender, instance, **kwargs):
+    rider_id = instance.rider_id_id
+    # Bump once the change is visible, so a list cached under the new
+    # version can't miss it
+    transaction.on_commit(lambda: bump_favorites_version(rider_id))
+
+
+def connect():
+    """
+    Bump the favorites version whenever a favorite location is saved or deleted.
+    """
+    post_save.connect(_bump_on_change, sender=FavoriteLocation, dispatch_uid='favorites_saved')
+    post_delete.connect(_bump_on_change, sender=FavoriteLocation, dispatch_uid='favorites_deleted')
@@ -0,0 +1,98 @@
+import re
+import logging
+import redis
+from django.conf import settings
+from base.redis_metrics import register_key_prefixes
+from servers.redis_pool import get_redis_client, script_client
+
+logger = logging.getLogger(__name__)
+
+# Per rider app session: member -> handle, plus "#" holding the last handle
+HANDLES_KEY = 'nearby:handles:{user_id}:{session}'
+
+register_key_prefixes('nearby:handles')
+
+# Session ids are chosen by the client (X-Handle-Session header)
+SESSION_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+# ARGV: ttl, max handles, then members. Returns the reset flag followed by
+# one handle per member, negated when it was assigned by this call. A
+# session whose new members would take it past the limit starts over from
+# handle 1.
+_ASSIGN_HANDLES_LUA = """
+local last = tonumber(redis.call('HGET', KEYS[1], '#') or '0')
+local handles = redis.call('HMGET', KEYS[1], unpack(ARGV, 3))
+local missing = 0
+for i = 1, #handles do
+    if not handles[i] then missing = missing + 1 end
+end
+local reset = 0
+if last + missing > tonumber(ARGV[2]) then
+    redis.call('DEL', KEYS[1])
+    last, reset = 0, 1
+    for i = 1, #handles do handles[i] = false end
+end
+local out = {reset}
+for i = 1, #handles do
+    if handles[i] then
+        out[i + 1] = tonumber(handles[i])
+    else
+        last = last + 1
+        redis.call('HSET', KEYS[1], ARGV[i + 2], last)
+        out[i + 1] = -last
+    end
+end
+redis.call('HSET', KEYS[1], '#', last)
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return out
+"""
+
+_assign_handles_script = script_client().register_script(_ASSIGN_HANDLES_LUA)
+
+
+def _fresh_handles(members):
+    # Sessions only hand out positive handles, so these never overwrite
+    # handles the client still holds from its session
+    return False, list(range(-1, -len(members) - 1, -1)), [True] * len(members)
+
+
+def assign_handles(user_id, session, members):
+    """
+    Map driver members to short integer handles that stay stable for the
+    rest of a client session, so repeat results only send the handle.
+
+    Without a valid session id, or when Redis is unavailable, every member
+    is sent in full under handles -1..-n that are valid for this response
+    alone; the session, if any, is left as it was. Empty results never
+    touch the session.
+
+    Args:
+        user_id: Requesting user's id, scoping the session
+        session: Client-chosen session id, or None
+        members: Driver members in result order
+
+    Returns:
+        tuple: (reset, handles, new) where reset tells the client to forget
+        earlier handles and new flags the handles first sent in this response
+    """
+    if not members or not session or not SESSION_PATTERN.match(session):
+        return _fresh_handles(members)
+
+    client = get_redis_client()
+    if client is None:
+        logger.warning("Redis client not available for nearby handles")
+        return _fresh_handles(members)
+
+    try:
+        reply = _assign_handles_script(
+            keys=[HANDLES_KEY.format(user_id=user_id, session=session)],
+            args=[settings.NEARBY_HANDLE_TTL, settings.NEARBY_HANDLE_MAX, *members],
+            client=client,
+        )
+    except redis.RedisError as e:
+        logger.error(f"Redis error while assigning nearby handles: {str(e)}")
+        return _fresh_handles(members)
+
+    handles = [abs(int(handle)) for handle in reply[1:]]
+    new = [int(handle) < 0 for handle in reply[1:]]
+    return bool(reply[0]), handles, new
@@ -0,0 +1,230 @@
+import json
+import asyncio
+import logging
+from django.conf import settings
+from base.websocket import CLOSE_UNAUTHORIZED, authenticate
+from servers.geo import geohash_bbox, geohash_encode, haversine
+from servers.redis import GEO_LAT_LIMIT
+from servers.redis_async import anearby_drivers
+
+logger = logging.getLogger(__name__)
+
+# Messages a subscriber may fall behind by before it is resynced
+SUBSCRIBER_QUEUE_SIZE = 16
+
+
+def _encode(message):
+    return json.dumps(message, separators=(',', ':'))
+
+
+class _Subscriber:
+    """
+    One websocket's outbound queue and current feed key.
+    """
+
+    def __init__(self):
+        self.key = None
+        self.queue = asyncio.Queue(SUBSCRIBER_QUEUE_SIZE)
+
+    def push(self, text, snapshot):
+        try:
+            self.queue.put_nowait(text)
+        except asyncio.QueueFull:
+            # Too slow for diffs: start over from the current state
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(snapshot())
+
+
+class NearbyFeed:
+    """
+    Shared nearby-driver feed, keyed by (geohash cell, radius bucket).
+
+    Every tick each key with subscribers is computed once: one
+    anearby_drivers query centred on the cell, diffed against the previous
+    tick into entered/moved/left. The encoded diff is queued for every
+    subscriber of that key, so the cost per tick grows with the number of
+    watched cells, not with the number of riders.
+
+    Args:
+        precision: Geohash length of the feed cells
+        radii: Sorted radius buckets in meters
+        tick: Seconds between diffs
+        count: Maximum drivers tracked per key
+    """
+
+    def __init__(self, precision, radii, tick, count):
+        self.precision = precision
+        self.radii = radii
+        self.tick = tick
+        self.count = count
+        self._subscribers = {}
+        self._state = {}
+        self._task = None
+
+    def key_for(self, lng, lat, radius):
+        bucket = next((r for r in self.radii if r >= radius), self.radii[-1])
+        return geohash_encode(lng, lat, self.precision), bucket
+
+    def _snapshot(self, key):
+        drivers = self._state.get(key, {})
+        return _encode({
+            'type': 'snapshot',
+            'cell': key[0],
+            'radius': key[1],
+            'drivers': [[member, lng, lat] for member, (lng, lat) in drivers.items()],
+        })
+
+    def subscribe(self, subscriber, key):
+        self.unsubscribe(subscriber)
+        subscriber.key = key
+        self._subscribers.setdefault(key, set()).add(subscriber)
+        if key in self._state:
+            subscriber.push(self._snapshot(key), lambda: self._snapshot(key))
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def unsubscribe(self, subscriber):
+        subscribers = self._subscribers.get(subscriber.key)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[subscriber.key]
+                self._state.pop(subscriber.key, None)
+        subscriber.key = None
+
+    async def _compute(self, key):
+        cell, radius = key
+        min_lng, min_lat, max_lng, max_lat = geohash_bbox(cell)
+        lng, lat = (min_lng + max_lng) / 2, (min_lat + max_lat) / 2
+        half_diagonal = float(haversine(min_lng, min_lat, lng, lat))
+        drivers = await anearby_drivers(
+            lng, lat,
+            radius=radius + half_diagonal,
+            count=self.count,
+            max_age=settings.NEARBY_DRIVERS_MAX_AGE or None,
+        )
+        if drivers is None:
+            return None
+        return {member: (round(coords[0], 6), round(coords[1], 6)) for member, _, coords in drivers}
+
+    def _diff(self, key, current):
+        previous = self._state.get(key)
+        self._state[key] = current
+        if previous is None:
+            return self._snapshot(key)
+        entered, moved = [], []
+        for member, position in current.items():
+            before = previous.get(member)
+            if before is None:
+                entered.append([member, *position])
+            elif before != position:
+                moved.append([member, *position])
+        left = [member for member in previous if member not in current]
+        if not (entered or moved or left):
+            return None
+        return _encode({
+            'type': 'diff',
+            'cell': key[0],
+            'radius': key[1],
+            'entered': entered,
+            'moved': moved,
+            'left': left,
+        })
+
+    async def _run(self):
+        while self._subscribers:
+            started = asyncio.get_running_loop().time()
+            keys = list(self._subscribers)
+            results = await asyncio.gather(
+                *(self._compute(key) for key in keys),
+                return_exceptions=True,
+            )
+            for key, current in zip(keys, results):
+                subscribers = self._subscribers.get(key)
+                if not subscribers:
+                    continue
+                if current is None or isinstance(current, BaseException):
+                    logger.warning(f"Nearby feed update failed for {key[0]}: {current}")
+                    continue
+                text = self._diff(key, current)
+                if text is not None:
+                    for subscriber in subscribers:
+                        subscriber.push(text, lambda key=key: self._snapshot(key))
+            elapsed = asyncio.get_running_loop().time() - started
+            await asyncio.sleep(max(self.tick - elapsed, 0))
+
+
+_feed = None
+
+
+def get_feed():
+    global _feed
+    if _feed is None:
+        _feed = NearbyFeed(
+            precision=settings.NEARBY_FEED_PRECISION,
+            radii=sorted(settings.NEARBY_FEED_RADII),
+            tick=settings.NEARBY_FEED_TICK,
+            count=settings.NEARBY_FEED_MAX_DRIVERS,
+        )
+    return _feed
+
+
+def _parse_subscription(frame):
+    """
+    Read a {"lng", "lat", "radius"?} viewport frame.
+
+    Returns:
+        tuple: ((lng, lat, radius), error message or None)
+    """
+    try:
+        data = json.loads(frame)
+        lng, lat = float(data['lng']), float(data['lat'])
+        radius = float(data.get('radius', 1000))
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return None, "Subscription must be {\"lng\": float, \"lat\": float, \"radius\": float}"
+    if not (-180 <= lng <= 180 and -GEO_LAT_LIMIT <= lat <= GEO_LAT_LIMIT):
+        return None, "Coordinates are out of range"
+    if radius <= 0:
+        return None, "radius must be greater than 0"
+    return (lng, lat, radius), None
+
+
+async def nearby_driver_feed(ws):
+    """
+    Push nearby-driver updates to a rider's map.
+
+    After connecting, the client sends its viewport as {"lng", "lat",
+    "radius"} and again whenever it moves. The server replies with a
+    "snapshot" of drivers around the viewport's feed cell, then a "diff"
+    with entered, moved and left drivers on every tick that changes
+    something. Drivers are [member, lng, lat]; clients trim to their exact
+    viewport.
+    """
+    user = await authenticate(ws)
+    await ws.accept()
+    if user is None:
+        await ws.close(CLOSE_UNAUTHORIZED)
+        return
+
+    feed = get_feed()
+    subscriber = _Subscriber()
+
+    async def writer():
+        while True:
+            await ws.send_text(await subscriber.queue.get())
+
+    sending = asyncio.get_running_loop().create_task(writer())
+    try:
+        async for frame in ws:
+            viewport, error = _parse_subscription(frame)
+            if error is not None:
+                # Replies go through the queue so only the writer sends
+                await subscriber.queue.put(_encode({'error': error}))
+                continue
+            key = feed.key_for(*viewport)
+            if key != subscriber.key:
+                feed.subscribe(subscriber, key)
+    finally:
+        feed.unsubscribe(subscriber)
+        sending.cancel()
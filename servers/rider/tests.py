@@ -1,3 +1,260 @@
-from django.test import TestCase
+import struct
+import uuid
+from unittest import mock
+import numpy as np
+import redis
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.test import APIClient
+from base.renderers import (
+    COORD_SCALE, DIST_SCALE, GEO_COLUMNS_MAGIC, GEO_COLUMNS_MAX_COUNT, GEO_COLUMNS_MAX_MEMBER,
+    GEO_COLUMNS_MEDIA_TYPE, GEO_COLUMNS_RESET, GEO_COLUMNS_VERSION, pack_geo_columns,
+)
+from base.testing import RedisTestMixin
+from servers import redis as geo_store
+from servers.geo import geohash_bbox, geohash_encode
+from servers.nearby_cache import _results, cached_nearby_drivers
+from servers.redis_pool import get_redis_client
+from .favorites import VERSION_KEY
+from .handles import HANDLES_KEY
+from .models import Rider
 
-# Create your tests here.
+User = get_user_model()
+
+
+def _make_rider():
+    user = User.objects.create(
+        username=f'test-{uuid.uuid4().hex[:12]}', phone=f'+1{uuid.uuid4().int % 10 ** 10:010d}', role='rider'
+    )
+    return Rider.objects.create(user_id=user)
+
+
+class FavoriteLocationsETagTests(RedisTestMixin, TestCase):
+
+    def setUp(self):
+        self.rider = _make_rider()
+        self.client = APIClient()
+        self.client.force_authenticate(self.rider.user_id)
+
+    def tearDown(self):
+        cache.delete(VERSION_KEY.format(rider_id=self.rider.id))
+
+    def _list(self, etag=None):
+        headers = {} if etag is None else {'HTTP_IF_NONE_MATCH': etag}
+        return self.client.get('/api/v1/rider/locations/all/', **headers)
+
+    def test_matching_etag_gets_not_modified(self):
+        response = self._list()
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertTrue(etag)
+
+        cached = self._list(etag)
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached['ETag'], etag)
+        self.assertEqual(cached.content, b'')
+        self.assertEqual(self._list(f'W/{etag}').status_code, 304)
+        self.assertEqual(self._list('"other"').status_code, 200)
+
+    def test_saving_favorite_changes_etag(self):
+        etag = self._list()['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                '/api/v1/rider/locations/',
+                {'label': 'Home', 'address': 'MG Road', 'lat': 12.97, 'lng': 77.6},
+                format='json',
+            )
+        self.assertEqual(response.status_code, 201)
+
+        response = self._list(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual([location['label'] for location in response.json()['data']], ['Home'])
+
+
+def _unpack_geo_columns(payload):
+    magic, version, flags, count = struct.unpack_from('<4sBBH', payload)
+    columns = np.frombuffer(payload, dtype='<i4', count=4 * count, offset=8).reshape(4, count)
+    offset = 8 + columns.nbytes
+    (fresh,) = struct.unpack_from('<H', payload, offset)
+    offset += 2
+    members = {}
+    for _ in range(fresh):
+        handle, length = struct.unpack_from('<iB', payload, offset)
+        offset += 5
+        members[handle] = payload[offset:offset + length].decode()
+        offset += length
+    return {
+        'magic': magic, 'version': version, 'reset': bool(flags & GEO_COLUMNS_RESET),
+        'handles': columns[0].tolist(),
+        'coords': list(zip(columns[1] / COORD_SCALE, columns[2] / COORD_SCALE)),
+        'dist': (columns[3] / DIST_SCALE).tolist(),
+        'members': members, 'size': offset,
+    }
+
+
+class GeoColumnsTests(SimpleTestCase):
+
+    drivers = [
+        ['driver:a', 12.34, (77.594566, 12.971599)],
+        ['driver:b', 980.5, (-0.127758, -51.507351)],
+    ]
+
+    def test_round_trip(self):
+        payload = pack_geo_columns(self.drivers, [7, 9], [True, False], True)
+        columns = _unpack_geo_columns(payload)
+
+        self.assertEqual(columns['magic'], GEO_COLUMNS_MAGIC)
+        self.assertEqual(columns['version'], GEO_COLUMNS_VERSION)
+        self.assertTrue(columns['reset'])
+        self.assertEqual(columns['handles'], [7, 9])
+        for (_, distance, (lng, lat)), coords, dist in zip(self.drivers, columns['coords'], columns['dist']):
+            self.assertAlmostEqual(coords[0], lng, places=6)
+            self.assertAlmostEqual(coords[1], lat, places=6)
+            self.assertAlmostEqual(dist, distance, places=1)
+        self.assertEqual(columns['members'], {7: 'driver:a'})
+        self.assertEqual(columns['size'], len(payload))
+
+    def test_empty_result(self):
+        columns = _unpack_geo_columns(pack_geo_columns([], [], [], False))
+        self.assertEqual((columns['handles'], columns['members'], columns['size']), ([], {}, 10))
+        self.assertFalse(columns['reset'])
+
+    def test_rejects_what_the_layout_cannot_carry(self):
+        long_member = [['d' * (GEO_COLUMNS_MAX_MEMBER + 1), 1.0, (0.0, 0.0)]]
+        with self.assertRaises(ValueError):
+            pack_geo_columns(long_member, [1], [True], False)
+        pack_geo_columns(long_member, [1], [False], False)
+
+        too_many = [['driver:a', 1.0, (0.0, 0.0)]] * (GEO_COLUMNS_MAX_COUNT + 1)
+        with self.assertRaises(ValueError):
+            pack_geo_columns(too_many, [1] * len(too_many), [False] * len(too_many), False)
+
+
+class NearbyColumnsViewTests(RedisTestMixin, TestCase):
+
+    def setUp(self):
+        self.rider = _make_rider()
+        self.client = APIClient()
+        self.client.force_authenticate(self.rider.user_id)
+        self.driver_id = str(uuid.uuid4())
+        self.point = (22.0 + uuid.uuid4().int % 1000 / 1000, 11.0)
+        geo_store.add_driver_location(self.driver_id, *self.point)
+
+    def tearDown(self):
+        geo_store.remove_driver(self.driver_id)
+        get_redis_client().delete(HANDLES_KEY.format(user_id=self.rider.user_id.pk, session='tests'))
+
+    def _nearby(self, lng=None, session='tests'):
+        headers = {'HTTP_ACCEPT': GEO_COLUMNS_MEDIA_TYPE}
+        if session is not None:
+            headers['HTTP_X_HANDLE_SESSION'] = session
+        return self.client.get(
+            '/api/v1/rider/nearby/', {'lng': lng or self.point[0], 'lat': self.point[1], 'radius': 100}, **headers
+        )
+
+    def _resolve(self, table, response):
+        # What a client keeping a handle table across responses would decode
+        columns = _unpack_geo_columns(response.content)
+        if columns['reset']:
+            table.clear()
+        table.update(columns['members'])
+        return [table.get(handle) for handle in columns['handles']]
+
+    def test_members_are_sent_once_per_session(self):
+        response = self._nearby()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], GEO_COLUMNS_MEDIA_TYPE)
+        first = _unpack_geo_columns(response.content)
+        self.assertEqual(list(first['members'].values()), [f'driver:{self.driver_id}'])
+        self.assertAlmostEqual(first['coords'][0][0], self.point[0], places=5)
+
+        second = _unpack_geo_columns(self._nearby().content)
+        self.assertEqual(second['handles'], first['handles'])
+        self.assertEqual(second['members'], {})
+        self.assertFalse(second['reset'])
+
+    def test_empty_result_keeps_session(self):
+        table, member = {}, f'driver:{self.driver_id}'
+        self.assertEqual(self._resolve(table, self._nearby()), [member])
+        empty = _unpack_geo_columns(self._nearby(lng=self.point[0] + 1).content)
+        self.assertEqual((empty['handles'], empty['reset']), ([], False))
+
+        self.assertEqual(self._resolve(table, self._nearby()), [member])
+        self.assertEqual(self._resolve(table, self._nearby()), [member])
+
+    def test_fallback_handles_leave_session_handles_intact(self):
+        table, member = {}, f'driver:{self.driver_id}'
+        self.assertEqual(self._resolve(table, self._nearby()), [member])
+
+        for fallback in (
+            lambda: self._nearby(session=None),
+            lambda: self._nearby(session='not a session'),
+        ):
+            columns = _unpack_geo_columns(fallback().content)
+            self.assertFalse(columns['reset'])
+            self.assertTrue(all(handle < 0 for handle in columns['handles']))
+            self.assertEqual(self._resolve(table, fallback()), [member])
+        with mock.patch('servers.rider.handles._assign_handles_script', side_effect=redis.RedisError):
+            self.assertEqual(self._resolve(table, self._nearby()), [member])
+
+        self.assertEqual(self._resolve(table, self._nearby()), [member])
+
+
+class NearbyCacheTests(RedisTestMixin, SimpleTestCase):
+
+    def setUp(self):
+        _results.clear()
+        # Centre of a cache cell, so small offsets stay inside it
+        cell = geohash_encode(26.0 + uuid.uuid4().int % 1000 / 1000, 11.0, settings.NEARBY_CACHE_PRECISION)
+        min_lng, min_lat, max_lng, max_lat = geohash_bbox(cell)
+        self.point = ((min_lng + max_lng) / 2, (min_lat + max_lat) / 2)
+        self.driver_ids = []
+
+    def tearDown(self):
+        _results.clear()
+        for driver_id in self.driver_ids:
+            geo_store.remove_driver(driver_id)
+
+    def _driver(self, lng_offset):
+        driver_id = str(uuid.uuid4())
+        self.driver_ids.append(driver_id)
+        geo_store.add_driver_location(driver_id, self.point[0] + lng_offset, self.point[1])
+        return f'driver:{driver_id}'
+
+    def _search(self):
+        return mock.patch('servers.nearby_cache.nearby_drivers', wraps=geo_store.nearby_drivers)
+
+    def test_neighbours_share_one_search(self):
+        for offset in (0.0009, 0.0003, 0.0006):
+            self._driver(offset)
+        lng, lat = self.point
+        with self._search() as search:
+            cached_nearby_drivers(lng, lat, radius=500, count=3)
+            neighbour = cached_nearby_drivers(lng + 0.0002, lat, radius=500, count=3)
+        self.assertEqual(search.call_count, 1)
+
+        direct = geo_store.nearby_drivers(lng + 0.0002, lat, radius=500, count=3)
+        self.assertEqual([m for m, *_ in neighbour], [m for m, *_ in direct])
+        for (_, dist, _), (_, expected, _) in zip(neighbour, direct):
+            self.assertAlmostEqual(dist, expected, delta=0.5)
+
+    @override_settings(NEARBY_CACHE_COUNTS=[1], NEARBY_CACHE_OVERFETCH=1)
+    def test_truncated_result_falls_back_to_redis(self):
+        self._driver(0.0005)
+        west = self._driver(-0.0008)
+        with self._search() as search:
+            drivers = cached_nearby_drivers(self.point[0] - 0.0006, self.point[1], radius=500, count=1)
+        self.assertEqual([m for m, *_ in drivers], [west])
+        self.assertEqual(search.call_count, 2)
+
+    def test_requests_beyond_buckets_skip_the_cache(self):
+        member = self._driver(0.0003)
+        radius = max(settings.NEARBY_CACHE_RADII) + 1
+        with self._search() as search:
+            drivers = cached_nearby_drivers(*self.point, radius=radius, count=3)
+        self.assertEqual([m for m, *_ in drivers], [member])
+        self.assertEqual(search.call_args.kwargs['radius'], radius)
+        self.assertEqual(_results.stats()['size'], 0)
@@ -1,12 +1,20 @@
 import copy
 import logging
+from django.conf import settings
 from rest_framework import status
-from base.utils import success_response, error_response
-from rest_framework.decorators import api_view, permission_classes
+from django.http import HttpResponseNotModified
+from django.utils.http import parse_etags
+from base.renderers import FastJSONRenderer, GeoColumnsRenderer, compact_geo, pack_geo_columns
+from base.utils import success_response, error_response, fast_success_response, raw_success_response
+from rest_framework.decorators import api_view, permission_classes, renderer_classes
+from rest_framework.response import Response
 from .serializers import FavoriteLocationSerializer
 from rest_framework.permissions import IsAuthenticated
-from .models import FavoriteLocation
-from ..redis import nearby_drivers
+from .favorites import favorites_etag, get_favorites_json, get_favorites_version
+from .handles import assign_handles
+from ..nearby_cache import cached_nearby_drivers
+from ..redis import _check_nearby_args
+from ..profiles import get_rider_profile
 
 logger = logging.getLogger(__name__)
 
@@ -15,7 +23,9 @@ logger = logging.getLogger(__name__)
 @permission_classes([IsAuthenticated])
 def save_favorite_locations(request):
     """
-    Save a favorite location for the rider.
+    Save a favorite location for the rider. Saving bumps the rider's
+    favorites version (see servers.rider.favorites), so cached lists and
+    ETags go stale.
     
     Expected request data:
     {
@@ -27,7 +37,7 @@ def save_favorite_locations(request):
     """
     try:
         data = copy.copy(request.data)
-        data['rider_id'] = request.user.rider.id
+        data['rider_id'] = get_rider_profile(request.user).id
         instance = FavoriteLocationSerializer(data=data)
         
         if instance.is_valid():
@@ -67,14 +77,30 @@ def save_favorite_locations(request):
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@renderer_classes([FastJSONRenderer])
 def get_favorite_locations(request):
     """
     Retrieve all favorite locations for the authenticated rider.
+    
+    The list is served pre-serialized from the favorites cache with an ETag;
+    a matching If-None-Match gets 304 Not Modified without touching the
+    database.
     """
     try:
-        query_set = FavoriteLocation.objects.filter(rider_id=request.user.rider.id)
-        data = FavoriteLocationSerializer(query_set, many=True)
-        return success_response(data.data, status.HTTP_200_OK)
+        rider_id = get_rider_profile(request.user).id
+        version = get_favorites_version(rider_id)
+        if version is None:
+            return raw_success_response(get_favorites_json(rider_id, None), status.HTTP_200_OK)
+
+        etag = favorites_etag(rider_id, version)
+        headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+        if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+        if etag in if_none_match or f'W/{etag}' in if_none_match or '*' in if_none_match:
+            response = HttpResponseNotModified()
+            for header, value in headers.items():
+                response[header] = value
+            return response
+        return raw_success_response(get_favorites_json(rider_id, version), status.HTTP_200_OK, headers)
     except AttributeError as e:
         logger.error(f"Rider profile error: {str(e)}")
         return error_response(
@@ -97,6 +123,7 @@ def get_favorite_locations(request):
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@renderer_classes([FastJSONRenderer, GeoColumnsRenderer])
 def get_nearby_drivers(request):
     """
     Get nearby drivers for the rider.
@@ -106,6 +133,18 @@ def get_nearby_drivers(request):
     - lat: Latitude (float)
     - radius: Search radius in meters (int, optional, default: 1000)
     - count: Maximum number of results (int, optional, default: 10)
+    - max_age: Only drivers seen within this many seconds (int, optional,
+      default: NEARBY_DRIVERS_MAX_AGE, 0 disables the filter)
+    - compact: 1 to return {"ids": [...], "dist": [...], "coords": [lng, lat, ...]}
+      instead of [id, dist, [lng, lat]] triples (optional)
+    
+    Requests accepting application/vnd.vahango.nearby-columns get the
+    binary columnar format of base.renderers.pack_geo_columns instead.
+    Driver ids are replaced by integer handles that stay stable across
+    requests sending the same X-Handle-Session header (up to 64 letters,
+    digits, "-" or "_"); each id is sent once per session, with its first
+    handle. Negative handles are only valid within the response carrying
+    them.
     """
     try:
         # Get parameters from query_params for GET request
@@ -113,6 +152,7 @@ def get_nearby_drivers(request):
         lat = request.query_params.get('lat')
         radius = request.query_params.get('radius', 1000)
         count = request.query_params.get('count', 10)
+        max_age = request.query_params.get('max_age', settings.NEARBY_DRIVERS_MAX_AGE)
         
         # Validate required fields
         if lng is None or lat is None:
@@ -131,18 +171,31 @@ def get_nearby_drivers(request):
             lat = float(lat)
             radius = int(radius)
             count = int(count)
+            max_age = int(max_age) or None
         except (ValueError, TypeError) as e:
             logger.warning(f"Invalid parameter types: {str(e)}")
             return error_response(
                 code='INVALID_TYPE',
                 message='Invalid parameter types',
                 field='coordinates',
-                issue='lng and lat must be floats, radius and count must be integers',
+                issue='lng and lat must be floats, radius, count and max_age must be integers',
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            _check_nearby_args(lng, lat, radius, count, max_age)
+        except ValueError as e:
+            logger.warning(f"Invalid nearby drivers parameters: {str(e)}")
+            return error_response(
+                code='INVALID_RANGE',
+                message='Invalid parameter values',
+                field='coordinates',
+                issue=str(e),
                 status=status.HTTP_400_BAD_REQUEST
             )
         
         # Call Redis function
-        drivers = nearby_drivers(lng=lng, lat=lat, radius=radius, count=count)
+        drivers = cached_nearby_drivers(lng=lng, lat=lat, radius=radius, count=count, max_age=max_age)
         
         if drivers is None:
             logger.error("Redis operation failed for nearby drivers")
@@ -154,7 +207,14 @@ def get_nearby_drivers(request):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
         
-        return success_response(drivers, status.HTTP_200_OK)
+        headers = {'Vary': 'Accept, X-Handle-Session'}
+        if request.accepted_renderer.format == GeoColumnsRenderer.format:
+            members = [member for member, *_ in drivers]
+            reset, handles, new = assign_handles(request.user.id, request.headers.get('X-Handle-Session'), members)
+            return Response(pack_geo_columns(drivers, handles, new, reset), status.HTTP_200_OK, headers=headers)
+        if request.query_params.get('compact') == '1':
+            return fast_success_response(compact_geo(drivers), status.HTTP_200_OK, headers)
+        return fast_success_response(drivers, status.HTTP_200_OK, headers)
     
     except Exception as e:
         logger.error(f"Unexpected error getting nearby drivers: {str(e)}")
@@ -0,0 +1,81 @@
+from unittest import mock
+import redis
+from django.test import SimpleTestCase, override_settings
+from servers import redis_pool
+from servers.redis_pool import CircuitBreaker, _BreakerConnection
+
+
+class CircuitBreakerTests(SimpleTestCase):
+
+    def setUp(self):
+        self.now = 100.0
+        patcher = mock.patch('servers.redis_pool.time.monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker(threshold=3, backoff=1, max_backoff=3)
+
+    def _fail(self, times=1):
+        for _ in range(times):
+            self.breaker.record_failure()
+
+    def test_opens_after_threshold_failures(self):
+        self._fail(2)
+        self.assertTrue(self.breaker.allow())
+        self._fail()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.opened, 1)
+
+    def test_success_resets_failure_count(self):
+        self._fail(2)
+        self.breaker.record_success()
+        self._fail(2)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_single_probe_after_backoff(self):
+        self._fail(3)
+        self.now += 1
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertFalse(self.breaker.allow())
+
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(self.breaker.allow())
+
+    def test_failed_probe_doubles_backoff_up_to_max(self):
+        self._fail(3)
+        self.now += 1
+        for backoff in (2, 3, 3):
+            self.assertTrue(self.breaker.allow())
+            self._fail()
+            self.now += backoff - 0.1
+            self.assertFalse(self.breaker.allow())
+            self.now += 0.1
+        self.assertTrue(self.breaker.allow())
+
+    def test_open_breaker_hands_out_no_client(self):
+        self._fail(3)
+        with mock.patch.object(redis_pool, '_breaker', self.breaker):
+            self.assertIsNone(redis_pool.get_redis_client())
+            self.assertIsNone(redis_pool.get_async_redis_client())
+            self.assertIsNotNone(redis_pool.script_client())
+
+    def test_connection_failures_reach_the_breaker(self):
+        connection = _BreakerConnection(host='localhost', port=1, socket_connect_timeout=0.1)
+        with mock.patch.object(_BreakerConnection, 'breaker', self.breaker):
+            for _ in range(3):
+                with self.assertRaises(redis.ConnectionError):
+                    connection.connect()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+    @override_settings(METRICS_TOKEN='test-token')
+    def test_openings_are_exported_as_a_counter(self):
+        self._fail(3)
+        with mock.patch.object(redis_pool, '_breaker', self.breaker):
+            response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer test-token')
+        self.assertEqual(response.status_code, 200)
+        lines = response.content.decode().splitlines()
+        self.assertIn('# TYPE redis_breaker_opened_total counter', lines)
+        self.assertIn('redis_breaker_opened_total 1', lines)
+        self.assertIn('redis_breaker_state 2', lines)